@@ -0,0 +1,257 @@
+"""Portfolio analytics computed from daily candles.
+
+Closing prices for every holding and the benchmark index are aligned into a
+single dates x instruments matrix, and the risk metrics and the performance
+series are derived from it in one vectorised pass. Results go through the
+response cache until the end of the trading day, keyed by the portfolio
+composition, so repeated analytics polls are served from memory.
+
+The first computation of the day backfills candles for every holding, which
+takes a while for a large portfolio at Kite's historical rate limit. Callers
+can wait a bounded time for it; the computation carries on in the background
+and they get placeholder values marked ``pending`` in the meantime.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+import cache
+from candles import from_epoch, store as candle_store
+from instruments import master as instrument_master
+from portfolio import Holdings
+
+logger = logging.getLogger(__name__)
+
+BENCHMARK_SYMBOL = os.getenv("BENCHMARK_SYMBOL", "NSE:NIFTY 50")
+# Instrument token of NIFTY 50, used when the instrument master is not loaded
+BENCHMARK_TOKEN = int(os.getenv("BENCHMARK_TOKEN", "256265"))
+RISK_LOOKBACK_DAYS = int(os.getenv("RISK_LOOKBACK_DAYS", "365"))
+RISK_FREE_RATE = float(os.getenv("RISK_FREE_RATE", "0.065"))
+VAR_CONFIDENCE = float(os.getenv("VAR_CONFIDENCE", "0.95"))
+PERFORMANCE_DAYS = int(os.getenv("PERFORMANCE_DAYS", "30"))
+# Seconds a request waits for a first computation before answering ``pending``
+ANALYTICS_WAIT = float(os.getenv("ANALYTICS_WAIT", "5"))
+TRADING_DAYS = 252
+
+
+def benchmark_token() -> int:
+    return instrument_master.token(BENCHMARK_SYMBOL) or BENCHMARK_TOKEN
+
+
+def forward_fill(matrix: np.ndarray) -> np.ndarray:
+    """Carry the last valid value down each column"""
+    rows = np.arange(matrix.shape[0])[:, None]
+    index = np.where(np.isnan(matrix), 0, rows)
+    np.maximum.accumulate(index, axis=0, out=index)
+    return matrix[index, np.arange(matrix.shape[1])]
+
+
+async def price_matrix(kite, tokens: Sequence[int], start: date, end: date) -> Tuple[np.ndarray, np.ndarray]:
+    """Aligned daily closes for ``tokens`` on the benchmark's trading calendar
+
+    Returns ``(dates, closes)`` where ``dates`` holds epoch seconds and
+    ``closes`` has one column per token plus the benchmark as the last column.
+    Gaps are forward filled; values before an instrument's first candle are NaN.
+    """
+    all_tokens = list(tokens) + [benchmark_token()]
+    series = await asyncio.gather(*(candle_store.array(kite, token, start, end) for token in all_tokens))
+
+    calendar = series[-1]["ts"]
+    if not len(calendar):
+        calendar = np.unique(np.concatenate([s["ts"] for s in series]))
+
+    closes = np.full((len(calendar), len(all_tokens)), np.nan)
+    for column, candles in enumerate(series):
+        if not len(candles):
+            continue
+        position = np.clip(np.searchsorted(candles["ts"], calendar), 0, len(candles) - 1)
+        matched = candles["ts"][position] == calendar
+        closes[matched, column] = candles["close"][position[matched]]
+    return calendar, forward_fill(closes)
+
+
+def returns_matrix(closes: np.ndarray) -> np.ndarray:
+    """Simple daily returns; days without a price on either side count as flat"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = closes[1:] / closes[:-1] - 1.0
+    return np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def compute_risk(returns: np.ndarray, benchmark: np.ndarray, weights: np.ndarray,
+                 risk_free_rate: float = RISK_FREE_RATE,
+                 confidence: float = VAR_CONFIDENCE) -> Dict[str, Any]:
+    """Risk metrics for a weighted portfolio from a (days x instruments) returns matrix"""
+    observations = returns.shape[0]
+    if observations < 2 or not weights.size:
+        return {
+            "volatility": 0.0,
+            "beta": 0.0,
+            "alpha": 0.0,
+            "sharpeRatio": 0.0,
+            "informationRatio": 0.0,
+            "valueAtRisk": 0.0,
+            "conditionalValueAtRisk": 0.0,
+            "observations": int(observations),
+            "covariance": np.zeros((weights.size, weights.size)),
+        }
+
+    portfolio = returns @ weights
+    rf_daily = risk_free_rate / TRADING_DAYS
+    sqrt_days = np.sqrt(TRADING_DAYS)
+
+    covariance = np.cov(np.column_stack([returns, benchmark]), rowvar=False)
+    asset_cov = covariance[:-1, :-1]
+    benchmark_var = covariance[-1, -1]
+    portfolio_std = float(np.sqrt(weights @ asset_cov @ weights))
+    beta = float(weights @ covariance[:-1, -1] / benchmark_var) if benchmark_var > 0 else 0.0
+
+    excess = portfolio.mean() - rf_daily
+    alpha = (excess - beta * (benchmark.mean() - rf_daily)) * TRADING_DAYS
+    active = portfolio - benchmark
+    tracking_error = active.std(ddof=1)
+
+    var = -np.percentile(portfolio, (1 - confidence) * 100)
+    tail = portfolio[portfolio <= -var]
+    cvar = -tail.mean() if tail.size else var
+
+    return {
+        "volatility": portfolio_std * sqrt_days,
+        "beta": beta,
+        "alpha": float(alpha),
+        "sharpeRatio": float(excess / portfolio_std * sqrt_days) if portfolio_std > 0 else 0.0,
+        "informationRatio": float(active.mean() / tracking_error * sqrt_days) if tracking_error > 0 else 0.0,
+        "valueAtRisk": float(var),
+        "conditionalValueAtRisk": float(cvar),
+        "observations": int(observations),
+        "covariance": asset_cov * TRADING_DAYS,
+    }
+
+
+def _seconds_until_tomorrow() -> float:
+    now = datetime.now()
+    return (datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) - now).total_seconds()
+
+
+def _composition_key(prefix: str, held: Holdings) -> str:
+    order = np.argsort(held.instrument_token, kind="stable")
+    composition = np.stack([held.instrument_token[order], held.quantity[order]])
+    return f"{prefix}:{date.today().isoformat()}:{hashlib.sha1(composition.tobytes()).hexdigest()[:16]}"
+
+
+async def _daily(key: str, compute: Callable[[], Awaitable[Dict[str, Any]]],
+                 wait: Optional[float]) -> Optional[Dict[str, Any]]:
+    """Cached result of a once-a-day computation, or None if not ready within ``wait`` seconds"""
+    lookup = cache.default_cache.get_or_fetch(key, _seconds_until_tomorrow(), compute)
+    if wait is None:
+        return await lookup
+    try:
+        # Only this caller stops waiting; the shared computation finishes and is cached
+        return await asyncio.wait_for(lookup, wait)
+    except asyncio.TimeoutError:
+        return None
+
+
+async def risk_metrics(kite, held: Holdings, wait: Optional[float] = None) -> Dict[str, Any]:
+    """Portfolio risk metrics, computed at most once per trading day per composition
+
+    With ``wait``, zeros marked ``pending`` are returned if the computation
+    takes longer than that many seconds.
+    """
+    risk = await _daily(_composition_key("risk", held), lambda: _risk_metrics(kite, held), wait)
+    if risk is not None:
+        return risk
+    risk = compute_risk(np.empty((0, len(held))), np.empty(0), np.zeros(len(held)))
+    risk.update({
+        "valueAtRiskAmount": 0.0,
+        "conditionalValueAtRiskAmount": 0.0,
+        "covariance": {"symbols": held.tradingsymbol.tolist(), "matrix": []},
+        "pending": True,
+    })
+    return risk
+
+
+async def _risk_metrics(kite, held: Holdings) -> Dict[str, Any]:
+    today = date.today()
+    tokens = held.instrument_token.tolist()
+    _, closes = await price_matrix(kite, tokens, today - timedelta(days=RISK_LOOKBACK_DAYS), today)
+    returns = returns_matrix(closes)
+
+    values = held.value
+    total = values.sum()
+    weights = values / total if total > 0 else values
+
+    risk = compute_risk(returns[:, :-1], returns[:, -1], weights)
+    risk.update({
+        "valueAtRiskAmount": float(risk["valueAtRisk"] * total),
+        "conditionalValueAtRiskAmount": float(risk["conditionalValueAtRisk"] * total),
+        "covariance": {
+            "symbols": held.tradingsymbol.tolist(),
+            "matrix": risk["covariance"].tolist(),
+        },
+        "asOf": datetime.now().isoformat(timespec="seconds"),
+        "pending": False,
+    })
+    return risk
+
+
+async def performance_series(kite, held: Holdings, days: int = PERFORMANCE_DAYS,
+                             wait: Optional[float] = None) -> Dict[str, Any]:
+    """Daily mark-to-market value of the current holdings against the benchmark
+
+    The history up to yesterday is computed once per day; only today's point
+    is recomputed from live prices on each call. With ``wait``, a history not
+    ready in that many seconds is left out and the series marked ``pending``.
+    """
+    history = await _daily(
+        _composition_key(f"performance:{days}", held), lambda: _performance_history(kite, held, days), wait
+    )
+    pending = history is None
+    if pending:
+        history = {"dates": [], "portfolio": [], "benchmark": []}
+
+    dates = list(history["dates"])
+    portfolio = list(history["portfolio"])
+    benchmark = list(history["benchmark"])
+
+    # Today's point from live prices
+    try:
+        quote = await cache.fetch("ltp", kite.ltp, [BENCHMARK_SYMBOL], ttl=30)
+        benchmark_today = quote[BENCHMARK_SYMBOL]["last_price"]
+    except Exception as e:
+        logger.warning(f"Error fetching benchmark price: {str(e)}")
+        benchmark_today = benchmark[-1] if benchmark else float("nan")
+    dates.append(date.today().isoformat())
+    portfolio.append(held.total_value)
+    benchmark.append(benchmark_today)
+
+    # Rebase the benchmark onto the portfolio's starting value
+    benchmark = np.array(benchmark, dtype=float)
+    base = benchmark[~np.isnan(benchmark)][:1]
+    if base.size and base[0] and portfolio[0]:
+        benchmark = benchmark / base[0] * portfolio[0]
+    return {
+        "dates": dates,
+        "portfolioValues": portfolio,
+        "benchmarkValues": np.nan_to_num(benchmark, nan=0.0).tolist(),
+        "pending": pending,
+    }
+
+
+async def _performance_history(kite, held: Holdings, days: int) -> Dict[str, Any]:
+    today = date.today()
+    tokens = held.instrument_token.tolist()
+    dates, closes = await price_matrix(kite, tokens, today - timedelta(days=days), today - timedelta(days=1))
+
+    # dates x instruments price matrix times the quantity vector
+    quantities = held.quantity.astype(float)
+    values = np.nan_to_num(closes[:, :-1], nan=0.0) @ quantities
+    return {
+        "dates": [from_epoch(int(ts)).date().isoformat() for ts in dates],
+        "portfolio": values.tolist(),
+        "benchmark": closes[:, -1].tolist(),
+    }
@@ -0,0 +1,372 @@
+"""Order validation and basket placement.
+
+Every leg is checked locally before anything is sent to Kite: the instrument
+must exist and be tradable, the quantity must be a whole number of lots
+within the exchange freeze limit, prices must sit on the tick size, and the
+product must suit the segment. With a margin check, legs that the account
+cannot fund are rejected as well, using one ``basket_order_margins`` call.
+The remaining legs are then placed concurrently. Order calls already go
+through the rate limiter, so a large basket queues instead of getting 429s.
+
+Kite's instrument dump carries no freeze quantities. If NSE's
+``qtyfreeze.csv`` is saved as ``DATA_DIR/freeze_quantities.csv`` its limits
+are enforced, and otherwise that check is skipped.
+"""
+import asyncio
+import csv
+import logging
+import math
+import os
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+import broker
+import cache
+from instruments import DATA_DIR, master as instrument_master
+
+logger = logging.getLogger(__name__)
+
+FREEZE_QUANTITIES_PATH = os.path.join(DATA_DIR, "freeze_quantities.csv")
+
+BASKET_MAX_LEGS = int(os.getenv("BASKET_MAX_LEGS", "50"))
+
+VARIETIES = ("regular", "amo", "co", "iceberg", "auction")
+TRANSACTION_TYPES = ("BUY", "SELL")
+ORDER_TYPES = ("MARKET", "LIMIT", "SL", "SL-M")
+VALIDITIES = ("DAY", "IOC", "TTL")
+
+# Kite splits an iceberg order into 2 to 10 legs
+ICEBERG_LEGS = (2, 10)
+ICEBERG_ORDER_TYPES = ("LIMIT", "SL")
+# A TTL order lives for 1 minute up to the rest of the trading day
+VALIDITY_TTL_MAX = 24 * 60
+
+# Products each exchange accepts
+PRODUCTS = {
+    "NSE": ("CNC", "MIS", "MTF", "CO"),
+    "BSE": ("CNC", "MIS", "MTF", "CO"),
+    "NFO": ("NRML", "MIS", "CO"),
+    "BFO": ("NRML", "MIS", "CO"),
+    "CDS": ("NRML", "MIS"),
+    "BCD": ("NRML", "MIS"),
+    "MCX": ("NRML", "MIS", "CO"),
+}
+
+# Segments that cannot be traded
+UNTRADABLE_SEGMENTS = ("INDICES",)
+
+# Keys accepted from the UI for each Kite order parameter
+_ALIASES = {
+    "tradingsymbol": ("tradingsymbol", "symbol"),
+    "exchange": ("exchange",),
+    "transaction_type": ("transaction_type", "transactionType"),
+    "order_type": ("order_type", "orderType"),
+    "quantity": ("quantity",),
+    "product": ("product",),
+    "price": ("price",),
+    "trigger_price": ("trigger_price", "triggerPrice"),
+    "disclosed_quantity": ("disclosed_quantity", "disclosedQuantity"),
+    "validity": ("validity",),
+    "validity_ttl": ("validity_ttl", "validityTtl"),
+    "iceberg_legs": ("iceberg_legs", "icebergLegs"),
+    "iceberg_quantity": ("iceberg_quantity", "icebergQuantity"),
+    "tag": ("tag",),
+    "variety": ("variety",),
+}
+
+# Funds segment of the margins response that pays for each exchange
+_FUNDS_SEGMENT = {"MCX": "commodity"}
+
+
+class FreezeLimits:
+    """Maximum quantity per order by underlying symbol, from NSE's qtyfreeze.csv"""
+
+    def __init__(self, path: str = FREEZE_QUANTITIES_PATH):
+        self.path = path
+        self._limits: Optional[Dict[str, int]] = None
+
+    def _load(self) -> Dict[str, int]:
+        limits: Dict[str, int] = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, newline="") as f:
+                    for row in csv.DictReader(f):
+                        row = {key.strip().upper(): (value or "").strip() for key, value in row.items() if key}
+                        symbol = row.get("SYMBOL")
+                        quantity = row.get("VOL_FRZ_QTY") or row.get("FREEZE_QTY")
+                        if symbol and quantity and quantity.isdigit():
+                            limits[symbol] = int(quantity)
+                logger.info(f"Loaded {len(limits)} freeze quantities from {self.path}")
+            except (OSError, csv.Error) as e:
+                logger.error(f"Error loading freeze quantities: {str(e)}")
+        return limits
+
+    def get(self, instrument: Dict[str, Any]) -> Optional[int]:
+        """Freeze quantity for an instrument; derivatives use their underlying's"""
+        if self._limits is None:
+            self._limits = self._load()
+        if instrument["segment"].endswith(("-FUT", "-OPT")):
+            return self._limits.get(instrument["name"])
+        return self._limits.get(instrument["tradingsymbol"])
+
+
+freeze_limits = FreezeLimits()
+
+
+class BasketError(ValueError):
+    """Raised for a basket whose legs are not all order objects"""
+
+    def __init__(self, results: List[Dict[str, Any]]):
+        super().__init__(f"Every order must be an object; {len(results)} are not")
+        self.results = results
+
+
+def malformed(legs: List[Any]) -> List[Dict[str, Any]]:
+    """An ``invalid`` result for each leg that is not an order object"""
+    return [
+        {"index": index, "status": "invalid", "errors": [f"Order must be an object, not {type(leg).__name__}"]}
+        for index, leg in enumerate(legs) if not isinstance(leg, dict)
+    ]
+
+
+def normalise(leg: Dict[str, Any]) -> Dict[str, Any]:
+    """Kite order parameters for a leg given with Kite's or the UI's keys"""
+    params: Dict[str, Any] = {}
+    for name, keys in _ALIASES.items():
+        for key in keys:
+            if leg.get(key) not in (None, ""):
+                params[name] = leg[key]
+                break
+    symbol = str(params.get("tradingsymbol", ""))
+    if ":" in symbol:
+        params["exchange"], params["tradingsymbol"] = symbol.split(":", 1)
+    params.setdefault("exchange", "NSE")
+    params.setdefault("product", "CNC" if params["exchange"] in ("NSE", "BSE") else "NRML")
+    params.setdefault("variety", "regular")
+    for name in ("exchange", "transaction_type", "order_type", "product", "validity"):
+        if isinstance(params.get(name), str):
+            params[name] = params[name].upper()
+    # Forms keep hidden price fields filled in; drop what the order type ignores
+    if params.get("order_type") in ("MARKET", "SL-M"):
+        params.pop("price", None)
+    if params.get("order_type") in ("MARKET", "LIMIT"):
+        params.pop("trigger_price", None)
+    if params.get("validity") != "TTL":
+        params.pop("validity_ttl", None)
+    if params["variety"] != "iceberg":
+        params.pop("iceberg_legs", None)
+        params.pop("iceberg_quantity", None)
+    return params
+
+
+def _on_tick(value: float, tick_size: float) -> bool:
+    steps = value / tick_size
+    return math.isclose(steps, round(steps), abs_tol=1e-6)
+
+
+def _number(params: Dict[str, Any], name: str, kind=float) -> Tuple[Optional[Any], Optional[str]]:
+    if name not in params:
+        return None, None
+    try:
+        value = kind(params[name])
+    except (TypeError, ValueError):
+        return None, f"{name} must be a number"
+    if kind is int and float(params[name]) != value:
+        return None, f"{name} must be a whole number"
+    params[name] = value
+    return value, None
+
+
+def validate(params: Dict[str, Any], master=instrument_master, freeze=freeze_limits) -> List[str]:
+    """Problems that would make Kite reject the order; empty when it is valid
+
+    Numeric fields are converted in place. Pass ``freeze=None`` to skip the
+    freeze quantity check for orders that will be sliced.
+    """
+    errors = []
+    if not params.get("tradingsymbol"):
+        errors.append("tradingsymbol is required")
+    if params.get("variety") not in VARIETIES:
+        errors.append(f"Invalid variety: {params.get('variety')}")
+    if params.get("transaction_type") not in TRANSACTION_TYPES:
+        errors.append(f"Invalid transaction type: {params.get('transaction_type')}")
+    order_type = params.get("order_type")
+    if order_type not in ORDER_TYPES:
+        errors.append(f"Invalid order type: {order_type}")
+    if params.get("validity", "DAY") not in VALIDITIES:
+        errors.append(f"Invalid validity: {params['validity']}")
+    if params.get("validity") == "TTL":
+        ttl, error = _number(params, "validity_ttl", int)
+        if error or ttl is None or not 1 <= ttl <= VALIDITY_TTL_MAX:
+            errors.append(error or f"validity_ttl must be between 1 and {VALIDITY_TTL_MAX} minutes for TTL orders")
+    exchange = params["exchange"]
+    if exchange not in PRODUCTS:
+        errors.append(f"Invalid exchange: {exchange}")
+    elif params["product"] not in PRODUCTS[exchange]:
+        errors.append(f"Product {params['product']} is not allowed on {exchange}")
+
+    quantity, error = _number(params, "quantity", int)
+    if error or quantity is None or quantity <= 0:
+        errors.append(error or "quantity must be positive")
+        quantity = None
+    price, error = _number(params, "price")
+    if error:
+        errors.append(error)
+    trigger_price, error = _number(params, "trigger_price")
+    if error:
+        errors.append(error)
+    if order_type in ("LIMIT", "SL") and not price:
+        errors.append(f"price is required for {order_type} orders")
+    if order_type in ("SL", "SL-M") and not trigger_price:
+        errors.append(f"trigger_price is required for {order_type} orders")
+    for name, value in (("price", price), ("trigger_price", trigger_price)):
+        if value is not None and value < 0:
+            errors.append(f"{name} must not be negative")
+
+    # Each leg of an iceberg order is a separate exchange order of iceberg_quantity
+    iceberg = params.get("variety") == "iceberg"
+    leg_quantity = quantity
+    if iceberg:
+        if order_type in ORDER_TYPES and order_type not in ICEBERG_ORDER_TYPES:
+            errors.append(f"Iceberg orders must be LIMIT or SL, not {order_type}")
+        legs, error = _number(params, "iceberg_legs", int)
+        if error or legs is None or not ICEBERG_LEGS[0] <= legs <= ICEBERG_LEGS[1]:
+            errors.append(error or f"iceberg_legs must be between {ICEBERG_LEGS[0]} and {ICEBERG_LEGS[1]}")
+            legs = None
+        leg_quantity, error = _number(params, "iceberg_quantity", int)
+        if error or leg_quantity is None or leg_quantity <= 0:
+            errors.append(error or "iceberg_quantity is required for iceberg orders")
+            leg_quantity = None
+        elif quantity is not None and legs is not None and not leg_quantity < quantity <= leg_quantity * legs:
+            errors.append(f"iceberg_quantity must split quantity {quantity} into {legs} legs")
+
+    if not master.loaded or not params.get("tradingsymbol") or exchange not in PRODUCTS:
+        return errors
+    instrument = master.get(f"{exchange}:{params['tradingsymbol']}")
+    if instrument is None:
+        errors.append(f"Unknown instrument: {exchange}:{params['tradingsymbol']}")
+        return errors
+    if instrument["segment"] in UNTRADABLE_SEGMENTS:
+        errors.append(f"{exchange}:{params['tradingsymbol']} is not tradable")
+    if instrument["expiry"] and instrument["expiry"] < date.today().isoformat():
+        errors.append(f"{exchange}:{params['tradingsymbol']} expired on {instrument['expiry']}")
+    lot_size = instrument["lot_size"] or 1
+    if quantity is not None and quantity % lot_size:
+        errors.append(f"quantity must be a multiple of the lot size {lot_size}")
+    if iceberg and leg_quantity is not None and leg_quantity % lot_size:
+        errors.append(f"iceberg_quantity must be a multiple of the lot size {lot_size}")
+    limit = freeze.get(instrument) if freeze is not None and leg_quantity is not None else None
+    if limit is not None and leg_quantity > limit:
+        if iceberg:
+            errors.append(f"iceberg_quantity exceeds the freeze limit of {limit}")
+        else:
+            errors.append(f"quantity exceeds the freeze limit of {limit}; place it as a sliced execution")
+    tick_size = instrument["tick_size"]
+    if tick_size:
+        for name, value in (("price", price), ("trigger_price", trigger_price)):
+            if value and not _on_tick(value, tick_size):
+                errors.append(f"{name} must be a multiple of the tick size {tick_size}")
+    return errors
+
+
+def freeze_limit(params: Dict[str, Any], master=instrument_master, freeze=freeze_limits) -> Optional[int]:
+    """Largest quantity a single order for the instrument may have, if known"""
+    instrument = master.get(f"{params['exchange']}:{params['tradingsymbol']}") if master.loaded else None
+    return freeze.get(instrument) if instrument is not None else None
+
+
+def _margin_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "exchange": params["exchange"],
+        "tradingsymbol": params["tradingsymbol"],
+        "transaction_type": params["transaction_type"],
+        "variety": params["variety"],
+        "product": params["product"],
+        "order_type": params["order_type"],
+        "quantity": params["quantity"],
+        "price": params.get("price", 0),
+        "trigger_price": params.get("trigger_price", 0),
+    }
+
+
+async def unfunded(kite, legs: List[Dict[str, Any]]) -> Dict[int, str]:
+    """Legs the account cannot pay for, by position in ``legs``
+
+    The whole basket is priced first, so hedged legs get their margin
+    benefit. If the basket as a whole is unaffordable, legs are funded in
+    order until the money runs out.
+    """
+    basket, margins = await asyncio.gather(
+        broker.call(kite.basket_order_margins, [_margin_params(leg) for leg in legs], consider_positions=True),
+        cache.fetch("margins", kite.margins),
+    )
+    available: Dict[str, float] = {}
+    for leg in legs:
+        segment = _FUNDS_SEGMENT.get(leg["exchange"], "equity")
+        available.setdefault(segment, float((margins.get(segment) or {}).get("net", 0.0)))
+    if len(available) == 1 and basket["final"]["total"] <= next(iter(available.values())):
+        return {}
+
+    rejected = {}
+    for index, (leg, margin) in enumerate(zip(legs, basket["orders"])):
+        segment = _FUNDS_SEGMENT.get(leg["exchange"], "equity")
+        required = float(margin.get("total", 0.0))
+        if required > available[segment]:
+            rejected[index] = f"Insufficient funds: needs {required:.2f}, {available[segment]:.2f} available"
+        else:
+            available[segment] -= required
+    return rejected
+
+
+async def _place(kite, params: Dict[str, Any]) -> Dict[str, Any]:
+    order = dict(params)
+    variety = order.pop("variety")
+    try:
+        order_id = await broker.call(kite.place_order, variety=variety, **order)
+    except Exception as e:
+        logger.error(f"Error placing {params['exchange']}:{params['tradingsymbol']}: {str(e)}")
+        return {"status": "failed", "error": str(e)}
+    return {"status": "placed", "order_id": order_id}
+
+
+async def place_basket(kite, legs: List[Dict[str, Any]], margin_check: bool = False) -> Dict[str, Any]:
+    """Validate, optionally margin-check, and place a list of orders
+
+    Returns one result per leg, in the order given. A leg's ``status`` is
+    ``invalid``, ``unfunded``, ``placed`` or ``failed``. Nothing is placed if
+    a leg is not an order object; :class:`BasketError` lists those legs.
+    """
+    if len(legs) > BASKET_MAX_LEGS:
+        raise ValueError(f"A basket can have at most {BASKET_MAX_LEGS} orders")
+    rejected = malformed(legs)
+    if rejected:
+        raise BasketError(rejected)
+    results: List[Dict[str, Any]] = []
+    accepted: List[Tuple[int, Dict[str, Any]]] = []
+    for index, leg in enumerate(legs):
+        params = normalise(leg)
+        result = {"index": index, "symbol": f"{params['exchange']}:{params.get('tradingsymbol', '')}"}
+        errors = validate(params)
+        if errors:
+            result.update({"status": "invalid", "errors": errors})
+        else:
+            accepted.append((index, params))
+        results.append(result)
+
+    if margin_check and accepted:
+        rejected = await unfunded(kite, [params for _, params in accepted])
+        for position, reason in rejected.items():
+            results[accepted[position][0]].update({"status": "unfunded", "errors": [reason]})
+        accepted = [item for position, item in enumerate(accepted) if position not in rejected]
+
+    if accepted:
+        placed = await asyncio.gather(*(_place(kite, params) for _, params in accepted))
+        for (index, _), outcome in zip(accepted, placed):
+            results[index].update(outcome)
+        await cache.invalidate_orders(kite)
+
+    counts: Dict[str, int] = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    logger.info(f"Basket of {len(legs)} orders: {counts}")
+    return {"results": results, "counts": counts}
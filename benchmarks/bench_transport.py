@@ -0,0 +1,130 @@
+"""Benchmark Kite transports on parallel portfolio loads.
+
+Each round loads ``--users`` portfolio snapshots at once (holdings, positions,
+margins and orders per user) on a thread pool the size of the broker pool,
+and the latency of every round is recorded. By default the calls go to a
+local mock of the Kite API that adds a fixed delay per new connection (the
+TCP + TLS handshake) and per request. Pass ``--root`` and ``--access-token``
+to run against the real API instead.
+
+    python benchmarks/bench_transport.py --rounds 50 --users 8
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kiteconnect import KiteConnect  # noqa: E402
+
+import transport  # noqa: E402
+from broker import BROKER_POOL_SIZE  # noqa: E402
+
+SNAPSHOT_CALLS = ("holdings", "positions", "margins", "orders")
+
+_PAYLOADS = {
+    "/portfolio/holdings": [{"tradingsymbol": f"SYM{i}", "quantity": i, "last_price": 100.0} for i in range(50)],
+    "/portfolio/positions": {"net": [], "day": []},
+    "/user/margins": {"equity": {"net": 1000.0}},
+    "/orders": [],
+}
+
+
+class MockKiteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    handshake_delay = 0.0
+    request_delay = 0.0
+    connections = 0
+    _lock = threading.Lock()
+
+    def setup(self):
+        # Stand-in for the TCP + TLS handshake every new connection pays for
+        with MockKiteHandler._lock:
+            MockKiteHandler.connections += 1
+        time.sleep(self.handshake_delay)
+        super().setup()
+
+    def do_GET(self):
+        time.sleep(self.request_delay)
+        body = json.dumps({"status": "success", "data": _PAYLOADS.get(self.path.split("?")[0], {})}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(handshake_ms: float, request_ms: float) -> ThreadingHTTPServer:
+    MockKiteHandler.handshake_delay = handshake_ms / 1000
+    MockKiteHandler.request_delay = request_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockKiteHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_clients(root: str, access_token: str):
+    clients = {
+        # What main.py used before: the library's default session
+        "default": KiteConnect(api_key="bench", access_token=access_token, root=root),
+        "requests": transport.create_kite("bench", "requests", access_token=access_token, root=root),
+        "httpx": transport.create_kite("bench", "httpx", access_token=access_token, root=root),
+    }
+    return clients
+
+
+def run(kite: KiteConnect, pool: ThreadPoolExecutor, rounds: int, users: int):
+    latencies = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        futures = [pool.submit(getattr(kite, call)) for _ in range(users) for call in SNAPSHOT_CALLS]
+        for future in futures:
+            future.result()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=30)
+    parser.add_argument("--users", type=int, default=8, help="portfolio loads per round")
+    parser.add_argument("--handshake-ms", type=float, default=40.0, help="mock connection setup cost")
+    parser.add_argument("--request-ms", type=float, default=15.0, help="mock server time per request")
+    parser.add_argument("--root", help="Kite API root; starts a local mock when omitted")
+    parser.add_argument("--access-token", default="bench")
+    args = parser.parse_args()
+
+    server = None
+    root = args.root
+    if root is None:
+        server = start_mock_server(args.handshake_ms, args.request_ms)
+        root = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(f"{args.rounds} rounds x {args.users} parallel portfolio loads, {BROKER_POOL_SIZE} threads, {root}")
+    print(f"{'transport':<10} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8} {'connections':>12}")
+    with ThreadPoolExecutor(max_workers=BROKER_POOL_SIZE) as pool:
+        for name, kite in build_clients(root, args.access_token).items():
+            run(kite, pool, 1, args.users)  # warm up
+            before = MockKiteHandler.connections
+            latencies = sorted(run(kite, pool, args.rounds, args.users))
+            opened = MockKiteHandler.connections - before if server else "-"
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f"{name:<10} {statistics.median(latencies):>8.1f} {p95:>8.1f} "
+                  f"{statistics.mean(latencies):>8.1f} {opened:>12}")
+            transport.close(kite)
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Broker call layer.
+
+KiteConnect is a synchronous client, so every call blocks the thread it runs on.
+Handlers go through :func:`call`, which runs the call on a bounded thread pool
+and applies a per-call timeout, so a slow Zerodha round-trip never stalls the
+event loop (and with it every open WebSocket). Calls are paced by the
+per-endpoint token buckets in :mod:`ratelimit`, and calls Kite throttles are
+retried after a jittered backoff.
+"""
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set
+
+from kiteconnect.exceptions import KiteException
+
+import metrics
+import ratelimit
+
+logger = logging.getLogger(__name__)
+
+BROKER_POOL_SIZE = int(os.getenv("BROKER_POOL_SIZE", "16"))
+BROKER_CALL_TIMEOUT = float(os.getenv("BROKER_CALL_TIMEOUT", "15"))
+
+
+class BrokerTimeoutError(Exception):
+    """Raised when a broker call does not complete within its timeout"""
+    pass
+
+
+class RateLimitedError(Exception):
+    """Raised when Kite keeps throttling a call after all retries"""
+    pass
+
+
+def _throttled(error: Exception) -> bool:
+    return isinstance(error, KiteException) and error.code == 429
+
+
+def _call_name(fn: Callable) -> str:
+    return getattr(fn, "__name__", repr(fn))
+
+
+class BrokerExecutor:
+    """Runs blocking broker calls on a sized thread pool and tracks queue depth"""
+
+    def __init__(self, max_workers: int = BROKER_POOL_SIZE, timeout: float = BROKER_CALL_TIMEOUT,
+                 limiter: Optional[ratelimit.RateLimiter] = None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.limiter = limiter or ratelimit.limiter
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kite")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._errors = 0
+        self._timeouts = 0
+        self._retries = 0
+        # Submitted calls not yet finished, cancelled at shutdown
+        self._pending: Set[Future] = set()
+
+    def _run(self, fn: Callable, args: tuple, kwargs: dict) -> Any:
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            metrics.kite_call_errors.inc(method=_call_name(fn), error=type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+            metrics.kite_call_duration.observe(elapsed, method=_call_name(fn))
+            logger.debug("kite.%s took %.1f ms", _call_name(fn), elapsed * 1000,
+                         extra={"kite_method": _call_name(fn), "duration_ms": round(elapsed * 1000, 1)})
+
+    def _on_done(self, future) -> None:
+        with self._lock:
+            self._pending.discard(future)
+            # A call cancelled while still queued never reaches _run
+            if future.cancelled():
+                self._queued -= 1
+
+    async def call(self, fn: Callable, *args, timeout: Optional[float] = None,
+                   priority: Optional[int] = None, **kwargs) -> Any:
+        """Run ``fn(*args, **kwargs)`` on the pool and await its result
+
+        The call first waits for a token from its endpoint's bucket, served
+        by ``priority`` (defaulting to the endpoint class's priority).
+        """
+        bucket = self.limiter.bucket_for(fn)
+        priority = self.limiter.priority_for(fn) if priority is None else priority
+        for attempt in range(ratelimit.RATE_LIMIT_RETRIES + 1):
+            await bucket.acquire(priority)
+            try:
+                return await self._submit(fn, args, kwargs, timeout)
+            except KiteException as e:
+                if not _throttled(e):
+                    raise
+                bucket.penalise()
+                if attempt == ratelimit.RATE_LIMIT_RETRIES:
+                    raise RateLimitedError(f"kite.{_call_name(fn)} is rate limited: {str(e)}") from e
+                delay = ratelimit.backoff(attempt)
+                logger.warning(f"kite.{_call_name(fn)} throttled, retrying in {delay:.2f}s")
+                with self._lock:
+                    self._retries += 1
+                await asyncio.sleep(delay)
+
+    async def _submit(self, fn: Callable, args: tuple, kwargs: dict, timeout: Optional[float]) -> Any:
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            self._queued += 1
+        try:
+            # Carry the caller's context (e.g. its request id for logs) onto the pool thread
+            future = self._executor.submit(contextvars.copy_context().run, self._run, fn, args, kwargs)
+        except RuntimeError:
+            with self._lock:
+                self._queued -= 1
+            raise
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._on_done)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            metrics.kite_call_errors.inc(method=_call_name(fn), error=BrokerTimeoutError.__name__)
+            raise BrokerTimeoutError(f"kite.{_call_name(fn)} timed out after {timeout}s")
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of pool utilisation"""
+        with self._lock:
+            return {
+                "pool_size": self.max_workers,
+                "queue_depth": self._queued,
+                "in_flight": self._running,
+                "completed": self._completed,
+                "errors": self._errors,
+                "timeouts": self._timeouts,
+                "retries": self._retries,
+            }
+
+    def shutdown(self) -> None:
+        # Calls still queued are dropped; running ones are left to finish
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.cancel()
+        self._executor.shutdown(wait=False)
+
+
+executor = BrokerExecutor()
+
+
+async def call(fn: Callable, *args, timeout: Optional[float] = None,
+               priority: Optional[int] = None, **kwargs) -> Any:
+    """Run a blocking broker call on the shared executor"""
+    return await executor.call(fn, *args, timeout=timeout, priority=priority, **kwargs)
+
+
+def stats() -> Dict[str, Any]:
+    return executor.stats()
+
+
+def shutdown() -> None:
+    executor.shutdown()
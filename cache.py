@@ -0,0 +1,228 @@
+"""In-process TTL cache for broker read endpoints.
+
+Every browser tab polls the same read endpoints, so responses are kept for a
+short, per-endpoint TTL. Concurrent misses for the same key share a single
+upstream request (single-flight), and writes such as placing or cancelling an
+order invalidate the affected entries. Keys for account endpoints are scoped
+to the calling client's access token, so sessions never see each other's
+data; market-wide endpoints in ``SHARED_KEYS`` are cached once for everyone.
+
+With a shared state backend, broker responses are also stored there so every
+worker can reuse them, and invalidations are broadcast to all workers.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import broker
+import state
+
+logger = logging.getLogger(__name__)
+
+# Seconds each endpoint's response stays fresh
+CACHE_TTLS: Dict[str, float] = {
+    "holdings": float(os.getenv("CACHE_TTL_HOLDINGS", "15")),
+    "positions": float(os.getenv("CACHE_TTL_POSITIONS", "5")),
+    "margins": float(os.getenv("CACHE_TTL_MARGINS", "10")),
+    "orders": float(os.getenv("CACHE_TTL_ORDERS", "5")),
+}
+
+# Entries affected by order placement/cancellation
+ORDER_KEYS = ("orders", "positions", "holdings", "margins")
+
+# Endpoints whose responses are the same for every user
+SHARED_KEYS = ("ltp", "quote")
+
+# Seconds between sweeps for expired entries
+CACHE_SWEEP_INTERVAL = float(os.getenv("CACHE_SWEEP_INTERVAL", "60"))
+
+# Shared-backend key prefix and the channel invalidations are broadcast on
+_SHARED_PREFIX = "cache:"
+INVALIDATE_CHANNEL = "cache:invalidate"
+
+
+def _retrieve_exception(task: asyncio.Future) -> None:
+    """Mark a failed fetch's exception as retrieved when every caller has gone"""
+    if not task.cancelled():
+        task.exception()
+
+
+class TTLCache:
+    """Async TTL cache with single-flight misses"""
+
+    def __init__(self, shared=None):
+        # Only a backend shared between workers adds anything to the local dicts
+        self.shared = shared if shared is not None and shared.shared else None
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Keys invalidated while their fetch was in flight, and how often
+        self._invalidated: Dict[str, int] = {}
+        self._next_sweep = time.monotonic() + CACHE_SWEEP_INTERVAL
+        self.hits = 0
+        self.expired = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+        if self.shared is not None:
+            self.shared.subscribe(INVALIDATE_CHANNEL, self._on_invalidate)
+
+    async def get_or_fetch(self, key: str, ttl: float, fetch: Callable[[], Awaitable[Any]],
+                           shared: bool = False) -> Any:
+        """Return the cached value for ``key`` or fetch it once for all waiters
+
+        With ``shared``, the value is also looked up in and written to the
+        shared backend, so it must be JSON-serialisable.
+        """
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        # The fetch runs in its own task: a caller that is cancelled (e.g. its
+        # client hung up) stops waiting without failing the others
+        task = asyncio.ensure_future(self._fetch(key, ttl, fetch, shared))
+        task.add_done_callback(_retrieve_exception)
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, ttl: float, fetch: Callable[[], Awaitable[Any]], shared: bool) -> Any:
+        try:
+            if shared and self.shared is not None:
+                value, ttl = await self._fetch_shared(key, ttl, fetch)
+            else:
+                value = await fetch()
+        finally:
+            self._inflight.pop(key, None)
+            invalidated = self._invalidated.pop(key, 0)
+
+        # Skip storing results that were invalidated while in flight
+        if not invalidated:
+            self._store(key, ttl, value)
+        return value
+
+    def _store(self, key: str, ttl: float, value: Any) -> None:
+        now = time.monotonic()
+        self._entries[key] = (now + ttl, value)
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+    def sweep(self, now: Optional[float] = None) -> int:
+        """Drop expired entries; returns how many were dropped"""
+        now = time.monotonic() if now is None else now
+        expired = [key for key, (expires, _) in self._entries.items() if expires <= now]
+        for key in expired:
+            del self._entries[key]
+        self.expired += len(expired)
+        self._next_sweep = now + CACHE_SWEEP_INTERVAL
+        return len(expired)
+
+    async def _fetch_shared(self, key: str, ttl: float, fetch: Callable[[], Awaitable[Any]]) -> Tuple[Any, float]:
+        """Value from the shared backend with its remaining TTL, or fetch and store it"""
+        try:
+            entry = await self.shared.get(_SHARED_PREFIX + key)
+        except Exception as e:
+            logger.warning(f"Shared cache unavailable: {str(e)}")
+            return await fetch(), ttl
+        now = time.time()
+        if entry is not None and entry["expires"] > now:
+            self.shared_hits += 1
+            return entry["value"], entry["expires"] - now
+        value = await fetch()
+        try:
+            await self.shared.set(_SHARED_PREFIX + key, {"expires": time.time() + ttl, "value": value}, ttl=ttl)
+        except Exception as e:
+            logger.warning(f"Error writing shared cache: {str(e)}")
+        return value, ttl
+
+    def invalidate(self, *keys: str) -> None:
+        """Drop the given keys, or everything when called without arguments"""
+        targets = keys or tuple(set(self._entries) | set(self._inflight))
+        for key in targets:
+            self._entries.pop(key, None)
+            if key in self._inflight:
+                self._invalidated[key] = self._invalidated.get(key, 0) + 1
+        logger.debug("Invalidated cache keys: %s", targets)
+
+    def invalidate_prefix(self, prefix: str) -> None:
+        """Drop every key starting with ``prefix``"""
+        self.invalidate(*(key for key in set(self._entries) | set(self._inflight) if key.startswith(prefix)))
+
+    async def invalidate_everywhere(self, *keys: str, prefix: Optional[str] = None) -> None:
+        """Drop keys, or every key under ``prefix``, on all workers"""
+        if prefix is not None:
+            self.invalidate_prefix(prefix)
+        else:
+            self.invalidate(*keys)
+        if self.shared is None:
+            return
+        if prefix is not None:
+            stored = await self.shared.keys(_SHARED_PREFIX + prefix)
+        else:
+            stored = [_SHARED_PREFIX + key for key in keys]
+        await self.shared.delete(*stored)
+        await self.shared.publish(INVALIDATE_CHANNEL, {"worker": state.WORKER_ID, "keys": list(keys), "prefix": prefix})
+
+    async def _on_invalidate(self, message: Dict[str, Any]) -> None:
+        if message["worker"] == state.WORKER_ID:
+            return
+        if message["prefix"] is not None:
+            self.invalidate_prefix(message["prefix"])
+        else:
+            self.invalidate(*message["keys"])
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "shared_hits": self.shared_hits,
+            "expired": self.expired,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+default_cache = TTLCache(state.backend)
+
+
+def scope(kite) -> str:
+    """Key prefix for a client's account endpoints"""
+    token = getattr(kite, "access_token", None) or ""
+    return hashlib.sha256(token.encode()).hexdigest()[:16] + ":"
+
+
+async def fetch(name: str, fn: Callable, *args, ttl: Optional[float] = None) -> Any:
+    """Cached broker call keyed by endpoint name, arguments and, for account
+    endpoints, the client's session"""
+    key = name if not args else f"{name}:{args!r}"
+    if name not in SHARED_KEYS:
+        key = scope(getattr(fn, "__self__", None)) + key
+    ttl = CACHE_TTLS.get(name, 0.0) if ttl is None else ttl
+    return await default_cache.get_or_fetch(key, ttl, lambda: broker.call(fn, *args), shared=True)
+
+
+async def invalidate(kite, *keys: str) -> None:
+    """Drop a client's entries for the given endpoints, or all of them"""
+    if keys:
+        await default_cache.invalidate_everywhere(*(scope(kite) + key for key in keys))
+    else:
+        await default_cache.invalidate_everywhere(prefix=scope(kite))
+
+
+async def invalidate_orders(kite) -> None:
+    """Invalidate everything an order placement or cancellation can change"""
+    await invalidate(kite, *ORDER_KEYS)
+
+
+def stats() -> Dict[str, Any]:
+    return default_cache.stats()
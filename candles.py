@@ -0,0 +1,271 @@
+"""Local historical candle store.
+
+Candles from ``kite.historical_data`` are kept in SQLite, keyed by instrument
+token, interval and timestamp, together with the time range already fetched.
+A query only fetches the parts of its range that are not covered yet, split
+into chunks that respect Kite's per-request limits, which are fetched
+concurrently. Everything else is served from disk.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+from contextlib import asynccontextmanager, contextmanager
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+import broker
+from instruments import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+CANDLES_PATH = os.path.join(DATA_DIR, "candles.sqlite")
+
+IST = timezone(timedelta(hours=5, minutes=30))
+
+# Longest range (in days) Kite serves per historical_data request
+INTERVAL_LIMITS: Dict[str, int] = {
+    "minute": 60,
+    "3minute": 100,
+    "5minute": 100,
+    "10minute": 100,
+    "15minute": 200,
+    "30minute": 200,
+    "60minute": 400,
+    "day": 2000,
+}
+
+INTERVAL_SECONDS: Dict[str, int] = {
+    "minute": 60,
+    "3minute": 180,
+    "5minute": 300,
+    "10minute": 600,
+    "15minute": 900,
+    "30minute": 1800,
+    "60minute": 3600,
+    "day": 86400,
+}
+
+CANDLE_DTYPE = np.dtype([
+    ("ts", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<i8"),
+])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS candles (
+    token INTEGER NOT NULL,
+    interval TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    open REAL, high REAL, low REAL, close REAL,
+    volume INTEGER, oi INTEGER,
+    PRIMARY KEY (token, interval, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS coverage (
+    token INTEGER NOT NULL,
+    interval TEXT NOT NULL,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL,
+    PRIMARY KEY (token, interval)
+);
+"""
+
+DateLike = Union[date, datetime]
+
+
+def to_epoch(value: DateLike) -> int:
+    """Epoch seconds, treating naive values as IST like Kite does"""
+    if not isinstance(value, datetime):
+        value = datetime.combine(value, dtime())
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=IST)
+    return int(value.timestamp())
+
+
+def from_epoch(ts: int) -> datetime:
+    return datetime.fromtimestamp(ts, IST)
+
+
+def next_day(ts: int) -> int:
+    """Start of the first IST day at or after ``ts``"""
+    offset = int(IST.utcoffset(None).total_seconds())
+    return ts + -(ts + offset) % 86400
+
+
+def split_range(start_ts: int, end_ts: int, interval: str) -> List[Tuple[int, int]]:
+    """Split a range into chunks Kite accepts in a single request"""
+    step = INTERVAL_LIMITS[interval] * 86400
+    chunks = []
+    while start_ts <= end_ts:
+        chunk_end = min(start_ts + step - 1, end_ts)
+        chunks.append((start_ts, chunk_end))
+        start_ts = chunk_end + 1
+    return chunks
+
+
+class CandleStore:
+    """SQLite-backed candle cache with incremental backfill"""
+
+    def __init__(self, path: str = CANDLES_PATH):
+        self.path = path
+        # Backfill lock per (token, interval) and how many tasks hold or wait on it
+        self._locks: Dict[Tuple[int, str], asyncio.Lock] = {}
+        self._lock_users: Dict[Tuple[int, str], int] = {}
+        self._initialised = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialised:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialised:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            self._initialised = True
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """A connection that commits on success and is always closed"""
+        conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @asynccontextmanager
+    async def _locked(self, token: int, interval: str) -> AsyncIterator[None]:
+        """Hold the backfill lock for an instrument and interval, dropping it when unused"""
+        key = (token, interval)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
+
+    # Blocking helpers, run on a worker thread
+
+    def _coverage(self, token: int, interval: str) -> Optional[Tuple[int, int]]:
+        with self._transaction() as conn:
+            return conn.execute(
+                "SELECT start_ts, end_ts FROM coverage WHERE token = ? AND interval = ?",
+                (token, interval)
+            ).fetchone()
+
+    def _store(self, token: int, interval: str, candles: List[Dict[str, Any]],
+               start_ts: int, end_ts: Optional[int]) -> None:
+        rows = [
+            (token, interval, to_epoch(c["date"]), c["open"], c["high"], c["low"], c["close"],
+             c.get("volume", 0), c.get("oi"))
+            for c in candles
+        ]
+        with self._transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            if end_ts is None:
+                return
+            conn.execute(
+                """INSERT INTO coverage VALUES (?, ?, ?, ?)
+                   ON CONFLICT (token, interval) DO UPDATE SET
+                       start_ts = MIN(start_ts, excluded.start_ts),
+                       end_ts = MAX(end_ts, excluded.end_ts)""",
+                (token, interval, start_ts, end_ts)
+            )
+
+    def _query(self, token: int, interval: str, start_ts: int, end_ts: int) -> np.ndarray:
+        with self._transaction() as conn:
+            rows = conn.execute(
+                """SELECT ts, open, high, low, close, COALESCE(volume, 0) FROM candles
+                   WHERE token = ? AND interval = ? AND ts BETWEEN ? AND ?
+                   ORDER BY ts""",
+                (token, interval, start_ts, end_ts)
+            ).fetchall()
+        return np.array(rows, dtype=CANDLE_DTYPE) if rows else np.empty(0, dtype=CANDLE_DTYPE)
+
+    # Async API
+
+    def _missing(self, coverage: Optional[Tuple[int, int]], start_ts: int, end_ts: int,
+                 interval: str = "day") -> List[Tuple[int, int]]:
+        if coverage is None:
+            return [(start_ts, end_ts)]
+        covered_start, covered_end = coverage
+        gaps = []
+        if start_ts < covered_start:
+            gaps.append((start_ts, covered_start - 1))
+        # Start at the covered edge even if the request starts later, so coverage stays contiguous
+        gap_start = covered_end + 1
+        if interval == "day":
+            # Kite serves day candles by date, so a range starting mid-day would refetch the edge day
+            gap_start = next_day(gap_start)
+        if end_ts >= gap_start:
+            gaps.append((gap_start, end_ts))
+        return gaps
+
+    async def _fetch(self, kite, token: int, interval: str, start_ts: int, end_ts: int) -> List[Dict[str, Any]]:
+        chunks = split_range(start_ts, end_ts, interval)
+        results = await asyncio.gather(*(
+            broker.call(
+                kite.historical_data,
+                instrument_token=token,
+                from_date=from_epoch(chunk_start).replace(tzinfo=None),
+                to_date=from_epoch(chunk_end).replace(tzinfo=None),
+                interval=interval
+            )
+            for chunk_start, chunk_end in chunks
+        ))
+        return [candle for result in results for candle in result]
+
+    async def backfill(self, kite, token: int, start: DateLike, end: DateLike, interval: str = "day") -> None:
+        """Fetch whatever part of the range is not stored yet"""
+        if interval not in INTERVAL_LIMITS:
+            raise ValueError(f"Invalid interval: {interval}")
+        start_ts, end_ts = to_epoch(start), to_epoch(end)
+        # The candle still forming is never marked as covered, so it is refetched next time
+        now = int(datetime.now(IST).timestamp())
+        ist_offset = int(IST.utcoffset(None).total_seconds())
+        complete_ts = now - (now + ist_offset) % INTERVAL_SECONDS[interval] - 1
+        loop = asyncio.get_running_loop()
+        async with self._locked(token, interval):
+            coverage = await loop.run_in_executor(None, self._coverage, token, interval)
+            for gap_start, gap_end in self._missing(coverage, start_ts, end_ts, interval):
+                candles = await self._fetch(kite, token, interval, gap_start, gap_end)
+                logger.debug("Fetched %d %s candles for %s", len(candles), interval, token)
+                covered_end = min(gap_end, complete_ts)
+                await loop.run_in_executor(
+                    None, self._store, token, interval, candles, gap_start,
+                    covered_end if covered_end >= gap_start else None
+                )
+
+    async def array(self, kite, token: int, start: DateLike, end: DateLike, interval: str = "day") -> np.ndarray:
+        """Candles for a range as a structured NumPy array"""
+        await self.backfill(kite, token, start, end, interval)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._query, token, interval, to_epoch(start), to_epoch(end)
+        )
+
+    async def get(self, kite, token: int, start: DateLike, end: DateLike, interval: str = "day") -> List[Dict[str, Any]]:
+        """Candles for a range in Kite's historical_data shape"""
+        candles = await self.array(kite, token, start, end, interval)
+        return [
+            {
+                "date": from_epoch(int(c["ts"])).isoformat(),
+                "open": float(c["open"]),
+                "high": float(c["high"]),
+                "low": float(c["low"]),
+                "close": float(c["close"]),
+                "volume": int(c["volume"]),
+            }
+            for c in candles
+        ]
+
+
+store = CandleStore()
@@ -0,0 +1,226 @@
+"""Sector and asset-class classification.
+
+Each instrument maps to a sector, industry, asset class and market-cap
+bucket. The mapping comes from ``data/classifications.csv``, which ships with
+the app and covers the NIFTY 50 and common ETFs. A file of your own at
+``CLASSIFICATIONS_PATH`` (CSV, or Parquet with ``pyarrow`` installed) adds
+rows or replaces shipped ones. Both files have the columns ``symbol``,
+``isin``, ``sector``, ``industry``, ``asset_class`` and ``market_cap``. A row
+matches by ISIN when it has one and by trading symbol otherwise.
+
+Instruments missing from both files are classified from their segment,
+series and name in the instrument master: mutual funds and ETFs (ISINs
+starting ``INF``), gold bonds, government securities and bonds, commodity
+and currency segments and derivatives. Listed equity ETFs have the asset
+class ETF; gold, silver and debt ETFs that of what they hold. Anything else
+is Equity with sector ``Others``.
+
+The files are read once at startup into sorted NumPy key columns, so a whole
+holdings array is classified with a single ``searchsorted``.
+"""
+import csv
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from instruments import master as instrument_master
+
+logger = logging.getLogger(__name__)
+
+BUNDLED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "classifications.csv")
+CLASSIFICATIONS_PATH = os.getenv("CLASSIFICATIONS_PATH")
+
+FIELDS = ("sector", "industry", "asset_class", "market_cap")
+
+UNCLASSIFIED = "Others"
+
+Classification = Tuple[str, str, str, str]
+
+# Kite appends the series to non-EQ trading symbols, e.g. SGBAUG28V-GB
+_GOLD_BOND_SERIES = ("GB",)
+_GOVERNMENT_SERIES = ("GS", "TB", "SG")
+# Bonds and NCDs trade in series N*, Y* and Z*
+_BOND_SERIES_PREFIXES = ("N", "Y", "Z")
+
+# Words in a fund's name that say what it holds
+_FUND_KEYWORDS = (
+    (("LIQUID", "GILT", "BOND", "DEBT", "GSEC", "G-SEC", "SDL", "MONEY MARKET", "OVERNIGHT"), ("Debt", "Debt")),
+    (("GOLD",), ("Gold", "Commodity")),
+    (("SILVER",), ("Silver", "Commodity")),
+)
+
+
+def _read_csv(path: str) -> List[Dict[str, str]]:
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def _read_parquet(path: str) -> List[Dict[str, str]]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet classification files need the pyarrow package (pip install pyarrow)")
+    return pq.read_table(path).to_pylist()
+
+
+def read_rows(path: str) -> List[Dict[str, str]]:
+    """Rows of a classification file, with lower-cased column names"""
+    reader = _read_parquet if path.lower().endswith((".parquet", ".pq")) else _read_csv
+    return [
+        {str(key).strip().lower(): str(value or "").strip() for key, value in row.items() if key}
+        for row in reader(path)
+    ]
+
+
+def _fund(name: str, listed: bool) -> Classification:
+    for keywords, (sector, asset_class) in _FUND_KEYWORDS:
+        if any(keyword in name for keyword in keywords):
+            return sector, "ETF" if listed else "Mutual Fund", asset_class, ""
+    if listed:
+        return "ETF", "ETF", "ETF", ""
+    return "Mutual Funds", "Mutual Fund", "Equity", ""
+
+
+def infer(symbol: str, exchange: str = "", isin: str = "") -> Classification:
+    """Best guess from the symbol, ISIN and instrument master for an unmapped instrument"""
+    instrument = instrument_master.get(f"{exchange}:{symbol}") if exchange else None
+    segment = instrument["segment"] if instrument else ""
+    name = f"{symbol} {instrument['name'] if instrument else ''}".upper()
+
+    if segment.endswith(("-FUT", "-OPT")):
+        return "Derivatives", segment, "Derivatives", ""
+    if segment.startswith("MCX") or exchange == "MCX":
+        return "Commodities", segment, "Commodity", ""
+    if segment.startswith(("CDS", "BCD")) or exchange in ("CDS", "BCD"):
+        return "Currency", segment, "Currency", ""
+    if segment == "INDICES":
+        return "Index", "Index", "Index", ""
+
+    series = symbol.rpartition("-")[2] if "-" in symbol else ""
+    if len(series) == 2:
+        if series in _GOLD_BOND_SERIES:
+            return "Gold", "Sovereign Gold Bond", "Commodity", ""
+        if series in _GOVERNMENT_SERIES:
+            return "Government Securities", "Government Securities", "Debt", ""
+        if series.startswith(_BOND_SERIES_PREFIXES):
+            return "Bonds", "Bonds", "Debt", ""
+
+    if isin.startswith("INF") or "ETF" in name or symbol.endswith("BEES"):
+        return _fund(name, listed=exchange in ("NSE", "BSE") or not isin.startswith("INF"))
+    return UNCLASSIFIED, UNCLASSIFIED, "Equity", ""
+
+
+class ClassificationIndex:
+    """Classification by ISIN or trading symbol, loaded once from data files"""
+
+    def __init__(self, paths: Iterable[Optional[str]] = (BUNDLED_PATH, CLASSIFICATIONS_PATH)):
+        self.paths = [path for path in dict.fromkeys(paths) if path]
+        self.loaded = False
+        self._symbols = np.array([], dtype=str)
+        self._isins = np.array([], dtype=str)
+        # Row of each key in ``_columns``
+        self._symbol_rows = np.array([], dtype=np.intp)
+        self._isin_rows = np.array([], dtype=np.intp)
+        self._columns: Dict[str, np.ndarray] = {field: np.array([], dtype=str) for field in FIELDS}
+        self._inferred: Dict[Tuple[str, str, str], Classification] = {}
+        # Instrument master table the cached guesses were made from
+        self._inferred_from: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self._columns["sector"])
+
+    def load(self) -> None:
+        """Read every classification file; later files override earlier ones"""
+        by_isin: Dict[str, Classification] = {}
+        by_symbol: Dict[str, Classification] = {}
+        for path in self.paths:
+            if not os.path.exists(path):
+                if path != BUNDLED_PATH:
+                    logger.warning(f"Classification file not found: {path}")
+                continue
+            try:
+                rows = read_rows(path)
+            except (OSError, ValueError, csv.Error) as e:
+                logger.error(f"Error loading classifications from {path}: {str(e)}")
+                continue
+            for row in rows:
+                values = tuple(row.get(field, "") for field in FIELDS)
+                if not values[0]:
+                    continue
+                if row.get("isin"):
+                    by_isin[row["isin"].upper()] = values
+                if row.get("symbol"):
+                    by_symbol[row["symbol"].upper()] = values
+            logger.info(f"Loaded {len(rows)} classifications from {path}")
+        self._index(by_isin, by_symbol)
+
+    def _index(self, by_isin: Dict[str, Classification], by_symbol: Dict[str, Classification]) -> None:
+        values = list(dict.fromkeys([*by_isin.values(), *by_symbol.values()]))
+        row_of = {value: i for i, value in enumerate(values)}
+        for i, field in enumerate(FIELDS):
+            self._columns[field] = np.array([value[i] for value in values], dtype=str)
+        isins = sorted(by_isin)
+        symbols = sorted(by_symbol)
+        self._isins = np.array(isins, dtype=str)
+        self._isin_rows = np.array([row_of[by_isin[key]] for key in isins], dtype=np.intp)
+        self._symbols = np.array(symbols, dtype=str)
+        self._symbol_rows = np.array([row_of[by_symbol[key]] for key in symbols], dtype=np.intp)
+        self._inferred.clear()
+        self.loaded = True
+
+    @staticmethod
+    def _find(keys: np.ndarray, rows: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """Row for each query, or -1 where the key is missing"""
+        if not len(keys):
+            return np.full(len(queries), -1, dtype=np.intp)
+        positions = np.searchsorted(keys, queries).clip(max=len(keys) - 1)
+        return np.where(keys[positions] == queries, rows[positions], -1)
+
+    def classify(self, symbols: Iterable[str], exchanges: Optional[Iterable[str]] = None,
+                 isins: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+        """Column of labels per field for parallel arrays of symbols, exchanges and ISINs"""
+        if not self.loaded:
+            self.load()
+        symbols = np.char.upper(np.asarray(symbols, dtype=str))
+        exchanges = np.asarray(exchanges if exchanges is not None else [""] * len(symbols), dtype=str)
+        isins = np.char.upper(np.asarray(isins if isins is not None else [""] * len(symbols), dtype=str))
+
+        rows = self._find(self._isins, self._isin_rows, isins)
+        unmatched = rows < 0
+        rows[unmatched] = self._find(self._symbols, self._symbol_rows, symbols[unmatched])
+
+        found = rows >= 0
+        result = {}
+        for field, column in self._columns.items():
+            labels = np.full(len(rows), "", dtype=object)
+            labels[found] = column[rows[found]]
+            result[field] = labels
+        # Guesses depend on the instrument master, so start over when it is (re)loaded
+        if self._inferred_from is not instrument_master.records:
+            self._inferred.clear()
+            self._inferred_from = instrument_master.records
+        for i in np.flatnonzero(rows < 0):
+            key = (str(symbols[i]), str(exchanges[i]), str(isins[i]))
+            values = self._inferred.get(key)
+            if values is None:
+                values = infer(*key)
+                # Without the master a guess only has the symbol to go on
+                if instrument_master.loaded:
+                    self._inferred[key] = values
+            for field, value in zip(FIELDS, values):
+                result[field][i] = value
+        return {field: column.astype(str) for field, column in result.items()}
+
+    def for_holdings(self, holdings) -> Dict[str, np.ndarray]:
+        """Classification columns for a :class:`portfolio.Holdings`"""
+        return self.classify(holdings.tradingsymbol, holdings.exchange, holdings.isin)
+
+    def get(self, symbol: str, exchange: str = "", isin: str = "") -> Dict[str, str]:
+        """Classification of a single instrument"""
+        columns = self.classify([symbol], [exchange], [isin])
+        return {field: str(column[0]) for field, column in columns.items()}
+
+
+classifications = ClassificationIndex()
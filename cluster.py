@@ -0,0 +1,266 @@
+"""Ticker coordination across workers.
+
+Only one worker holds the upstream KiteTicker connection. Workers elect it
+through a lease in the shared state backend, and when the leader goes away
+another one takes over within ``TICKER_LEASE_SECONDS``. Each worker
+publishes the tokens its own clients want. The leader subscribes upstream
+to the union of them all, and publishes every tick and order update it
+receives so each worker can fan them out to its own clients.
+
+With the in-process backend the single worker is always the leader, and
+nothing is published.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import state
+from ticker import MODES
+
+logger = logging.getLogger(__name__)
+
+TICKER_LEASE_SECONDS = float(os.getenv("TICKER_LEASE_SECONDS", "10"))
+
+LEASE_KEY = "ticker:leader"
+# Access token the leader should open the upstream connection with
+TOKEN_KEY = "ticker:token"
+DEMAND_PREFIX = "ticker:demand:"
+
+TICKS_CHANNEL = "ticker:ticks"
+ORDERS_CHANNEL = "ticker:orders"
+DEMAND_CHANNEL = "ticker:demand"
+TOKEN_CHANNEL = "ticker:token"
+
+
+def _remote(worker_id: str) -> Tuple[str, str]:
+    """Bridge client standing in for another worker's subscriptions"""
+    return ("worker", worker_id)
+
+
+def _is_remote(client: Any) -> bool:
+    return isinstance(client, tuple) and client[:1] == ("worker",)
+
+
+class TickerCoordinator:
+    """Shares one upstream ticker between every worker"""
+
+    def __init__(self, bridge, shared=None, worker_id: str = state.WORKER_ID,
+                 lease_seconds: float = TICKER_LEASE_SECONDS):
+        self.bridge = bridge
+        self.shared = shared or state.backend
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.leader = False
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._published: Optional[Dict[int, str]] = None
+        self._demand_pending = False
+        self.elections = 0
+        self.ticks_relayed = 0
+        self.ticks_received = 0
+        bridge.add_listener(self._relay_ticks, upstream_only=True)
+        bridge.add_order_listener(self._relay_order, upstream_only=True)
+        bridge.add_subscription_listener(self._demand_changed)
+        self.shared.subscribe(TICKS_CHANNEL, self._on_ticks)
+        self.shared.subscribe(ORDERS_CHANNEL, self._on_order)
+        self.shared.subscribe(DEMAND_CHANNEL, self._on_demand)
+        self.shared.subscribe(TOKEN_CHANNEL, self._on_token)
+
+    # Lifecycle
+
+    async def start(self) -> None:
+        """Join the election and keep the lease and demand fresh"""
+        if self._task is not None:
+            return
+        await self._heartbeat()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await self.shared.delete(DEMAND_PREFIX + self.worker_id)
+            if self.leader and await self.shared.get(LEASE_KEY) == self.worker_id:
+                await self.shared.delete(LEASE_KEY)
+        except Exception as e:
+            logger.warning(f"Error leaving ticker election: {str(e)}")
+        self._step_down()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.lease_seconds / 3)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self._heartbeat()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ticker coordination error: {str(e)}")
+
+    async def _heartbeat(self) -> None:
+        await self._publish_demand(refresh=True)
+        leader = await self._hold_lease()
+        if leader and not self.leader:
+            self.elections += 1
+            logger.info(f"Worker {self.worker_id} now holds the upstream ticker")
+        elif self.leader and not leader:
+            self._step_down()
+        self.leader = leader
+        if leader:
+            await self._apply_demand()
+            await self._sync_token()
+
+    async def _hold_lease(self) -> bool:
+        if await self.shared.set(LEASE_KEY, self.worker_id, ttl=self.lease_seconds, only_if_missing=True):
+            return True
+        if await self.shared.get(LEASE_KEY) == self.worker_id:
+            await self.shared.set(LEASE_KEY, self.worker_id, ttl=self.lease_seconds)
+            return True
+        return False
+
+    def _step_down(self) -> None:
+        if self.leader:
+            logger.info(f"Worker {self.worker_id} released the upstream ticker")
+        self.leader = False
+        self.bridge.stop()
+        for client in self.bridge.clients():
+            if _is_remote(client):
+                self.bridge.unsubscribe(client)
+
+    # Upstream access token
+
+    async def request_stream(self, access_token: str) -> None:
+        """Make sure ticks are flowing, offering a token for the upstream connection"""
+        if not access_token:
+            return
+        if await self.shared.set(TOKEN_KEY, access_token, only_if_missing=True):
+            await self.shared.publish(TOKEN_CHANNEL, {"worker": self.worker_id})
+        if self.leader:
+            await self._sync_token()
+
+    async def release_token(self, access_token: str, successor: Optional[str] = None) -> None:
+        """Stop using a token that no longer works, switching to ``successor``"""
+        if await self.shared.get(TOKEN_KEY) != access_token:
+            return
+        if successor:
+            await self.shared.set(TOKEN_KEY, successor)
+        else:
+            await self.shared.delete(TOKEN_KEY)
+        await self.shared.publish(TOKEN_CHANNEL, {"worker": self.worker_id})
+        if self.leader:
+            await self._sync_token()
+
+    async def _sync_token(self) -> None:
+        token = await self.shared.get(TOKEN_KEY)
+        if token != self.bridge.access_token:
+            self.bridge.stop()
+            if token:
+                self.bridge.start(token)
+
+    async def _on_token(self, message: Dict[str, Any]) -> None:
+        if self.leader and message["worker"] != self.worker_id:
+            await self._sync_token()
+
+    # Subscriptions
+
+    def local_demand(self) -> Dict[int, str]:
+        """Tokens this worker's own clients want, in the richest mode asked for"""
+        modes: Dict[int, str] = {}
+        for client in self.bridge.clients():
+            if _is_remote(client):
+                continue
+            for token, mode in self.bridge.tokens_for(client).items():
+                if token not in modes or MODES.index(mode) > MODES.index(modes[token]):
+                    modes[token] = mode
+        return modes
+
+    def _demand_changed(self) -> None:
+        # Coalesce the subscription changes of one burst into a single publish
+        if self.shared.shared and not self._demand_pending:
+            self._demand_pending = True
+            asyncio.ensure_future(self._publish_demand())
+
+    async def _publish_demand(self, refresh: bool = False) -> None:
+        self._demand_pending = False
+        if not self.shared.shared:
+            return
+        demand = self.local_demand()
+        changed = demand != self._published
+        if not changed and not refresh:
+            return
+        key = DEMAND_PREFIX + self.worker_id
+        if demand:
+            # JSON object keys are strings
+            await self.shared.set(key, {str(token): mode for token, mode in demand.items()},
+                                  ttl=self.lease_seconds * 3)
+        else:
+            await self.shared.delete(key)
+        self._published = demand
+        if changed:
+            await self.shared.publish(DEMAND_CHANNEL, {"worker": self.worker_id})
+
+    async def _on_demand(self, message: Dict[str, Any]) -> None:
+        if self.leader and message["worker"] != self.worker_id:
+            await self._apply_demand()
+
+    async def _apply_demand(self) -> None:
+        """Subscribe upstream to what every other worker's clients want"""
+        if not self.shared.shared:
+            return
+        live = set()
+        for key in await self.shared.keys(DEMAND_PREFIX):
+            worker_id = key[len(DEMAND_PREFIX):]
+            if worker_id == self.worker_id:
+                continue
+            modes = await self.shared.get(key)
+            if modes is None:
+                continue
+            live.add(worker_id)
+            self.bridge.set_tokens(_remote(worker_id), {int(token): mode for token, mode in modes.items()})
+        for client in self.bridge.clients():
+            if _is_remote(client) and client[1] not in live:
+                self.bridge.unsubscribe(client)
+
+    # Fan-out
+
+    async def publish_order(self, order: Dict[str, Any]) -> None:
+        """Deliver an order update that did not come from the ticker, e.g. a postback"""
+        self.bridge.dispatch_order(order)
+        await self._relay_order(order)
+
+    async def _relay_ticks(self, ticks) -> None:
+        if self.shared.shared:
+            self.ticks_relayed += len(ticks)
+            await self.shared.publish(TICKS_CHANNEL, {"worker": self.worker_id, "ticks": ticks})
+
+    async def _relay_order(self, order: Dict[str, Any]) -> None:
+        if self.shared.shared:
+            await self.shared.publish(ORDERS_CHANNEL, {"worker": self.worker_id, "order": order})
+
+    async def _on_ticks(self, message: Dict[str, Any]) -> None:
+        if message["worker"] != self.worker_id:
+            self.ticks_received += len(message["ticks"])
+            self.bridge.dispatch_ticks(message["ticks"])
+
+    async def _on_order(self, message: Dict[str, Any]) -> None:
+        if message["worker"] != self.worker_id:
+            self.bridge.dispatch_order(message["order"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker": self.worker_id,
+            "backend": type(self.shared).__name__,
+            "leader": self.leader,
+            "upstream_connected": self.bridge.connected,
+            "remote_workers": sum(1 for client in self.bridge.clients() if _is_remote(client)),
+            "local_tokens": len(self.local_demand()),
+            "upstream_tokens": len(self.bridge.subscribed_tokens()),
+            "elections": self.elections,
+            "ticks_relayed": self.ticks_relayed,
+            "ticks_received": self.ticks_received,
+        }
@@ -0,0 +1,280 @@
+"""WebSocket client connections with bounded, conflating outbound queues.
+
+Handlers never await a socket send directly. Each client gets a writer task
+that drains its own queue, so one slow browser cannot stall the others.
+Price ticks are conflated per instrument: a client that falls behind only
+receives the latest tick for each token, and each subscription can cap how
+often a token is sent (``max_hz``), with due ticks batched into one frame.
+Clients that stay above the high-water mark are disconnected.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+import frames
+
+logger = logging.getLogger(__name__)
+
+# Pending messages + conflated ticks above which a client counts as lagging
+WS_HIGH_WATER = int(os.getenv("WS_HIGH_WATER", "256"))
+# Hard cap on queued (non-conflatable) messages
+WS_MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", "1024"))
+# Seconds a client may stay above the high-water mark before being dropped
+WS_LAGGARD_SECONDS = float(os.getenv("WS_LAGGARD_SECONDS", "5"))
+
+# Default and ceiling for per-subscription tick rates
+WS_DEFAULT_MAX_HZ = float(os.getenv("WS_DEFAULT_MAX_HZ", "4"))
+WS_MAX_HZ_LIMIT = float(os.getenv("WS_MAX_HZ_LIMIT", "20"))
+
+# Server-side push channels a client can subscribe to
+CHANNELS = ("pnl", "orders", "executions")
+
+# Close code for "try again later"
+CLOSE_LAGGARD = 1013
+
+# Reasons the server disconnects a client
+SLOW_CONSUMER = "slow consumer"
+QUEUE_FULL = "outbound queue full"
+
+
+def parse_max_hz(max_hz: Any = None) -> float:
+    """Tick rate for a subscription, capped at ``WS_MAX_HZ_LIMIT``; 0 is unthrottled"""
+    if max_hz is None:
+        return WS_DEFAULT_MAX_HZ
+    try:
+        value = float(max_hz)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid max_hz: {max_hz!r}")
+    if math.isnan(value) or value < 0:
+        raise ValueError(f"Invalid max_hz: {max_hz!r}")
+    return min(value, WS_MAX_HZ_LIMIT)
+
+
+class ClientConnection:
+    """Outbound queue and writer task for one WebSocket"""
+
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.manager = manager
+        self._messages: deque = deque()
+        self._ticks: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        # token -> minimum seconds between frames, and when it may next be sent
+        self._intervals: Dict[int, float] = {}
+        self._next_due: Dict[int, float] = {}
+        # Tick frame encoding and, for binary frames, the last values sent per token
+        self.encoding = "json"
+        self._last_sent: Dict[int, frames.Values] = {}
+        self.channels: Set[str] = set()
+        # Session the client is authenticated as
+        self.session: Optional[Any] = None
+        self._wakeup = asyncio.Event()
+        self._over_since: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.close_reason: Optional[str] = None
+        self.sent = 0
+        self.conflated = 0
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._writer())
+
+    async def stop(self) -> None:
+        self.closed = True
+        self._wakeup.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    @property
+    def pending(self) -> int:
+        return len(self._messages) + len(self._ticks)
+
+    def send(self, message: Dict[str, Any]) -> bool:
+        """Queue a message; returns False if the client was dropped"""
+        if self.closed:
+            return False
+        if len(self._messages) >= WS_MAX_QUEUE:
+            self.manager.dropped_messages += 1
+            self._disconnect(QUEUE_FULL)
+            return False
+        self._messages.append(message)
+        self._wakeup.set()
+        return self._check_lag()
+
+    def send_ticks(self, ticks: Iterable[Dict[str, Any]]) -> bool:
+        """Queue ticks, replacing any unsent tick for the same instrument"""
+        if self.closed:
+            return False
+        for tick in ticks:
+            token = tick["instrument_token"]
+            if token in self._ticks:
+                self.conflated += 1
+                self.manager.conflated_ticks += 1
+                del self._ticks[token]
+            self._ticks[token] = tick
+        self._wakeup.set()
+        return self._check_lag()
+
+    def set_rate(self, tokens: Iterable[int], max_hz: Optional[float] = None) -> float:
+        """Cap how often ticks for the given tokens are sent; returns the applied rate"""
+        max_hz = parse_max_hz(max_hz)
+        interval = 1.0 / max_hz if max_hz > 0 else 0.0
+        for token in tokens:
+            self._intervals[token] = interval
+            # A fresh subscription starts from full values
+            self._last_sent.pop(token, None)
+        return max_hz
+
+    def set_encoding(self, encoding: str) -> None:
+        if encoding not in frames.ENCODINGS:
+            raise ValueError(f"Invalid encoding: {encoding}")
+        self.encoding = encoding
+        self._last_sent.clear()
+
+    def clear_rate(self, tokens: Optional[Iterable[int]] = None) -> None:
+        for token in (list(self._intervals) if tokens is None else tokens):
+            self._intervals.pop(token, None)
+            self._next_due.pop(token, None)
+            self._ticks.pop(token, None)
+            self._last_sent.pop(token, None)
+
+    def _take_due_ticks(self) -> Tuple[List[Dict[str, Any]], Optional[float]]:
+        """Pop ticks whose rate limit allows sending; also return the next wait"""
+        now = time.monotonic()
+        ready: List[Dict[str, Any]] = []
+        wait: Optional[float] = None
+        for token in list(self._ticks):
+            due = self._next_due.get(token, 0.0)
+            if due <= now:
+                ready.append(self._ticks.pop(token))
+                interval = self._intervals.get(token, 0.0)
+                if interval:
+                    self._next_due[token] = now + interval
+            elif wait is None or due - now < wait:
+                wait = due - now
+        return ready, wait
+
+    async def _send_ticks(self, ticks: List[Dict[str, Any]]) -> None:
+        if self.encoding == "binary":
+            frame = frames.encode_ticks(ticks, self._last_sent)
+            if not frame:
+                return
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_json({
+                "type": "ticks",
+                "data": ticks
+            })
+        self.sent += 1
+
+    def _check_lag(self) -> bool:
+        if self.pending <= WS_HIGH_WATER:
+            self._over_since = None
+            return True
+        now = time.monotonic()
+        if self._over_since is None:
+            self._over_since = now
+        elif now - self._over_since > WS_LAGGARD_SECONDS:
+            self._disconnect(SLOW_CONSUMER)
+            return False
+        return True
+
+    def _disconnect(self, reason: str) -> None:
+        if self.closed:
+            return
+        logger.warning(f"Disconnecting WebSocket client: {reason} ({self.pending} pending)")
+        self.closed = True
+        self.close_reason = reason
+        self.manager.disconnects[reason] = self.manager.disconnects.get(reason, 0) + 1
+        if reason == SLOW_CONSUMER:
+            self.manager.disconnected_laggards += 1
+        self._messages.clear()
+        self._ticks.clear()
+        asyncio.ensure_future(self._abort(reason))
+
+    async def _abort(self, reason: str) -> None:
+        # The writer may be stuck in a send to this client, so stop it first
+        if self._task is not None:
+            self._task.cancel()
+        try:
+            await self.websocket.close(code=CLOSE_LAGGARD, reason=reason)
+        except Exception as e:
+            logger.debug("Error closing WebSocket: %s", e)
+
+    async def _writer(self) -> None:
+        try:
+            wait: Optional[float] = None
+            while not self.closed:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                while self._messages and not self.closed:
+                    await self.websocket.send_json(self._messages.popleft())
+                    self.sent += 1
+                ticks, wait = self._take_due_ticks()
+                if ticks and not self.closed:
+                    await self._send_ticks(ticks)
+                self._check_lag()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug("WebSocket writer stopped: %s", e)
+            self.closed = True
+
+
+class ConnectionManager:
+    """Registry of active WebSocket clients and their drop counters"""
+
+    def __init__(self):
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        self.dropped_messages = 0
+        self.conflated_ticks = 0
+        self.disconnected_laggards = 0
+        # reason -> clients the server disconnected for it
+        self.disconnects: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.connections)
+
+    def __iter__(self):
+        return iter(list(self.connections.values()))
+
+    def connect(self, websocket: WebSocket) -> ClientConnection:
+        connection = ClientConnection(websocket, self)
+        self.connections[websocket] = connection
+        connection.start()
+        return connection
+
+    async def disconnect(self, websocket: WebSocket) -> Optional[ClientConnection]:
+        connection = self.connections.pop(websocket, None)
+        if connection is not None:
+            await connection.stop()
+        return connection
+
+    def broadcast(self, message: Dict[str, Any]) -> None:
+        """Queue a message for every client"""
+        for connection in self:
+            connection.send(message)
+
+    def stats(self) -> Dict[str, Any]:
+        queue_depths: List[int] = [connection.pending for connection in self]
+        return {
+            "connections": len(queue_depths),
+            "queued": sum(queue_depths),
+            "max_queue_depth": max(queue_depths, default=0),
+            "dropped_messages": self.dropped_messages,
+            "conflated_ticks": self.conflated_ticks,
+            "disconnected_laggards": self.disconnected_laggards,
+            "disconnects": dict(self.disconnects),
+        }
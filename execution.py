@@ -0,0 +1,403 @@
+"""Server-side execution of large orders in slices.
+
+A parent order is worked as a series of child orders, each within the
+exchange freeze quantity and a whole number of lots:
+
+``split``
+    Every slice is placed at once. Use it to get past the freeze limit as
+    fast as the order quota allows.
+``iceberg``
+    One slice is open at a time. The next one is placed when the previous
+    one completes.
+``twap``
+    Slices are spread evenly over ``duration`` seconds.
+``vwap``
+    At every interval, a ``participation`` share of the volume traded since
+    the previous interval is placed, using live ticks. Whatever is left at
+    the end of ``duration`` is placed then.
+
+Children are placed through the broker executor at normal priority. Order
+quota is therefore used as fast as it refills, and manual orders still go
+ahead of queued slices. Fills are tracked from the session's order book. A
+child that is rejected, or cancelled from outside, stops the parent. Parents
+live in the worker that started them and stop being worked when their
+session ends. Children already placed stay with the broker.
+"""
+import asyncio
+import logging
+import math
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from kiteconnect import KiteTicker
+
+import broker
+import ratelimit
+from orderbook import TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Seconds between VWAP slices
+EXECUTION_VWAP_INTERVAL = float(os.getenv("EXECUTION_VWAP_INTERVAL", "10"))
+# Finished parents kept per session for progress queries
+EXECUTION_HISTORY = int(os.getenv("EXECUTION_HISTORY", "100"))
+
+STRATEGIES = ("split", "iceberg", "twap", "vwap")
+
+# TWAP slices when no slice quantity is given
+DEFAULT_TWAP_SLICES = 10
+DEFAULT_PARTICIPATION = 0.1
+
+RUNNING = "RUNNING"
+COMPLETE = "COMPLETE"
+CANCELLED = "CANCELLED"
+FAILED = "FAILED"
+
+ExecutionListener = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class ParentOrder:
+    """A large order and the child orders placed for it"""
+
+    def __init__(self, params: Dict[str, Any], strategy: str, slice_quantity: int, lot_size: int = 1,
+                 duration: float = 0.0, participation: float = DEFAULT_PARTICIPATION,
+                 instrument_token: Optional[int] = None):
+        self.id = secrets.token_hex(6)
+        self.params = params
+        self.strategy = strategy
+        self.quantity: int = params["quantity"]
+        self.slice_quantity = slice_quantity
+        self.lot_size = lot_size
+        self.duration = duration
+        self.participation = participation
+        self.instrument_token = instrument_token
+        # order_id -> latest state of the child
+        self.children: Dict[str, Dict[str, Any]] = {}
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.cancelled = False
+        self.error: Optional[str] = None
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def filled(self) -> int:
+        return sum(child.get("filled_quantity") or 0 for child in self.children.values())
+
+    @property
+    def committed(self) -> int:
+        """Quantity placed and not since cancelled or rejected"""
+        return sum(
+            (child.get("filled_quantity") or 0) if child["status"] in TERMINAL_STATUSES else child["quantity"]
+            for child in self.children.values()
+        )
+
+    @property
+    def remaining(self) -> int:
+        """Quantity still to be placed"""
+        return max(0, self.quantity - self.committed)
+
+    @property
+    def open_children(self) -> int:
+        return sum(1 for child in self.children.values() if child["status"] not in TERMINAL_STATUSES)
+
+    @property
+    def status(self) -> str:
+        if self.cancelled:
+            return CANCELLED
+        if self.error:
+            return FAILED
+        if self.filled >= self.quantity:
+            return COMPLETE
+        return RUNNING
+
+    @property
+    def done(self) -> bool:
+        return self.status != RUNNING
+
+    @property
+    def average_price(self) -> float:
+        value = sum((child.get("filled_quantity") or 0) * (child.get("average_price") or 0.0)
+                    for child in self.children.values())
+        return value / self.filled if self.filled else 0.0
+
+    def slices(self, quantity: int) -> List[int]:
+        """Child quantities for ``quantity``, in whole lots within the slice size"""
+        quantity -= quantity % self.lot_size
+        full, rest = divmod(quantity, self.slice_quantity)
+        return [self.slice_quantity] * full + ([rest] if rest else [])
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "symbol": f"{self.params['exchange']}:{self.params['tradingsymbol']}",
+            "transaction_type": self.params["transaction_type"],
+            "order_type": self.params["order_type"],
+            "strategy": self.strategy,
+            "status": self.status,
+            "quantity": self.quantity,
+            "placed": self.committed,
+            "filled": self.filled,
+            "average_price": self.average_price,
+            "children": len(self.children),
+            "open_children": self.open_children,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class ExecutionScheduler:
+    """Works a session's parent orders"""
+
+    def __init__(self, kite, orders):
+        self.kite = kite
+        self.orders = orders
+        self._parents: "OrderedDict[str, ParentOrder]" = OrderedDict()
+        self._by_child: Dict[str, ParentOrder] = {}
+        self._listeners: List[ExecutionListener] = []
+        self._bridge = None
+        self.children_placed = 0
+
+    def attach(self, bridge) -> None:
+        """Read traded volume for VWAP parents from a TickerBridge"""
+        self._bridge = bridge
+
+    def detach(self) -> None:
+        """Stop working every parent; placed children are left with the broker"""
+        for parent in self._parents.values():
+            if parent.task is not None:
+                parent.task.cancel()
+        if self._bridge is not None:
+            self._bridge.unsubscribe(self)
+            self._bridge = None
+
+    def add_listener(self, listener: ExecutionListener) -> None:
+        """Receive a parent's snapshot whenever its progress changes"""
+        self._listeners.append(listener)
+
+    def _notify(self, parent: ParentOrder) -> None:
+        snapshot = parent.snapshot()
+        for listener in self._listeners:
+            asyncio.ensure_future(listener(snapshot))
+
+    # Parents
+
+    def submit(self, params: Dict[str, Any], strategy: str = "split", slice_quantity: Optional[int] = None,
+               freeze_limit: Optional[int] = None, lot_size: int = 1, duration: float = 0.0,
+               slices: Optional[int] = None, participation: float = DEFAULT_PARTICIPATION,
+               instrument_token: Optional[int] = None) -> ParentOrder:
+        """Start working a validated order; raises ValueError for bad settings"""
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Invalid strategy: {strategy}")
+        if params.get("variety") == "iceberg":
+            raise ValueError("Iceberg orders are sliced by the exchange; use the regular variety to work them here")
+        if strategy in ("twap", "vwap") and duration <= 0:
+            raise ValueError(f"{strategy} needs a positive duration")
+        if strategy == "vwap":
+            if not 0 < participation <= 1:
+                raise ValueError("participation must be between 0 and 1")
+            if instrument_token is None:
+                raise ValueError("vwap needs the instrument in the instrument master")
+        lot_size = max(1, lot_size)
+        quantity = params["quantity"]
+        if not slice_quantity:
+            if strategy == "twap":
+                slice_quantity = math.ceil(quantity / (slices or DEFAULT_TWAP_SLICES))
+            else:
+                slice_quantity = freeze_limit or quantity
+        if freeze_limit:
+            slice_quantity = min(slice_quantity, freeze_limit)
+        # Whole lots, at least one
+        slice_quantity = max(lot_size, slice_quantity - slice_quantity % lot_size)
+
+        parent = ParentOrder(params, strategy, slice_quantity, lot_size, duration, participation, instrument_token)
+        self._parents[parent.id] = parent
+        if strategy == "vwap":
+            self._resubscribe()
+        parent.task = asyncio.ensure_future(self._run(parent))
+        logger.info(f"Started {strategy} execution {parent.id}: {params['transaction_type']} {quantity} "
+                    f"{params['exchange']}:{params['tradingsymbol']} in slices of {slice_quantity}")
+        self._notify(parent)
+        self._trim()
+        return parent
+
+    async def cancel(self, parent_id: str) -> Optional[ParentOrder]:
+        """Stop a parent and cancel its open children"""
+        parent = self._parents.get(parent_id)
+        if parent is None:
+            return None
+        if parent.done:
+            return parent
+        parent.cancelled = True
+        if parent.task is not None:
+            parent.task.cancel()
+        await asyncio.gather(*(
+            self._cancel_child(parent, order_id)
+            for order_id, child in list(parent.children.items()) if child["status"] not in TERMINAL_STATUSES
+        ))
+        self._finish(parent)
+        self._notify(parent)
+        return parent
+
+    def get(self, parent_id: str) -> Optional[ParentOrder]:
+        return self._parents.get(parent_id)
+
+    def executions(self) -> List[Dict[str, Any]]:
+        return [parent.snapshot() for parent in self._parents.values()]
+
+    def _trim(self) -> None:
+        finished = [parent_id for parent_id, parent in self._parents.items() if parent.done]
+        for parent_id in finished[:max(0, len(finished) - EXECUTION_HISTORY)]:
+            parent = self._parents.pop(parent_id)
+            for order_id in parent.children:
+                self._by_child.pop(order_id, None)
+
+    def _finish(self, parent: ParentOrder) -> None:
+        if parent.finished_at is None:
+            parent.finished_at = time.time()
+            logger.info(f"Execution {parent.id} {parent.status.lower()}: {parent.filled}/{parent.quantity} filled")
+            if parent.strategy == "vwap":
+                self._resubscribe()
+
+    # Working
+
+    async def _run(self, parent: ParentOrder) -> None:
+        try:
+            await getattr(self, f"_run_{parent.strategy}")(parent)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Execution {parent.id} failed: {str(e)}")
+            parent.error = str(e)
+            self._finish(parent)
+            self._notify(parent)
+
+    async def _run_split(self, parent: ParentOrder) -> None:
+        await self._place(parent, parent.slices(parent.remaining))
+
+    async def _run_iceberg(self, parent: ParentOrder) -> None:
+        while not parent.done and parent.remaining:
+            await self._place(parent, parent.slices(parent.remaining)[:1])
+            await self._wait(parent, lambda: parent.open_children == 0)
+
+    async def _run_twap(self, parent: ParentOrder) -> None:
+        count = len(parent.slices(parent.remaining))
+        interval = parent.duration / count
+        for index in range(count):
+            if parent.done or not parent.remaining:
+                return
+            await self._place(parent, parent.slices(parent.remaining)[:1])
+            if index < count - 1:
+                await asyncio.sleep(interval)
+
+    async def _run_vwap(self, parent: ParentOrder) -> None:
+        deadline = parent.started_at + parent.duration
+        interval = min(EXECUTION_VWAP_INTERVAL, parent.duration)
+        last_volume = self._volume(parent.instrument_token)
+        while not parent.done and parent.remaining and time.time() < deadline:
+            await asyncio.sleep(min(interval, max(0.0, deadline - time.time())))
+            volume = self._volume(parent.instrument_token)
+            if volume is not None and last_volume is not None:
+                target = int((volume - last_volume) * parent.participation)
+            else:
+                # No live volume yet: keep to the time-weighted schedule
+                elapsed = min(1.0, (time.time() - parent.started_at) / parent.duration)
+                target = int(parent.quantity * elapsed) - parent.committed
+            last_volume = volume if volume is not None else last_volume
+            await self._place(parent, parent.slices(min(max(0, target), parent.remaining)))
+        # Catch up on whatever the market did not absorb in time
+        if not parent.done and parent.remaining:
+            await self._place(parent, parent.slices(parent.remaining))
+
+    def _volume(self, token: Optional[int]) -> Optional[int]:
+        if self._bridge is None or token is None:
+            return None
+        tick = self._bridge.last_ticks.get(token)
+        return tick.get("volume_traded") if tick is not None else None
+
+    def _resubscribe(self) -> None:
+        if self._bridge is None:
+            return
+        self._bridge.set_tokens(self, {
+            parent.instrument_token: KiteTicker.MODE_QUOTE
+            for parent in self._parents.values() if parent.strategy == "vwap" and not parent.done
+        })
+
+    async def _wait(self, parent: ParentOrder, condition: Callable[[], bool]) -> None:
+        while not parent.done and not condition():
+            parent.changed.clear()
+            await parent.changed.wait()
+
+    async def _place(self, parent: ParentOrder, quantities: List[int]) -> None:
+        """Place child orders concurrently, paced by the order rate limit"""
+        if not quantities:
+            return
+        order = dict(parent.params)
+        variety = order.pop("variety")
+        order.setdefault("tag", parent.id)
+        # Shielded so that a placement already sent to Kite is still recorded,
+        # and can be cancelled, when the parent's task is cancelled meanwhile
+        results = await asyncio.shield(asyncio.gather(*(
+            self._place_child(parent, variety, {**order, "quantity": quantity})
+            for quantity in quantities
+        ), return_exceptions=True))
+        errors = [str(result) for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise RuntimeError(f"Could not place {len(errors)} of {len(quantities)} slices: {errors[0]}")
+        self._notify(parent)
+
+    async def _place_child(self, parent: ParentOrder, variety: str, order: Dict[str, Any]) -> str:
+        order_id = await broker.call(self.kite.place_order, variety=variety, priority=ratelimit.PRIORITY_NORMAL,
+                                     **order)
+        self.children_placed += 1
+        parent.children[order_id] = {"order_id": order_id, "quantity": order["quantity"],
+                                     "status": "PUT ORDER REQ RECEIVED"}
+        self._by_child[order_id] = parent
+        # Updates can arrive before place_order returns
+        known = self.orders.get(order_id)
+        if known is not None:
+            self._update_child(parent, known)
+        if parent.cancelled:
+            # Accepted after the parent was cancelled
+            await self._cancel_child(parent, order_id)
+            self._notify(parent)
+        return order_id
+
+    async def _cancel_child(self, parent: ParentOrder, order_id: str) -> None:
+        try:
+            await broker.call(self.kite.cancel_order, variety=parent.params["variety"], order_id=order_id)
+        except Exception as e:
+            logger.warning(f"Error cancelling child {order_id} of execution {parent.id}: {str(e)}")
+
+    # Order updates
+
+    async def on_order_update(self, order: Dict[str, Any]) -> None:
+        parent = self._by_child.get(order.get("order_id"))
+        if parent is None:
+            return
+        self._update_child(parent, order)
+        self._notify(parent)
+
+    def _update_child(self, parent: ParentOrder, order: Dict[str, Any]) -> None:
+        child = parent.children[order["order_id"]]
+        for field in ("status", "filled_quantity", "average_price", "status_message"):
+            if order.get(field) is not None:
+                child[field] = order[field]
+        parent.changed.set()
+        if child["status"] in ("REJECTED", "CANCELLED") and not parent.done:
+            parent.error = (f"Child order {order['order_id']} was {child['status'].lower()}"
+                            + (f": {child['status_message']}" if child.get("status_message") else ""))
+            if parent.task is not None:
+                parent.task.cancel()
+        if parent.done:
+            self._finish(parent)
+
+    def stats(self) -> Dict[str, Any]:
+        statuses: Dict[str, int] = {}
+        for parent in self._parents.values():
+            statuses[parent.status] = statuses.get(parent.status, 0) + 1
+        return {"executions": len(self._parents), "statuses": statuses, "children_placed": self.children_placed}
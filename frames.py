@@ -0,0 +1,126 @@
+"""Compact binary tick frames for the ``/ws`` feed.
+
+Clients that negotiate ``"encoding": "binary"`` receive tick batches as binary
+WebSocket messages instead of JSON. All integers are big-endian, as in Kite's
+own ticker packets.
+
+Frame header (4 bytes)::
+
+    uint8  version   (2)
+    uint8  type      (1 = ticks)
+    uint16 count     number of tick records
+
+Tick record::
+
+    uint32 instrument_token
+    uint8  field mask
+    float64 last_price        if mask & 0x01
+    uint64  volume_traded     if mask & 0x02
+    uint64  oi                if mask & 0x04
+    uint32  exchange_timestamp (epoch seconds) if mask & 0x08
+
+Fields are delta encoded against the last value sent to the same client: a
+field is only present when it changed, and instruments with no changes are
+left out of the frame entirely. A tick whose values cannot be encoded is
+logged and left out as well.
+"""
+import logging
+import struct
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+VERSION = 2
+FRAME_TICKS = 1
+
+LTP = 0x01
+VOLUME = 0x02
+OI = 0x04
+TIMESTAMP = 0x08
+
+_HEADER = struct.Struct(">BBH")
+_RECORD = struct.Struct(">IB")
+# (mask bit, tick key, struct) in wire order
+_FIELDS = (
+    (LTP, "last_price", struct.Struct(">d")),
+    (VOLUME, "volume_traded", struct.Struct(">Q")),
+    (OI, "oi", struct.Struct(">Q")),
+    (TIMESTAMP, "exchange_timestamp", struct.Struct(">I")),
+)
+
+ENCODINGS = ("json", "binary")
+
+Values = Tuple[Optional[float], ...]
+
+
+def _coerce(value: Any, kind: Callable) -> Any:
+    return None if value is None else kind(value)
+
+
+def _values(tick: Dict[str, Any]) -> Values:
+    timestamp = tick.get("exchange_timestamp")
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp).timestamp()
+    elif isinstance(timestamp, datetime):
+        timestamp = timestamp.timestamp()
+    return (
+        _coerce(tick.get("last_price"), float),
+        _coerce(tick.get("volume_traded"), int),
+        _coerce(tick.get("oi"), int),
+        _coerce(timestamp, int),
+    )
+
+
+def encode_ticks(ticks: List[Dict[str, Any]], last_sent: Dict[int, Values]) -> bytes:
+    """Encode a batch of ticks, updating ``last_sent`` in place
+
+    Returns an empty bytes object when nothing changed since the last frame.
+    """
+    parts = []
+    count = 0
+    for tick in ticks:
+        token = tick.get("instrument_token")
+        try:
+            values = _values(tick)
+            previous = last_sent.get(token)
+            mask = 0
+            fields = []
+            for i, (bit, _, packer) in enumerate(_FIELDS):
+                value = values[i]
+                if value is None or (previous is not None and previous[i] == value):
+                    continue
+                mask |= bit
+                fields.append(packer.pack(value))
+            if not mask:
+                continue
+            record = _RECORD.pack(token, mask)
+        except (struct.error, TypeError, ValueError, OverflowError) as e:
+            logger.warning("Skipping tick for %s that cannot be encoded: %s", token, e)
+            continue
+        last_sent[token] = values
+        parts.append(record)
+        parts.extend(fields)
+        count += 1
+    if not count:
+        return b""
+    return _HEADER.pack(VERSION, FRAME_TICKS, count) + b"".join(parts)
+
+
+def decode_ticks(frame: bytes) -> List[Dict[str, Any]]:
+    """Decode a tick frame back into (partial) tick dicts"""
+    version, frame_type, count = _HEADER.unpack_from(frame, 0)
+    if version != VERSION or frame_type != FRAME_TICKS:
+        raise ValueError(f"Unsupported frame: version={version} type={frame_type}")
+    offset = _HEADER.size
+    ticks = []
+    for _ in range(count):
+        token, mask = _RECORD.unpack_from(frame, offset)
+        offset += _RECORD.size
+        tick: Dict[str, Any] = {"instrument_token": token}
+        for bit, key, packer in _FIELDS:
+            if mask & bit:
+                tick[key] = packer.unpack_from(frame, offset)[0]
+                offset += packer.size
+        ticks.append(tick)
+    return ticks
@@ -0,0 +1,231 @@
+"""Instrument master.
+
+The daily ``kite.instruments()`` dump is stored on disk as a NumPy structured
+array and memory-mapped at startup. Hash indexes give O(1) symbol <-> token
+lookups, and a sorted symbol column supports prefix search for autocomplete.
+While the app runs, the table is checked every ``INSTRUMENTS_CHECK_INTERVAL``
+seconds and downloaded again once it is from a previous day.
+"""
+import asyncio
+import logging
+import os
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+import broker
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+INSTRUMENTS_PATH = os.path.join(DATA_DIR, "instruments.npy")
+INSTRUMENTS_CHECK_INTERVAL = float(os.getenv("INSTRUMENTS_CHECK_INTERVAL", "300"))
+
+DTYPE = np.dtype([
+    ("instrument_token", "<u4"),
+    ("exchange_token", "<u4"),
+    ("tradingsymbol", "S40"),
+    ("name", "S64"),
+    ("exchange", "S8"),
+    ("segment", "S16"),
+    ("instrument_type", "S8"),
+    ("expiry", "S10"),
+    ("strike", "<f8"),
+    ("tick_size", "<f8"),
+    ("lot_size", "<u4"),
+])
+
+_STRING_FIELDS = [name for name in DTYPE.names if DTYPE[name].kind == "S"]
+
+
+def _encode(value: Any, size: int) -> bytes:
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    return str(value or "").encode("utf-8")[:size]
+
+
+def to_records(instruments: Iterable[Dict[str, Any]]) -> np.ndarray:
+    """Convert a ``kite.instruments()`` payload into a structured array"""
+    sizes = {name: DTYPE[name].itemsize for name in _STRING_FIELDS}
+    rows = [
+        (
+            int(item["instrument_token"]),
+            int(item.get("exchange_token") or 0),
+            _encode(item["tradingsymbol"], sizes["tradingsymbol"]),
+            _encode(item.get("name"), sizes["name"]),
+            _encode(item["exchange"], sizes["exchange"]),
+            _encode(item.get("segment"), sizes["segment"]),
+            _encode(item.get("instrument_type"), sizes["instrument_type"]),
+            _encode(item.get("expiry"), sizes["expiry"]),
+            float(item.get("strike") or 0),
+            float(item.get("tick_size") or 0),
+            int(item.get("lot_size") or 0),
+        )
+        for item in instruments
+    ]
+    records = np.array(rows, dtype=DTYPE)
+    records.sort(order="tradingsymbol")
+    return records
+
+
+class InstrumentMaster:
+    """Memory-mapped instrument table with symbol/token indexes"""
+
+    def __init__(self, path: str = INSTRUMENTS_PATH):
+        self.path = path
+        self.records: Optional[np.ndarray] = None
+        self.loaded_on: Optional[date] = None
+        self._by_symbol: Dict[str, int] = {}
+        self._by_token: Dict[int, int] = {}
+        self._refreshing: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.records is not None
+
+    @property
+    def stale(self) -> bool:
+        return self.loaded_on is None or self.loaded_on < date.today()
+
+    def __len__(self) -> int:
+        return 0 if self.records is None else len(self.records)
+
+    def load(self) -> bool:
+        """Map the on-disk table, if there is one"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            records = np.load(self.path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading instrument master: {str(e)}")
+            return False
+        self._index(records)
+        self.loaded_on = datetime.fromtimestamp(os.path.getmtime(self.path)).date()
+        logger.info(f"Loaded {len(records)} instruments from {self.path}")
+        return True
+
+    def _index(self, records: np.ndarray) -> None:
+        exchanges = records["exchange"].astype(str)
+        symbols = records["tradingsymbol"].astype(str)
+        self._by_symbol = {f"{e}:{s}": i for i, (e, s) in enumerate(zip(exchanges, symbols))}
+        self._by_token = {int(t): i for i, t in enumerate(records["instrument_token"])}
+        self.records = records
+
+    async def refresh(self, kite) -> None:
+        """Download today's dump and replace the on-disk table"""
+        instruments = await broker.call(kite.instruments, timeout=120)
+        records = await asyncio.get_running_loop().run_in_executor(None, to_records, instruments)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, records)
+        os.replace(tmp_path, self.path)
+        self.load()
+
+    def ensure_fresh(self, kite) -> None:
+        """Refresh in the background when the table is missing or from a previous day"""
+        if not self.stale or (self._refreshing is not None and not self._refreshing.done()):
+            return
+        self._refreshing = asyncio.ensure_future(self._refresh_logged(kite))
+
+    async def _refresh_logged(self, kite) -> None:
+        try:
+            await self.refresh(kite)
+        except Exception as e:
+            logger.error(f"Error refreshing instrument master: {str(e)}")
+
+    async def keep_fresh(self, client: Callable[[], Optional[Any]],
+                         interval: float = INSTRUMENTS_CHECK_INTERVAL) -> None:
+        """Refresh whenever the table goes stale, for as long as the app runs
+
+        ``client`` returns an authenticated KiteConnect, or None while nobody
+        is logged in.
+        """
+        while True:
+            kite = client() if self.stale else None
+            if kite is not None:
+                self.ensure_fresh(kite)
+            await asyncio.sleep(interval)
+
+    # Lookups
+
+    def _row(self, index: int) -> Dict[str, Any]:
+        record = self.records[index]
+        row = {}
+        for name in DTYPE.names:
+            value = record[name]
+            row[name] = value.decode("utf-8", "ignore") if name in _STRING_FIELDS else value.item()
+        return row
+
+    def token(self, symbol: str) -> Optional[int]:
+        """Instrument token for an exchange-prefixed symbol such as NSE:INFY"""
+        index = self._by_symbol.get(symbol)
+        return None if index is None else int(self.records[index]["instrument_token"])
+
+    def symbol(self, token: int) -> Optional[str]:
+        """Exchange-prefixed symbol for an instrument token"""
+        index = self._by_token.get(int(token))
+        if index is None:
+            return None
+        record = self.records[index]
+        return f"{record['exchange'].decode()}:{record['tradingsymbol'].decode()}"
+
+    def get(self, key: Union[str, int]) -> Optional[Dict[str, Any]]:
+        """Full instrument row by symbol or token"""
+        if isinstance(key, int) or (isinstance(key, str) and key.isdigit()):
+            index = self._by_token.get(int(key))
+        else:
+            index = self._by_symbol.get(key)
+        return None if index is None else self._row(index)
+
+    def unknown(self, symbols: Iterable[str]) -> List[str]:
+        """Symbols missing from the master (empty when it is not loaded)"""
+        if not self.loaded:
+            return []
+        return [s for s in symbols if s not in self._by_symbol]
+
+    def search(self, prefix: str, segment: Optional[str] = None, exchange: Optional[str] = None,
+               limit: int = 20) -> List[Dict[str, Any]]:
+        """Instruments whose trading symbol starts with ``prefix``"""
+        if not self.loaded:
+            return []
+        key = prefix.upper().encode("utf-8")
+        symbols = self.records["tradingsymbol"]
+        start = int(np.searchsorted(symbols, key, side="left"))
+        end = int(np.searchsorted(symbols, key + b"\xff", side="left"))
+        indexes = np.arange(start, end)
+        if segment:
+            indexes = indexes[self.records["segment"][start:end] == segment.encode()]
+        if exchange:
+            indexes = indexes[self.records["exchange"][indexes] == exchange.encode()]
+        return [self._row(int(i)) for i in indexes[:limit]]
+
+
+master = InstrumentMaster()
+
+
+# Symbols resolved through kite.ltp() while the master is unavailable
+_symbol_tokens: Dict[str, int] = {}
+
+
+async def resolve_tokens(kite, symbols: Iterable[Any]) -> Dict[Any, int]:
+    """Map exchange-prefixed symbols or raw instrument tokens to instrument tokens"""
+    resolved: Dict[Any, int] = {}
+    missing = []
+    for symbol in symbols:
+        if isinstance(symbol, int) or (isinstance(symbol, str) and symbol.isdigit()):
+            resolved[symbol] = int(symbol)
+            continue
+        token = master.token(symbol) if master.loaded else _symbol_tokens.get(symbol)
+        if token is not None:
+            resolved[symbol] = token
+        elif not master.loaded:
+            missing.append(symbol)
+    if missing:
+        quotes = await broker.call(kite.ltp, missing)
+        for symbol in missing:
+            if symbol in quotes:
+                _symbol_tokens[symbol] = quotes[symbol]["instrument_token"]
+                resolved[symbol] = _symbol_tokens[symbol]
+    return resolved
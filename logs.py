@@ -0,0 +1,170 @@
+"""Logging setup.
+
+Records are handed to a queue and written by a background thread, so a slow
+terminal or log pipe never blocks the event loop. ``LOG_FORMAT=json`` writes
+one JSON object per line with the request id and any ``extra`` fields, such as
+the method and duration of ``kite.*`` calls. Every HTTP request gets an id
+(taken from ``X-Request-ID`` when the client sends one), and it is attached
+to everything logged while serving it.
+
+``LOG_SAMPLE`` thins out chatty loggers below WARNING, e.g.
+``ticker=0.01,connections=0.1``. Each distinct message is kept the first
+time and then at the given rate. Counts are kept for the most recently seen
+``SAMPLE_MAX_MESSAGES`` messages; one seen again after being dropped starts over.
+"""
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+DEFAULT_LOG_SAMPLE = "ticker=0.01"
+
+SAMPLE_MAX_MESSAGES = 1024
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(request_id)s - %(message)s"
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+request_id: "contextvars.ContextVar[str]" = contextvars.ContextVar("request_id", default="-")
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """Use the client's request id if it sent a sane one, else make one"""
+    if incoming and len(incoming) <= 64 and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex[:16]
+
+
+def parse_rates(spec: str) -> Dict[str, float]:
+    """``name=rate`` pairs, e.g. ``ticker=0.01,connections=0.1``"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        try:
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            raise ValueError(f"Invalid LOG_SAMPLE entry: {item}")
+    return rates
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep one in every ``1 / rate`` records of a message from a sampled logger"""
+
+    def __init__(self, rates: Dict[str, float], max_messages: int = SAMPLE_MAX_MESSAGES):
+        super().__init__()
+        self.rates = rates
+        self.max_messages = max_messages
+        # (logger, message) -> records seen, least recently seen first
+        self._seen: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        # Handlers run filters outside their own lock
+        self._lock = threading.Lock()
+
+    def _rate(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        key = (record.name, str(record.msg))
+        with self._lock:
+            seen = self._seen.pop(key, 0)
+            self._seen[key] = seen + 1
+            if len(self._seen) > self.max_messages:
+                self._seen.popitem(last=False)
+        return seen % round(1 / rate) == 0
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_FIELDS)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments now, while they are still valid, and leave
+        # the formatting to the writer thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure(level: Optional[str] = None, fmt: Optional[str] = None, sample: Optional[str] = None) -> None:
+    """Route the root logger through a queue to stderr
+
+    Settings default to ``LOG_LEVEL``, ``LOG_FORMAT`` and ``LOG_SAMPLE``, read
+    at call time so a ``.env`` loaded just before applies.
+    """
+    global _listener
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = fmt or os.getenv("LOG_FORMAT", "text")
+    sample = os.getenv("LOG_SAMPLE", DEFAULT_LOG_SAMPLE) if sample is None else sample
+    if fmt not in ("text", "json"):
+        raise ValueError(f"Invalid LOG_FORMAT: {fmt}")
+    shutdown()
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    handler = _QueueHandler(queue.SimpleQueue())
+    handler.addFilter(SamplingFilter(parse_rates(sample)))
+    handler.addFilter(RequestIdFilter())
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    _listener = logging.handlers.QueueListener(handler.queue, output)
+    _listener.start()
+
+
+def shutdown() -> None:
+    """Write out queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown)
@@ -1,8 +1,7 @@
 from fastapi import FastAPI, Request, HTTPException, WebSocket
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from kiteconnect import KiteConnect
 import os
 from dotenv import load_dotenv
 import uvicorn
@@ -10,21 +9,65 @@ from typing import Dict, Any, List
 import logging
 import traceback
 import json
-import numpy as np
 from datetime import datetime, timedelta
-from collections import defaultdict
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from functools import partial
+from contextlib import asynccontextmanager
+import asyncio
+import time
+
+from starlette.routing import Match
+
+import analytics
+import baskets
+import broker
+import cache
+import logs
+import metrics
+import quotes
+import ratelimit
+import state
+import transport
+from cluster import TickerCoordinator
+from execution import DEFAULT_PARTICIPATION
+from portfolio import SEED_FRESH, SEED_PARTS, SNAPSHOT_PARTS, Holdings, load_snapshot, open_positions
+from ticker import MODES as TICKER_MODES, TickerBridge, project_tick
+from instruments import master as instrument_master, resolve_tokens
+from classification import classifications
+from mutual_funds import catalogue as mf_catalogue
+from candles import INTERVAL_LIMITS, store as candle_store
+from connections import CHANNELS as WS_CHANNELS, ConnectionManager, parse_max_hz
+from pnl import HOLDINGS
+from orderbook import verify_postback
+from sessions import (
+    BACKENDS as SESSION_BACKENDS, EXPIRED, LOGOUT, SESSION_BACKEND, SESSION_COOKIE, SESSION_COOKIE_SECURE,
+    SessionStore
 )
-logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="Kite MCP Web App")
+# Configure logging (LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE)
+logs.configure()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop background resources"""
+    instrument_master.load()
+    classifications.load()
+    mf_catalogue.load()
+    await state.backend.start()
+    await ticker_coordinator.start()
+    instrument_refresh = asyncio.ensure_future(instrument_master.keep_fresh(live_client))
+    yield
+    instrument_refresh.cancel()
+    await ticker_coordinator.stop()
+    await state.backend.close()
+    for session in session_store:
+        transport.close(session.kite)
+    broker.shutdown()
+
+app = FastAPI(title="Kite MCP Web App", lifespan=lifespan)
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -36,19 +79,71 @@ templates = Jinja2Templates(directory="templates")
 api_key = os.getenv("KITE_API_KEY")
 api_secret = os.getenv("KITE_API_SECRET")
 
-logger.debug(f"API Key present: {bool(api_key)}")
-logger.debug(f"API Secret present: {bool(api_secret)}")
+logger.debug("API Key present: %s", bool(api_key))
+logger.debug("API Secret present: %s", bool(api_secret))
 
 if not api_key or not api_secret:
     raise ValueError("KITE_API_KEY and KITE_API_SECRET must be set in .env file")
 
-kite = KiteConnect(api_key=api_key)
+# Client for the login flow; each session gets its own authenticated client
+kite = transport.create_kite(api_key)
+
+def live_client():
+    """Client of any logged-in session, for app-wide downloads"""
+    session = next((s for s in session_store if not s.expired), None)
+    return session.kite if session is not None else None
 
-# Store access token in memory (for demo purposes - in production, use proper session management)
-access_token: Dict[str, Any] = {}
+def session_client(token: str):
+    """KiteConnect client for a restored session"""
+    return transport.create_kite(api_key, access_token=token)
+
+# Logged-in users, keyed by the session cookie
+session_store = SessionStore(session_client, backend=SESSION_BACKENDS[SESSION_BACKEND]())
 
 # Store active WebSocket connections
-active_connections: List[WebSocket] = []
+active_connections = ConnectionManager()
+
+# Shared upstream ticker for all WebSocket clients, held by one worker
+ticker_bridge = TickerBridge(api_key)
+ticker_coordinator = TickerCoordinator(ticker_bridge)
+
+async def open_session(session, reason: str):
+    """Wire a session's live books to the ticker and its WebSocket clients"""
+    # Live P&L, repriced from the ticker
+    session.positions.attach(ticker_bridge)
+    session.positions.add_listener(partial(broadcast_pnl, session))
+    # Order updates pushed on the ticker connection (and to /postback) feed
+    # the order book, which passes changed orders on to the position book
+    session.orders.add_listener(session.positions.on_order_update)
+    session.orders.add_listener(partial(broadcast_order, session))
+    # Sliced executions follow their children's fills and read volume from the ticker
+    session.executions.attach(ticker_bridge)
+    session.orders.add_listener(session.executions.on_order_update)
+    session.executions.add_listener(partial(broadcast_execution, session))
+
+async def close_session(session, reason: str):
+    """Release a session's client and books"""
+    session.positions.detach()
+    session.executions.detach()
+    session.orders.reset()
+    await cache.invalidate(session.kite)
+    transport.close(session.kite)
+    # Evicted sessions and those ended elsewhere still have a working token
+    if reason in (LOGOUT, EXPIRED):
+        successor = next((s for s in session_store if not s.expired), None)
+        await ticker_coordinator.release_token(
+            session.access_token, successor.access_token if successor is not None else None
+        )
+
+session_store.on_open(open_session)
+session_store.on_close(close_session)
+
+async def route_order_update(order: Dict[str, Any]):
+    """Apply a pushed order update to the books of the order's user"""
+    for session in session_store.for_user(order.get("user_id")):
+        session.orders.apply(order)
+
+ticker_bridge.add_order_listener(route_order_update)
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
@@ -78,18 +173,31 @@ async def login_redirect(request_token: str):
         if not request_token:
             raise ValueError("Request token is empty")
             
-        data = kite.generate_session(
+        client = transport.create_kite(api_key)
+        data = await broker.call(
+            client.generate_session,
             request_token,
             api_secret=api_secret
         )
         
         if not data or "access_token" not in data:
+            transport.close(client)
             raise ValueError("Invalid response from Zerodha API")
             
-        # Store the access token
-        access_token["token"] = data["access_token"]
+        # generate_session leaves the access token set on the client
+        session = await session_store.create(client, data.get("user_id"))
+        instrument_master.ensure_fresh(client)
         logger.info("Successfully generated session")
-        return RedirectResponse("/dashboard")
+        response = RedirectResponse("/dashboard")
+        response.set_cookie(
+            SESSION_COOKIE,
+            session.id,
+            max_age=session.ttl,
+            httponly=True,
+            secure=SESSION_COOKIE_SECURE,
+            samesite="lax"
+        )
+        return response
     except Exception as e:
         logger.error(f"Error generating session: {str(e)}")
         logger.error(traceback.format_exc())
@@ -99,64 +207,35 @@ async def login_redirect(request_token: str):
 async def dashboard(request: Request):
     """Dashboard showing user's portfolio"""
     try:
-        if not access_token.get("token"):
-            logger.warning("No access token found, redirecting to login")
+        session = request.state.session
+        if session is None:
+            logger.warning("No session found, redirecting to login")
             return RedirectResponse("/login")
-
-        # Set the access token
-        kite.set_access_token(access_token["token"])
-        logger.info("Access token set successfully")
+        kite = session.kite
 
         try:
-            # Get user's holdings
-            logger.debug("Fetching holdings...")
-            holdings = kite.holdings()
-            logger.info(f"Retrieved {len(holdings)} holdings")
-            
-            # Get user's positions
-            logger.debug("Fetching positions...")
-            positions = kite.positions()
-            logger.info(f"Retrieved positions data")
-            logger.debug(f"Positions data structure: {json.dumps(positions, indent=2)}")
-            
-            # Get user's margins
-            logger.debug("Fetching margins...")
-            margins = kite.margins()
-            logger.info("Retrieved margins data")
-            logger.debug(f"Margins data structure: {json.dumps(margins, indent=2)}")
-
-            # Process holdings data
-            portfolio = []
-            for holding in holdings:
-                if holding["quantity"] > 0:  # Only show non-zero holdings
-                    portfolio.append({
-                        "tradingsymbol": holding["tradingsymbol"],
-                        "quantity": holding["quantity"],
-                        "average_price": holding["average_price"],
-                        "last_price": holding["last_price"],
-                        "pnl": holding["pnl"]
-                    })
+            # Get user's holdings, positions and margins concurrently
+            logger.debug("Fetching portfolio snapshot...")
+            seeding = not session.positions.seeded
+            if seeding:
+                snapshot = await load_snapshot(kite, SEED_PARTS, fresh=SEED_FRESH)
+            else:
+                snapshot = await load_snapshot(kite, SNAPSHOT_PARTS)
+            holdings = snapshot["holdings"]
+            positions = snapshot["positions"]
+            margins = snapshot["margins"]
+            logger.info("Retrieved %d holdings", len(holdings))
+            if seeding and not snapshot["errors"]:
+                session.positions.seed(holdings, positions, snapshot["orders"])
 
-            # Process positions data
-            current_positions = []
-            if positions and "net" in positions:
-                for position in positions["net"]:
-                    # Check if the position has a non-zero quantity
-                    if position.get("quantity", 0) != 0:
-                        current_positions.append({
-                            "tradingsymbol": position["tradingsymbol"],
-                            "net_quantity": position["quantity"],
-                            "average_price": position["average_price"],
-                            "pnl": position.get("pnl", 0)
-                        })
-            
             return templates.TemplateResponse(
                 "dashboard.html",
                 {
                     "request": request,
-                    "portfolio": portfolio,
-                    "positions": current_positions,
-                    "margins": margins
+                    "portfolio": Holdings.from_payload(holdings).rows(),
+                    "positions": open_positions(positions),
+                    "margins": margins,
+                    "errors": snapshot["errors"]
                 }
             )
         except Exception as e:
@@ -170,63 +249,35 @@ async def dashboard(request: Request):
         raise HTTPException(status_code=400, detail=error_msg)
 
 @app.get("/refresh")
-async def refresh_data():
+async def refresh_data(request: Request):
     """Refresh dashboard data"""
     try:
-        if not access_token.get("token"):
-            logger.warning("No access token found in refresh_data")
+        session = request.state.session
+        if session is None:
+            logger.warning("No session found in refresh_data")
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated. Please login again."}
             )
-
-        # Set the access token
-        kite.set_access_token(access_token["token"])
-        logger.info("Access token set successfully in refresh_data")
+        kite = session.kite
 
         try:
             # Get fresh data
-            logger.debug("Fetching holdings...")
-            holdings = kite.holdings()
-            logger.info(f"Retrieved {len(holdings)} holdings")
-            
-            logger.debug("Fetching positions...")
-            positions = kite.positions()
-            logger.info("Retrieved positions data")
-            
-            logger.debug("Fetching margins...")
-            margins = kite.margins()
-            logger.info("Retrieved margins data")
-            logger.debug(f"Margins data structure: {json.dumps(margins, indent=2)}")
-
-            # Process holdings data
-            portfolio = []
-            for holding in holdings:
-                if holding["quantity"] > 0:
-                    portfolio.append({
-                        "tradingsymbol": holding["tradingsymbol"],
-                        "quantity": holding["quantity"],
-                        "average_price": holding["average_price"],
-                        "last_price": holding["last_price"],
-                        "pnl": holding["pnl"]
-                    })
-
-            # Process positions data
-            current_positions = []
-            if positions and "net" in positions:
-                for position in positions["net"]:
-                    if position.get("quantity", 0) != 0:
-                        current_positions.append({
-                            "tradingsymbol": position["tradingsymbol"],
-                            "net_quantity": position["quantity"],
-                            "average_price": position["average_price"],
-                            "pnl": position.get("pnl", 0)
-                        })
+            logger.debug("Fetching portfolio snapshot...")
+            snapshot = await load_snapshot(kite, SEED_PARTS, fresh=SEED_FRESH)
+            holdings = snapshot["holdings"]
+            positions = snapshot["positions"]
+            margins = snapshot["margins"]
+            logger.info("Retrieved %d holdings", len(holdings))
+            if not snapshot["errors"]:
+                # An explicit refresh also resyncs the live position book
+                session.positions.seed(holdings, positions, snapshot["orders"])
 
             return {
-                "portfolio": portfolio,
-                "positions": current_positions,
-                "margins": margins
+                "portfolio": Holdings.from_payload(holdings).rows(),
+                "positions": open_positions(positions),
+                "margins": margins,
+                "errors": snapshot["errors"]
             }
         except Exception as e:
             error_msg = f"Error fetching data: {str(e)}\n{traceback.format_exc()}"
@@ -244,36 +295,41 @@ async def refresh_data():
         )
 
 @app.post("/api/place_order")
-async def place_order(order_data: dict):
+async def place_order(request: Request, order_data: dict):
     """Place a new order"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"success": False, "message": "Not authenticated. Please login again."}
             )
 
-        kite.set_access_token(access_token["token"])
+        kite = session.kite
 
-        # Prepare order parameters
-        order_params = {
-            "tradingsymbol": order_data["symbol"],
-            "quantity": int(order_data["quantity"]),
-            "transaction_type": order_data["transactionType"],
-            "order_type": order_data["orderType"],
-            "product": "CNC",  # Cash and Carry
-            "exchange": "NSE"
-        }
+        # Reject orders Kite would refuse without a round-trip
+        order_params = baskets.normalise(order_data)
+        # The exchange slices iceberg orders itself, so their legs must fit the freeze limit
+        iceberg = order_params["variety"] == "iceberg"
+        errors = baskets.validate(order_params, freeze=baskets.freeze_limits if iceberg else None)
+        if errors:
+            return {"success": False, "message": "; ".join(errors), "errors": errors}
 
-        # Add price for limit orders
-        if order_data["orderType"] == "LIMIT" and order_data.get("price"):
-            order_params["price"] = float(order_data["price"])
+        # Orders above the freeze quantity are sliced
+        freeze_limit = baskets.freeze_limit(order_params)
+        if order_data.get("strategy") or (
+                not iceberg and freeze_limit and order_params["quantity"] > freeze_limit):
+            parent = await start_execution(session, order_params, order_data)
+            return {"success": True, "execution_id": parent.id, "execution": parent.snapshot()}
 
         # Place the order
-        order_id = kite.place_order(
-            variety=kite.VARIETY_REGULAR,
+        variety = order_params.pop("variety")
+        order_id = await broker.call(
+            kite.place_order,
+            variety=variety,
             **order_params
         )
+        await cache.invalidate_orders(kite)
 
         return {"success": True, "order_id": order_id}
     except Exception as e:
@@ -281,56 +337,166 @@ async def place_order(order_data: dict):
         logger.error(traceback.format_exc())
         return {"success": False, "message": str(e)}
 
+async def start_execution(session, order_params: Dict[str, Any], options: Dict[str, Any]):
+    """Hand a validated order to the session's execution scheduler"""
+    instrument = instrument_master.get(f"{order_params['exchange']}:{order_params['tradingsymbol']}")
+    parent = session.executions.submit(
+        order_params,
+        strategy=options.get("strategy") or "split",
+        slice_quantity=int(options.get("sliceQuantity") or 0) or None,
+        freeze_limit=baskets.freeze_limit(order_params),
+        lot_size=instrument["lot_size"] if instrument else 1,
+        duration=float(options.get("duration") or 0),
+        slices=int(options.get("slices") or 0) or None,
+        participation=float(options.get("participation") or DEFAULT_PARTICIPATION),
+        instrument_token=instrument["instrument_token"] if instrument else None,
+    )
+    # Every strategy finishes on order updates; VWAP also reads traded volume
+    await ticker_coordinator.request_stream(session.access_token)
+    return parent
+
+@app.post("/api/executions")
+async def create_execution(request: Request, order_data: dict):
+    """Work a large order as sliced child orders
+
+    Takes the fields of ``/api/place_order`` plus ``strategy`` (split,
+    iceberg, twap or vwap), and optionally ``sliceQuantity``, ``duration`` in
+    seconds, ``slices`` for TWAP and ``participation`` for VWAP.
+    """
+    session = request.state.session
+    if session is None:
+        return JSONResponse(
+            status_code=401,
+            content={"error": "Not authenticated. Please login again."}
+        )
+    order_params = baskets.normalise(order_data)
+    errors = baskets.validate(order_params, freeze=None)
+    if errors:
+        return JSONResponse(status_code=400, content={"error": "; ".join(errors), "errors": errors})
+    try:
+        parent = await start_execution(session, order_params, order_data)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return parent.snapshot()
+
+@app.get("/api/executions")
+async def get_executions(request: Request):
+    """Progress of the session's sliced executions"""
+    return request.state.session.executions.executions()
+
+@app.post("/api/executions/{execution_id}/cancel")
+async def cancel_execution(request: Request, execution_id: str):
+    """Stop a sliced execution and cancel its open child orders"""
+    parent = await request.state.session.executions.cancel(execution_id)
+    if parent is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown execution: {execution_id}"})
+    await cache.invalidate_orders(request.state.session.kite)
+    return parent.snapshot()
+
+@app.post("/api/basket_orders")
+async def place_basket_orders(request: Request, basket: dict):
+    """Validate and place several orders at once
+
+    Body: ``{"orders": [...], "marginCheck": false}``. Each order takes the
+    same fields as ``/api/place_order``. With ``marginCheck``, orders the
+    account cannot fund are held back. Returns one result per order.
+    """
+    session = request.state.session
+    if session is None:
+        return JSONResponse(
+            status_code=401,
+            content={"error": "Not authenticated. Please login again."}
+        )
+    orders = basket.get("orders")
+    if not isinstance(orders, list) or not orders:
+        return JSONResponse(status_code=400, content={"error": "orders must be a non-empty list"})
+    try:
+        return await baskets.place_basket(session.kite, orders, margin_check=bool(basket.get("marginCheck")))
+    except baskets.BasketError as e:
+        return JSONResponse(status_code=400, content={"error": str(e), "results": e.results})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except broker.RateLimitedError:
+        raise
+    except Exception as e:
+        logger.error(f"Error placing basket: {str(e)}")
+        logger.error(traceback.format_exc())
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
 @app.get("/api/orders")
-async def get_orders():
+async def get_orders(request: Request):
     """Get order book"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated. Please login again."}
             )
 
-        kite.set_access_token(access_token["token"])
+        kite = session.kite
 
-        # Get orders
-        orders = kite.orders()
+        # Orders are pushed while the ticker is up; without it, resync from the broker
+        await ticker_coordinator.request_stream(kite.access_token)
+        if ticker_bridge.connected and ticker_bridge.access_token == kite.access_token:
+            await session.orders.ensure_loaded(kite)
+        else:
+            await session.orders.load(kite)
         
         # Process orders for display
-        processed_orders = []
-        for order in orders:
-            processed_orders.append({
-                "order_id": order["order_id"],
-                "symbol": order["tradingsymbol"],
-                "type": f"{order['transaction_type']} {order['order_type']}",
-                "status": order["status"],
-                "quantity": order["quantity"],
-                "price": order.get("price", "Market")
-            })
-
-        return processed_orders
+        return [order_row(order) for order in session.orders.orders()]
+    except broker.RateLimitedError:
+        raise
     except Exception as e:
         logger.error(f"Error fetching orders: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=400, detail=str(e))
 
+def order_row(order):
+    """Order book entry as shown in the UI"""
+    return {
+        "order_id": order["order_id"],
+        "symbol": order["tradingsymbol"],
+        "type": f"{order['transaction_type']} {order['order_type']}",
+        "status": order["status"],
+        "quantity": order["quantity"],
+        "price": order.get("price", "Market"),
+        "order_timestamp": str(order["order_timestamp"]) if order.get("order_timestamp") else None
+    }
+
+@app.post("/postback")
+async def order_postback(request: Request):
+    """Order postback webhook registered with Kite"""
+    try:
+        order = await request.json()
+    except ValueError:
+        return JSONResponse(status_code=400, content={"error": "Invalid JSON"})
+    if not verify_postback(order, api_secret):
+        logger.warning(f"Rejected postback with a bad checksum for order {order.get('order_id')}")
+        return JSONResponse(status_code=403, content={"error": "Invalid checksum"})
+    await ticker_coordinator.publish_order(order)
+    return {"status": "ok"}
+
 @app.post("/api/cancel_order/{order_id}")
-async def cancel_order(order_id: str):
+async def cancel_order(request: Request, order_id: str):
     """Cancel an existing order"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"success": False, "message": "Not authenticated. Please login again."}
             )
 
-        kite.set_access_token(access_token["token"])
+        kite = session.kite
 
         # Cancel the order
-        kite.cancel_order(
+        await broker.call(
+            kite.cancel_order,
             variety=kite.VARIETY_REGULAR,
             order_id=order_id
         )
+        await cache.invalidate_orders(kite)
 
         return {"success": True}
     except Exception as e:
@@ -339,33 +505,24 @@ async def cancel_order(order_id: str):
         return {"success": False, "message": str(e)}
 
 @app.get("/api/portfolio")
-async def get_portfolio():
+async def get_portfolio(request: Request):
     """Get current portfolio"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated. Please login again."}
             )
 
-        kite.set_access_token(access_token["token"])
+        kite = session.kite
 
-        # Get holdings
-        holdings = kite.holdings()
+        # Holdings from the live position book
+        await session.positions.ensure_loaded(kite)
         
-        # Process holdings for display
-        portfolio = []
-        for holding in holdings:
-            if holding["quantity"] > 0:
-                portfolio.append({
-                    "symbol": holding["tradingsymbol"],
-                    "quantity": holding["quantity"],
-                    "average_price": holding["average_price"],
-                    "last_price": holding["last_price"],
-                    "pnl": holding["pnl"]
-                })
-
-        return portfolio
+        return Holdings.from_payload(session.positions.entries(HOLDINGS)).rows()
+    except broker.RateLimitedError:
+        raise
     except Exception as e:
         logger.error(f"Error fetching portfolio: {str(e)}")
         logger.error(traceback.format_exc())
@@ -375,7 +532,9 @@ async def get_portfolio():
 async def websocket_endpoint(websocket: WebSocket):
     """WebSocket endpoint for real-time data streaming"""
     await websocket.accept()
-    active_connections.append(websocket)
+    connection = active_connections.connect(websocket)
+    # Browsers are authenticated by their session cookie
+    connection.session = await session_store.get(websocket.cookies.get(SESSION_COOKIE))
     try:
         while True:
             data = await websocket.receive_text()
@@ -385,35 +544,138 @@ async def websocket_endpoint(websocket: WebSocket):
                 
                 # Handle different types of requests
                 if message.get("type") == "auth":
-                    # Handle authentication
-                    access_token_value = message.get("access_token")
-                    if access_token_value:
-                        kite.set_access_token(access_token_value)
-                        await websocket.send_json({
+                    # Other clients name their session, or a logged-in access token
+                    if message.get("session"):
+                        session = await session_store.get(message["session"])
+                    else:
+                        session = session_store.find(message.get("access_token"))
+                    if session is None:
+                        connection.send({
                             "type": "auth_response",
-                            "status": "success"
+                            "status": "error",
+                            "message": "Unknown or expired session"
                         })
-                
+                        continue
+                    connection.session = session
+                    if message.get("encoding"):
+                        connection.set_encoding(message["encoding"])
+                    connection.send({
+                        "type": "auth_response",
+                        "status": "success",
+                        "encoding": connection.encoding
+                    })
+                    continue
+
+                session = connection.session
+                if session is not None and session.expired:
+                    # Evicted sessions come back from the persistent backend
+                    session = connection.session = await session_store.get(session.id)
+                if session is None:
+                    connection.send({
+                        "type": "error",
+                        "message": "Not authenticated"
+                    })
+                    continue
+                kite = session.kite
+
+                if message.get("type") == "subscribe" and message.get("channel"):
+                    # Server-side push channels
+                    channel = message["channel"]
+                    try:
+                        if channel not in WS_CHANNELS:
+                            raise MCPSubscriptionError(f"Invalid channel: {channel}")
+                        if channel == "pnl":
+                            await session.positions.ensure_loaded(kite)
+                        elif channel == "orders":
+                            await session.orders.ensure_loaded(kite)
+                        await ticker_coordinator.request_stream(kite.access_token)
+                        connection.channels.add(channel)
+                        connection.send({
+                            "type": "subscription_response",
+                            "status": "success",
+                            "channel": channel
+                        })
+                        if channel == "pnl":
+                            connection.send(session.positions.snapshot())
+                        elif channel == "executions":
+                            connection.send({
+                                "type": "executions",
+                                "executions": session.executions.executions()
+                            })
+                        else:
+                            connection.send({
+                                "type": "orders",
+                                "orders": [order_row(order) for order in session.orders.orders()]
+                            })
+                    except Exception as e:
+                        logger.error(f"Error subscribing to channel: {str(e)}")
+                        connection.send({
+                            "type": "subscription_response",
+                            "status": "error",
+                            "channel": channel,
+                            "message": str(e)
+                        })
+
                 elif message.get("type") == "subscribe":
                     # Handle subscription requests
                     symbols = message.get("symbols", [])
                     if symbols:
                         try:
-                            # Subscribe to real-time data
-                            kite.subscribe(symbols)
-                            await websocket.send_json({
+                            # Subscribe to real-time data on the shared ticker
+                            tokens = await resolve_tokens(kite, symbols)
+                            if not tokens:
+                                raise MCPSubscriptionError(f"Unknown symbols: {symbols}")
+                            mode = message.get("mode", ticker_bridge.mode)
+                            if mode not in TICKER_MODES:
+                                raise MCPSubscriptionError(f"Invalid mode: {mode}")
+                            # Validate everything before the bridge takes references for this client
+                            max_hz = parse_max_hz(message.get("max_hz"))
+                            if message.get("encoding"):
+                                connection.set_encoding(message["encoding"])
+                            await ticker_coordinator.request_stream(kite.access_token)
+                            ticker_bridge.subscribe(connection, tokens.values(), mode)
+                            connection.set_rate(tokens.values(), max_hz)
+                            connection.send({
                                 "type": "subscription_response",
                                 "status": "success",
-                                "symbols": symbols
+                                "symbols": symbols,
+                                "tokens": tokens,
+                                "mode": mode,
+                                "max_hz": max_hz,
+                                "encoding": connection.encoding
                             })
+                            # Start the client off with the last known values
+                            connection.send_ticks(
+                                project_tick(ticker_bridge.last_ticks[token], mode)
+                                for token in tokens.values() if token in ticker_bridge.last_ticks
+                            )
                         except Exception as e:
                             logger.error(f"Error subscribing to symbols: {str(e)}")
-                            await websocket.send_json({
+                            connection.send({
                                 "type": "subscription_response",
                                 "status": "error",
                                 "message": str(e)
                             })
                 
+                elif message.get("type") == "unsubscribe" and message.get("channel"):
+                    connection.channels.discard(message["channel"])
+                    connection.send({
+                        "type": "unsubscription_response",
+                        "status": "success",
+                        "channel": message["channel"]
+                    })
+
+                elif message.get("type") == "unsubscribe":
+                    symbols = message.get("symbols")
+                    tokens = await resolve_tokens(kite, symbols) if symbols else {}
+                    ticker_bridge.unsubscribe(connection, tokens.values() if symbols else None)
+                    connection.clear_rate(tokens.values() if symbols else None)
+                    connection.send({
+                        "type": "unsubscription_response",
+                        "status": "success",
+                        "symbols": symbols or []
+                    })
+
                 elif message.get("type") == "request":
                     # Handle data requests
                     endpoint = message.get("endpoint")
@@ -422,42 +684,45 @@ async def websocket_endpoint(websocket: WebSocket):
                     try:
                         # Map endpoints to KiteConnect methods
                         if endpoint == "portfolio":
-                            data = kite.portfolio()
+                            data = await broker.call(kite.portfolio)
                         elif endpoint == "positions":
-                            data = kite.positions()
+                            data = await cache.fetch("positions", kite.positions)
                         elif endpoint == "orders":
-                            data = kite.orders()
+                            data = await cache.fetch("orders", kite.orders)
                         elif endpoint == "holdings":
-                            data = kite.holdings()
+                            data = await cache.fetch("holdings", kite.holdings)
                         elif endpoint == "margins":
-                            data = kite.margins()
-                        elif endpoint == "quote":
-                            data = kite.quote(params.get("symbols", []))
-                        elif endpoint == "ltp":
-                            data = kite.ltp(params.get("symbols", []))
+                            data = await cache.fetch("margins", kite.margins)
+                        elif endpoint in ("quote", "ltp"):
+                            symbols = params.get("symbols", [])
+                            unknown = instrument_master.unknown(symbols)
+                            if unknown:
+                                data = {"error": f"Unknown symbols: {', '.join(unknown)}"}
+                            else:
+                                data = await quotes.get(kite, symbols, endpoint)
                         else:
                             data = {"error": "Invalid endpoint"}
                         
-                        await websocket.send_json({
+                        connection.send({
                             "type": "response",
                             "endpoint": endpoint,
                             "data": data
                         })
                     except Exception as e:
                         logger.error(f"Error processing request: {str(e)}")
-                        await websocket.send_json({
+                        connection.send({
                             "type": "error",
                             "message": str(e)
                         })
                 
             except json.JSONDecodeError:
-                await websocket.send_json({
+                connection.send({
                     "type": "error",
                     "message": "Invalid JSON format"
                 })
             except Exception as e:
                 logger.error(f"WebSocket error: {str(e)}")
-                await websocket.send_json({
+                connection.send({
                     "type": "error",
                     "message": str(e)
                 })
@@ -465,7 +730,49 @@ async def websocket_endpoint(websocket: WebSocket):
     except Exception as e:
         logger.error(f"WebSocket connection error: {str(e)}")
     finally:
-        active_connections.remove(websocket)
+        ticker_bridge.unsubscribe(connection)
+        await active_connections.disconnect(websocket)
+
+async def broadcast_ticks(ticks: List[Dict[str, Any]]):
+    """Fan decoded ticks out to the clients subscribed to them"""
+    # Each tick is projected at most once per mode, however many clients want it
+    projections: Dict[tuple, Dict[str, Any]] = {}
+
+    def view(index: int, mode: str) -> Dict[str, Any]:
+        key = (index, mode)
+        if key not in projections:
+            projections[key] = project_tick(ticks[index], mode)
+        return projections[key]
+
+    for connection in active_connections:
+        modes = ticker_bridge.tokens_for(connection)
+        if modes:
+            connection.send_ticks(
+                view(index, modes[tick["instrument_token"]])
+                for index, tick in enumerate(ticks) if tick["instrument_token"] in modes
+            )
+
+ticker_bridge.add_listener(broadcast_ticks)
+
+async def broadcast_pnl(session, message: Dict[str, Any]):
+    """Push a session's position book changes to its clients on the pnl channel"""
+    for connection in active_connections:
+        if connection.session is session and "pnl" in connection.channels:
+            connection.send(message)
+
+async def broadcast_order(session, order: Dict[str, Any]):
+    """Push a session's changed orders to its clients on the orders channel"""
+    message = {"type": "order", "order": order_row(order)}
+    for connection in active_connections:
+        if connection.session is session and "orders" in connection.channels:
+            connection.send(message)
+
+async def broadcast_execution(session, execution: Dict[str, Any]):
+    """Push a session's execution progress to its clients on the executions channel"""
+    message = {"type": "execution", "execution": execution}
+    for connection in active_connections:
+        if connection.session is session and "executions" in connection.channels:
+            connection.send(message)
 
 # Add MCP-specific error handling
 class MCPError(Exception):
@@ -480,6 +787,16 @@ class MCPSubscriptionError(MCPError):
     """Raised when there's an error subscribing to symbols"""
     pass
 
+@app.exception_handler(broker.RateLimitedError)
+async def rate_limited_handler(request: Request, exc: broker.RateLimitedError):
+    """Report broker throttling as 429 instead of a generic error"""
+    logger.warning(f"Rate limited: {str(exc)}")
+    return JSONResponse(
+        status_code=429,
+        content={"error": str(exc)},
+        headers={"Retry-After": "1"}
+    )
+
 # Add MCP-specific error handlers
 @app.exception_handler(MCPError)
 async def mcp_exception_handler(request: Request, exc: MCPError):
@@ -497,10 +814,9 @@ async def mcp_exception_handler(request: Request, exc: MCPError):
 async def mcp_auth_middleware(request: Request, call_next):
     """Middleware to handle MCP authentication"""
     try:
-        if request.url.path.startswith("/api/"):
-            if not access_token.get("token"):
-                raise MCPAuthenticationError("Not authenticated")
-            kite.set_access_token(access_token["token"])
+        request.state.session = await session_store.get(request.cookies.get(SESSION_COOKIE))
+        if request.url.path.startswith("/api/") and request.state.session is None:
+            raise MCPAuthenticationError("Not authenticated")
         response = await call_next(request)
         return response
     except MCPAuthenticationError as e:
@@ -515,11 +831,48 @@ async def mcp_auth_middleware(request: Request, call_next):
             content={"error": "Internal server error"}
         )
 
+def route_template(request: Request) -> str:
+    """Path template of the route a request matches, to keep metric labels bounded"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Record latency, status and concurrency of every HTTP request"""
+    method, route = request.method, route_template(request)
+    metrics.http_in_flight.inc(method=method, route=route)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.http_in_flight.dec(method=method, route=route)
+        metrics.http_request_duration.observe(time.perf_counter() - started, method=method, route=route)
+        metrics.http_requests.inc(method=method, route=route, status=str(status))
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """Tag everything logged while serving a request with its id"""
+    rid = logs.new_request_id(request.headers.get(logs.REQUEST_ID_HEADER))
+    token = logs.request_id.set(rid)
+    try:
+        response = await call_next(request)
+        response.headers[logs.REQUEST_ID_HEADER] = rid
+        return response
+    finally:
+        logs.request_id.reset(token)
+
 @app.get("/api/auth_status")
-async def check_auth_status():
+async def check_auth_status(request: Request):
     """Check if user is authenticated"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=200,
                 content={"authenticated": False}
@@ -535,28 +888,167 @@ async def check_auth_status():
             content={"error": str(e)}
         )
 
+@app.get("/api/broker/stats")
+async def get_broker_stats():
+    """Broker thread pool utilisation"""
+    return broker.stats()
+
+@app.get("/api/ws/stats")
+async def get_ws_stats():
+    """WebSocket outbound queue depths and drop counters"""
+    return active_connections.stats()
+
+@app.get("/api/pnl")
+async def get_pnl(request: Request):
+    """Live P&L from the position book"""
+    session = request.state.session
+    if session is None:
+        return JSONResponse(
+            status_code=401,
+            content={"error": "Not authenticated. Please login again."}
+        )
+    try:
+        await session.positions.ensure_loaded(session.kite)
+        return session.positions.snapshot()
+    except Exception as e:
+        logger.error(f"Error loading position book: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/pnl/stats")
+async def get_pnl_stats(request: Request):
+    """Position book counters"""
+    return request.state.session.positions.stats()
+
+@app.get("/api/orders/stats")
+async def get_order_book_stats(request: Request):
+    """Order book counters"""
+    return request.state.session.orders.stats()
+
+def collect_metrics():
+    """Metric families read from component stats at scrape time"""
+    cache_stats = cache.stats()
+    yield metrics.Family("cache_lookups_total", "counter", "Response cache lookups by outcome", ("outcome",)) \
+        .add(cache_stats["hits"], outcome="hit").add(cache_stats["misses"], outcome="miss") \
+        .add(cache_stats["coalesced"], outcome="coalesced").add(cache_stats["shared_hits"], outcome="shared_hit")
+    yield metrics.Family("cache_hit_ratio", "gauge", "Share of lookups served without a broker call") \
+        .add(cache_stats["hit_ratio"])
+    yield metrics.Family("cache_entries", "gauge", "Entries in the response cache").add(cache_stats["entries"])
+    quote_stats = quotes.stats()
+    yield metrics.Family("quote_lookups_total", "counter", "Quote lookups by outcome", ("outcome",)) \
+        .add(quote_stats["cache_hits"], outcome="hit").add(quote_stats["coalesced"], outcome="coalesced") \
+        .add(quote_stats["broker_calls"], outcome="broker_call")
+
+    ws_stats = active_connections.stats()
+    yield metrics.Family("ws_connections", "gauge", "Open WebSocket connections").add(ws_stats["connections"])
+    yield metrics.Family("ws_queued_messages", "gauge", "Messages waiting in WebSocket outbound queues") \
+        .add(ws_stats["queued"])
+    yield metrics.Family("ws_max_queue_depth", "gauge", "Deepest WebSocket outbound queue") \
+        .add(ws_stats["max_queue_depth"])
+    yield metrics.Family("ws_dropped_messages_total", "counter", "Messages dropped from full queues") \
+        .add(ws_stats["dropped_messages"])
+    yield metrics.Family("ws_conflated_ticks_total", "counter", "Ticks replaced by a newer one before sending") \
+        .add(ws_stats["conflated_ticks"])
+    yield metrics.Family("ws_laggards_disconnected_total", "counter", "Clients dropped for falling behind") \
+        .add(ws_stats["disconnected_laggards"])
+    disconnects = metrics.Family("ws_disconnects_total", "counter", "Clients disconnected by the server, by reason",
+                                 ("reason",))
+    for reason, count in ws_stats["disconnects"].items():
+        disconnects.add(count, reason=reason)
+    yield disconnects
+
+    yield metrics.Family("ticker_connected", "gauge", "Whether this worker holds the upstream ticker") \
+        .add(int(ticker_bridge.connected))
+    yield metrics.Family("ticker_subscribed_tokens", "gauge", "Instrument tokens subscribed") \
+        .add(len(ticker_bridge.subscribed_tokens()))
+
+    broker_stats = broker.stats()
+    yield metrics.Family("broker_queue_depth", "gauge", "kite.* calls waiting for a pool thread") \
+        .add(broker_stats["queue_depth"])
+    yield metrics.Family("broker_in_flight", "gauge", "kite.* calls running").add(broker_stats["in_flight"])
+    yield metrics.Family("broker_retries_total", "counter", "kite.* calls retried after throttling") \
+        .add(broker_stats["retries"])
+    queued = metrics.Family("ratelimit_queued", "gauge", "Calls waiting for a rate limit token", ("bucket",))
+    utilisation = metrics.Family("ratelimit_utilisation", "gauge", "Share of the rate limit used recently", ("bucket",))
+    throttled = metrics.Family("ratelimit_throttled_total", "counter", "429 responses from Kite", ("bucket",))
+    for name, bucket in ratelimit.stats().items():
+        queued.add(bucket["queued"], bucket=name)
+        utilisation.add(bucket["utilisation"], bucket=name)
+        throttled.add(bucket["throttled"], bucket=name)
+    yield from (queued, utilisation, throttled)
+
+    yield metrics.Family("sessions_active", "gauge", "Logged-in sessions held by this worker").add(len(session_store))
+
+metrics.add_collector(collect_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint"""
+    client_host = request.client.host if request.client else None
+    if not metrics.scrape_allowed(request.headers.get("authorization"), client_host):
+        return JSONResponse(status_code=401, content={"error": "Not authorised to read metrics"})
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/executions/stats")
+async def get_execution_stats(request: Request):
+    """Sliced execution counters"""
+    return request.state.session.executions.stats()
+
+@app.get("/api/cluster/stats")
+async def get_cluster_stats():
+    """Which worker holds the upstream ticker, and what it relays"""
+    return ticker_coordinator.stats()
+
+@app.get("/api/sessions/stats")
+async def get_session_stats():
+    """Session store size and churn"""
+    return session_store.stats()
+
+@app.get("/api/quotes/stats")
+async def get_quote_stats():
+    """Quote aggregator batching and cache counters"""
+    return quotes.stats()
+
+@app.get("/api/ratelimit/stats")
+async def get_rate_limit_stats():
+    """Token bucket utilisation per Kite endpoint class"""
+    return ratelimit.stats()
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Broker response cache hit ratios"""
+    return cache.stats()
+
 @app.post("/api/quotes")
-async def get_quotes(symbols: dict):
+async def get_quotes(request: Request, symbols: dict):
     """Get quotes for multiple symbols"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated"}
             )
 
-        kite.set_access_token(access_token["token"])
-        quotes = kite.quote(symbols["symbols"])
+        kite = session.kite
+        unknown = instrument_master.unknown(symbols["symbols"])
+        if unknown:
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Unknown symbols: {', '.join(unknown)}"}
+            )
+        batch = await quotes.get(kite, symbols["symbols"], "quote")
         
         formatted_quotes = []
-        for symbol, quote in quotes.items():
+        for symbol, quote in batch.items():
             formatted_quotes.append({
                 "symbol": symbol,
                 "last_price": quote["last_price"],
-                "change_percent": quote["change_percent"]
+                "change_percent": quotes.change_percent(quote)
             })
         
         return JSONResponse(content=formatted_quotes)
+    except broker.RateLimitedError:
+        raise
     except Exception as e:
         logger.error(f"Error fetching quotes: {str(e)}")
         return JSONResponse(
@@ -565,30 +1057,39 @@ async def get_quotes(symbols: dict):
         )
 
 @app.get("/api/historical/{symbol}")
-async def get_historical_data(symbol: str, days: int = 30):
+async def get_historical_data(request: Request, symbol: str, days: int = 30, interval: str = "day"):
     """Get historical data for a symbol"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated"}
             )
 
-        kite.set_access_token(access_token["token"])
+        kite = session.kite
         
         # Get historical data
         from datetime import datetime, timedelta
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
         
-        data = kite.historical_data(
-            instrument_token=kite.ltp(symbol)[symbol]["instrument_token"],
-            from_date=start_date,
-            to_date=end_date,
-            interval="day"
-        )
+        tokens = await resolve_tokens(kite, [symbol])
+        if symbol not in tokens:
+            return JSONResponse(
+                status_code=404,
+                content={"error": f"Unknown symbol: {symbol}"}
+            )
+        if interval not in INTERVAL_LIMITS:
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Invalid interval: {interval}"}
+            )
+        data = await candle_store.get(kite, tokens[symbol], start_date, end_date, interval)
         
         return JSONResponse(content=data)
+    except broker.RateLimitedError:
+        raise
     except Exception as e:
         logger.error(f"Error fetching historical data: {str(e)}")
         return JSONResponse(
@@ -596,18 +1097,36 @@ async def get_historical_data(symbol: str, days: int = 30):
             content={"error": str(e)}
         )
 
+@app.get("/api/instruments/search")
+async def search_instruments(request: Request, q: str, segment: str = None, exchange: str = None, limit: int = 20):
+    """Autocomplete instruments by trading symbol prefix"""
+    instrument_master.ensure_fresh(request.state.session.kite)
+    return instrument_master.search(q, segment=segment, exchange=exchange, limit=min(limit, 100))
+
+@app.get("/api/instruments/{key}")
+async def get_instrument(key: str):
+    """Look up an instrument by exchange-prefixed symbol or token"""
+    instrument = instrument_master.get(key)
+    if instrument is None:
+        return JSONResponse(
+            status_code=404,
+            content={"error": f"Unknown instrument: {key}"}
+        )
+    return instrument
+
 @app.get("/api/mf_holdings")
-async def get_mf_holdings():
+async def get_mf_holdings(request: Request):
     """Get mutual fund holdings"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated"}
             )
 
-        kite.set_access_token(access_token["token"])
-        holdings = kite.mf_holdings()
+        kite = session.kite
+        holdings = await broker.call(kite.mf_holdings)
         
         return JSONResponse(content=holdings)
     except Exception as e:
@@ -618,17 +1137,18 @@ async def get_mf_holdings():
         )
 
 @app.get("/api/mf_orders")
-async def get_mf_orders():
+async def get_mf_orders(request: Request):
     """Get mutual fund orders"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated"}
             )
 
-        kite.set_access_token(access_token["token"])
-        orders = kite.mf_orders()
+        kite = session.kite
+        orders = await broker.call(kite.mf_orders)
         
         return JSONResponse(content=orders)
     except Exception as e:
@@ -639,18 +1159,20 @@ async def get_mf_orders():
         )
 
 @app.post("/api/place_mf_order")
-async def place_mf_order(order_data: dict):
+async def place_mf_order(request: Request, order_data: dict):
     """Place a mutual fund order"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated"}
             )
 
-        kite.set_access_token(access_token["token"])
+        kite = session.kite
         
-        order = kite.place_mf_order(
+        order = await broker.call(
+            kite.place_mf_order,
             tradingsymbol=order_data["symbol"],
             amount=order_data["amount"],
             transaction_type="BUY"
@@ -665,17 +1187,18 @@ async def place_mf_order(order_data: dict):
         )
 
 @app.post("/api/cancel_mf_order/{order_id}")
-async def cancel_mf_order(order_id: str):
+async def cancel_mf_order(request: Request, order_id: str):
     """Cancel a mutual fund order"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated"}
             )
 
-        kite.set_access_token(access_token["token"])
-        kite.cancel_mf_order(order_id)
+        kite = session.kite
+        await broker.call(kite.cancel_mf_order, order_id)
         
         return JSONResponse(content={"success": True})
     except Exception as e:
@@ -686,17 +1209,18 @@ async def cancel_mf_order(order_id: str):
         )
 
 @app.get("/api/mf_sips")
-async def get_mf_sips():
+async def get_mf_sips(request: Request):
     """Get mutual fund SIPs"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated"}
             )
 
-        kite.set_access_token(access_token["token"])
-        sips = kite.mf_sips()
+        kite = session.kite
+        sips = await broker.call(kite.mf_sips)
         
         return JSONResponse(content=sips)
     except Exception as e:
@@ -707,18 +1231,20 @@ async def get_mf_sips():
         )
 
 @app.post("/api/create_sip")
-async def create_sip(sip_data: dict):
+async def create_sip(request: Request, sip_data: dict):
     """Create a new SIP"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated"}
             )
 
-        kite.set_access_token(access_token["token"])
+        kite = session.kite
         
-        sip = kite.place_mf_sip(
+        sip = await broker.call(
+            kite.place_mf_sip,
             tradingsymbol=sip_data["symbol"],
             amount=sip_data["amount"],
             frequency="monthly",
@@ -734,17 +1260,18 @@ async def create_sip(sip_data: dict):
         )
 
 @app.post("/api/modify_sip/{sip_id}")
-async def modify_sip(sip_id: str, sip_data: dict):
+async def modify_sip(request: Request, sip_id: str, sip_data: dict):
     """Modify an existing SIP"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated"}
             )
 
-        kite.set_access_token(access_token["token"])
-        kite.modify_mf_sip(sip_id, amount=sip_data["amount"])
+        kite = session.kite
+        await broker.call(kite.modify_mf_sip, sip_id, amount=sip_data["amount"])
         
         return JSONResponse(content={"success": True})
     except Exception as e:
@@ -755,17 +1282,18 @@ async def modify_sip(sip_id: str, sip_data: dict):
         )
 
 @app.post("/api/cancel_sip/{sip_id}")
-async def cancel_sip(sip_id: str):
+async def cancel_sip(request: Request, sip_id: str):
     """Cancel a SIP"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             return JSONResponse(
                 status_code=401,
                 content={"error": "Not authenticated"}
             )
 
-        kite.set_access_token(access_token["token"])
-        kite.cancel_mf_sip(sip_id)
+        kite = session.kite
+        await broker.call(kite.cancel_mf_sip, sip_id)
         
         return JSONResponse(content={"success": True})
     except Exception as e:
@@ -775,37 +1303,69 @@ async def cancel_sip(sip_id: str):
             content={"error": str(e)}
         )
 
+async def _mf_catalogue(request: Request):
+    """Error response unless the session can read the mutual fund catalogue"""
+    session = request.state.session
+    if session is None:
+        return JSONResponse(
+            status_code=401,
+            content={"error": "Not authenticated"}
+        )
+    await mf_catalogue.ensure_loaded(session.kite)
+    if not mf_catalogue.loaded:
+        return JSONResponse(
+            status_code=503,
+            content={"error": "Mutual fund catalogue is not available yet"}
+        )
+    return None
+
 @app.get("/api/available_mf")
-async def get_available_mf():
-    """Get list of available mutual funds"""
-    try:
-        if not access_token.get("token"):
-            return JSONResponse(
-                status_code=401,
-                content={"error": "Not authenticated"}
-            )
+async def get_available_mf(request: Request, q: str = "", amc: str = None, scheme_type: str = None,
+                           plan: str = None, dividend_type: str = None, offset: int = 0, limit: int = 20):
+    """Search available mutual funds, one page at a time"""
+    error = await _mf_catalogue(request)
+    if error is not None:
+        return error
+    return mf_catalogue.search(
+        q, amc=amc, scheme_type=scheme_type, plan=plan, dividend_type=dividend_type,
+        offset=offset, limit=limit
+    )
 
-        kite.set_access_token(access_token["token"])
-        funds = kite.mf_instruments()
-        
-        return JSONResponse(content=funds)
-    except Exception as e:
-        logger.error(f"Error fetching available MF: {str(e)}")
+@app.get("/api/available_mf/facets")
+async def get_available_mf_facets(request: Request):
+    """AMCs, scheme types, plans and dividend types with their scheme counts"""
+    error = await _mf_catalogue(request)
+    if error is not None:
+        return error
+    return mf_catalogue.facets()
+
+@app.get("/api/available_mf/{isin}")
+async def get_mutual_fund(request: Request, isin: str):
+    """Look up a mutual fund scheme by ISIN"""
+    error = await _mf_catalogue(request)
+    if error is not None:
+        return error
+    fund = mf_catalogue.get(isin)
+    if fund is None:
         return JSONResponse(
-            status_code=500,
-            content={"error": str(e)}
+            status_code=404,
+            content={"error": f"Unknown mutual fund: {isin}"}
         )
+    return fund
 
 @app.get("/logout")
-async def logout():
+async def logout(request: Request):
     """Handle user logout"""
     try:
-        # Clear the access token
-        access_token.clear()
+        # End the session; this also releases its client and books
+        if request.state.session is not None:
+            await session_store.delete(request.state.session.id)
         logger.info("User logged out successfully")
         
         # Redirect to home page
-        return RedirectResponse("/")
+        response = RedirectResponse("/")
+        response.delete_cookie(SESSION_COOKIE)
+        return response
     except Exception as e:
         logger.error(f"Error during logout: {str(e)}")
         logger.error(traceback.format_exc())
@@ -814,25 +1374,55 @@ async def logout():
 @app.get("/analytics", response_class=HTMLResponse)
 async def analytics_dashboard(request: Request):
     """Advanced analytics dashboard"""
-    if not access_token.get("token"):
+    session = request.state.session
+    if session is None:
         return RedirectResponse("/login")
     return templates.TemplateResponse("analytics.html", {"request": request})
 
+@app.get("/api/portfolio/risk")
+async def get_portfolio_risk(request: Request):
+    """Full risk report for the portfolio, including the covariance matrix"""
+    try:
+        session = request.state.session
+        if session is None:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+
+        kite = session.kite
+        holdings = await cache.fetch("holdings", kite.holdings)
+        return await analytics.risk_metrics(kite, Holdings.from_payload(holdings), wait=analytics.ANALYTICS_WAIT)
+    except (HTTPException, broker.RateLimitedError):
+        raise
+    except Exception as e:
+        logger.error(f"Error in portfolio risk: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/portfolio/analytics")
-async def get_portfolio_analytics():
+async def get_portfolio_analytics(request: Request, days: int = analytics.PERFORMANCE_DAYS):
     """Get portfolio analytics data"""
     try:
-        if not access_token.get("token"):
+        session = request.state.session
+        if session is None:
             raise HTTPException(status_code=401, detail="Not authenticated")
 
-        kite.set_access_token(access_token["token"])
+        kite = session.kite
         
         # Get holdings and positions
-        holdings = kite.holdings()
-        positions = kite.positions()
+        snapshot = await load_snapshot(kite, ("holdings", "positions"))
+        if "holdings" in snapshot["errors"]:
+            raise HTTPException(status_code=502, detail=snapshot["errors"]["holdings"])
+        # One columnar pass over the holdings feeds every calculation below
+        holdings = Holdings.from_payload(snapshot["holdings"])
+        positions = snapshot["positions"]
         
+        # Risk metrics and performance history come from daily candles (cached per
+        # trading day); a first computation still running is reported as pending
+        risk_metrics, performance = await asyncio.gather(
+            calculate_risk_metrics(kite, holdings, wait=analytics.ANALYTICS_WAIT),
+            calculate_performance_data(kite, holdings, days, wait=analytics.ANALYTICS_WAIT),
+        )
+
         # Calculate metrics
-        metrics = calculate_portfolio_metrics(holdings, positions)
+        portfolio_metrics = calculate_portfolio_metrics(holdings, positions, risk_metrics)
         
         # Calculate sector allocation
         sector_allocation = calculate_sector_allocation(holdings)
@@ -840,159 +1430,56 @@ async def get_portfolio_analytics():
         # Calculate asset class distribution
         asset_distribution = calculate_asset_distribution(holdings)
         
-        # Calculate performance data
-        performance = calculate_performance_data(holdings)
-        
-        # Calculate risk metrics
-        risk_metrics = calculate_risk_metrics(holdings)
-        
         return {
-            "metrics": metrics,
+            "metrics": portfolio_metrics,
             "sectorAllocation": sector_allocation,
             "assetClassDistribution": asset_distribution,
             "performance": performance,
-            "riskMetrics": risk_metrics
+            "riskMetrics": risk_metrics,
+            "pending": risk_metrics["pending"] or performance["pending"]
         }
+    except (HTTPException, broker.RateLimitedError):
+        raise
     except Exception as e:
         logger.error(f"Error in portfolio analytics: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-def calculate_portfolio_metrics(holdings, positions):
+def calculate_portfolio_metrics(holdings, positions, risk_metrics):
     """Calculate key portfolio metrics"""
-    total_value = sum(holding["last_price"] * holding["quantity"] for holding in holdings)
-    daily_pnl = sum(holding["pnl"] for holding in holdings)
-    
-    # Calculate returns for Sharpe ratio
-    returns = [holding["pnl"] / (holding["average_price"] * holding["quantity"]) 
-              for holding in holdings if holding["quantity"] > 0]
-    
-    if returns:
-        sharpe_ratio = np.mean(returns) / np.std(returns) if np.std(returns) != 0 else 0
-    else:
-        sharpe_ratio = 0
-    
-    # Calculate beta (simplified)
-    beta = 1.0  # Placeholder - would need historical data for proper calculation
-    
+    # Sharpe ratio and beta come from the time series of daily portfolio returns
     return {
-        "totalValue": total_value,
-        "dailyPnL": daily_pnl,
-        "sharpeRatio": sharpe_ratio,
-        "beta": beta
+        "totalValue": holdings.total_value,
+        "dailyPnL": holdings.total_pnl,
+        "sharpeRatio": risk_metrics["sharpeRatio"],
+        "beta": risk_metrics["beta"]
     }
 
 def calculate_sector_allocation(holdings):
     """Calculate sector allocation of portfolio"""
-    sector_values = defaultdict(float)
-    
-    for holding in holdings:
-        if holding["quantity"] > 0:
-            # Get sector information (you would need to maintain a mapping of stocks to sectors)
-            sector = get_stock_sector(holding["tradingsymbol"])
-            value = holding["last_price"] * holding["quantity"]
-            sector_values[sector] += value
-    
-    total_value = sum(sector_values.values())
-    
-    # Convert to percentages
-    labels = []
-    values = []
-    for sector, value in sector_values.items():
-        labels.append(sector)
-        values.append((value / total_value) * 100)
-    
-    return {
-        "labels": labels,
-        "values": values
-    }
+    return holdings.allocation(classifications.for_holdings(holdings)["sector"])
 
 def calculate_asset_distribution(holdings):
     """Calculate asset class distribution"""
-    asset_values = defaultdict(float)
-    
-    for holding in holdings:
-        if holding["quantity"] > 0:
-            # Determine asset class (equity, debt, etc.)
-            asset_class = get_asset_class(holding["tradingsymbol"])
-            value = holding["last_price"] * holding["quantity"]
-            asset_values[asset_class] += value
-    
-    total_value = sum(asset_values.values())
-    
-    # Convert to percentages
-    labels = []
-    values = []
-    for asset_class, value in asset_values.items():
-        labels.append(asset_class)
-        values.append((value / total_value) * 100)
-    
-    return {
-        "labels": labels,
-        "values": values
-    }
+    return holdings.allocation(classifications.for_holdings(holdings)["asset_class"])
 
-def calculate_performance_data(holdings):
+async def calculate_performance_data(kite, holdings, days=analytics.PERFORMANCE_DAYS, wait=None):
     """Calculate performance data for chart"""
-    # This is a simplified version - in reality, you'd want historical data
-    dates = [(datetime.now() - timedelta(days=x)).strftime('%Y-%m-%d') for x in range(30, 0, -1)]
-    
-    # Placeholder data - in reality, you'd calculate this from historical prices
-    portfolio_values = [100000 * (1 + 0.001 * i) for i in range(30)]
-    benchmark_values = [100000 * (1 + 0.0008 * i) for i in range(30)]
-    
-    return {
-        "dates": dates,
-        "portfolioValues": portfolio_values,
-        "benchmarkValues": benchmark_values
-    }
+    return await analytics.performance_series(kite, holdings, days, wait=wait)
 
-def calculate_risk_metrics(holdings):
-    """Calculate risk metrics for the portfolio"""
-    # These are simplified calculations - in reality, you'd need historical data
-    return {
-        "volatility": 0.15,  # 15% annualized volatility
-        "beta": 1.0,
-        "sharpeRatio": 1.5,
-        "alpha": 0.02,  # 2% alpha
-        "informationRatio": 0.8
-    }
-
-def get_stock_sector(tradingsymbol):
-    """Get sector for a stock (placeholder - you would need to maintain this mapping)"""
-    # This is a placeholder - you would need to maintain a mapping of stocks to sectors
-    sectors = {
-        "RELIANCE": "Energy",
-        "TCS": "IT",
-        "HDFCBANK": "Banking",
-        "INFY": "IT",
-        # Add more mappings as needed
-    }
-    return sectors.get(tradingsymbol, "Others")
-
-def get_asset_class(tradingsymbol):
-    """Get asset class for a security (placeholder - you would need to maintain this mapping)"""
-    # This is a placeholder - you would need to maintain a mapping of securities to asset classes
-    asset_classes = {
-        "RELIANCE": "Equity",
-        "TCS": "Equity",
-        "HDFCBANK": "Equity",
-        "INFY": "Equity",
-        # Add more mappings as needed
-    }
-    return asset_classes.get(tradingsymbol, "Others")
+async def calculate_risk_metrics(kite, holdings, wait=None):
+    """Calculate risk metrics for the portfolio (without the covariance matrix)"""
+    risk = await analytics.risk_metrics(kite, holdings, wait=wait)
+    return {key: value for key, value in risk.items() if key != "covariance"}
 
 @app.get("/orders", response_class=HTMLResponse)
 async def orders_page(request: Request):
     """Orders page showing order history and order placement form"""
     try:
-        if not access_token.get("token"):
-            logger.warning("No access token found, redirecting to login")
+        session = request.state.session
+        if session is None:
+            logger.warning("No session found, redirecting to login")
             return RedirectResponse("/login")
 
-        # Set the access token
-        kite.set_access_token(access_token["token"])
-        logger.info("Access token set successfully")
-
         return templates.TemplateResponse("orders.html", {"request": request})
     except Exception as e:
         error_msg = f"Orders page error: {str(e)}\n{traceback.format_exc()}"
@@ -1003,14 +1490,11 @@ async def orders_page(request: Request):
 async def positions_page(request: Request):
     """Positions page showing current positions"""
     try:
-        if not access_token.get("token"):
-            logger.warning("No access token found, redirecting to login")
+        session = request.state.session
+        if session is None:
+            logger.warning("No session found, redirecting to login")
             return RedirectResponse("/login")
 
-        # Set the access token
-        kite.set_access_token(access_token["token"])
-        logger.info("Access token set successfully")
-
         return templates.TemplateResponse("positions.html", {"request": request})
     except Exception as e:
         error_msg = f"Positions page error: {str(e)}\n{traceback.format_exc()}"
@@ -0,0 +1,235 @@
+"""Prometheus metrics.
+
+Counters, gauges and histograms are kept in process and served in the
+Prometheus text format by ``GET /metrics``. Hot paths update them directly:
+HTTP routes, ``kite.*`` calls and ticks. Numbers other modules already keep
+in ``stats()``, such as cache hits and WebSocket queue depths, are read by
+collectors at scrape time instead of being counted twice. Every worker
+reports its own values.
+
+Scrapes must send ``Authorization: Bearer <METRICS_TOKEN>``. Without a token
+configured, only clients on the loopback interface are served.
+"""
+import hmac
+import math
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LOOPBACK_HOSTS = ("127.0.0.1", "::1")
+
+# Seconds; spans a cached response up to a slow historical-data call
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """A named metric with a fixed set of label names"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        # Updated from broker threads as well as the event loop
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> Iterable[Tuple[str, Sequence[str], LabelValues, float]]:
+        """(name suffix, label names, label values, value) for each series"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [("", self.labels, key, value) for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts, sum, count)
+        self._values: Dict[LabelValues, List] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(series[0]), series[1], series[2]) for key, series in self._values.items()]
+        names = self.labels + ("le",)
+        samples = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", names, key + (_format_value(bound),), cumulative))
+            samples.append(("_bucket", names, key + ("+Inf",), count))
+            samples.append(("_sum", self.labels, key, total))
+            samples.append(("_count", self.labels, key, count))
+        return samples
+
+
+class Family(Metric):
+    """Values read at scrape time, built by a collector"""
+
+    def __init__(self, name: str, kind: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self._samples: List[Tuple[LabelValues, float]] = []
+
+    def add(self, value: float, **labels: str) -> "Family":
+        self._samples.append((self._key(labels), value))
+        return self
+
+    def samples(self):
+        return [("", self.labels, key, value) for key, value in self._samples]
+
+
+Collector = Callable[[], Iterable[Family]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._collectors: List[Collector] = []
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        """Call ``collector()`` on every scrape for extra metric families"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for family in collector():
+                lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+    return registry.register(Counter(name, help, labels))
+
+
+def gauge(name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+    return registry.register(Gauge(name, help, labels))
+
+
+def histogram(name: str, help: str, labels: Sequence[str] = (),
+              buckets: Optional[Sequence[float]] = None) -> Histogram:
+    return registry.register(Histogram(name, help, labels, buckets or LATENCY_BUCKETS))
+
+
+def add_collector(collector: Collector) -> None:
+    registry.add_collector(collector)
+
+
+def render() -> str:
+    return registry.render()
+
+
+def scrape_allowed(authorization: Optional[str], client_host: Optional[str],
+                   token: Optional[str] = None) -> bool:
+    """Whether a request may read the metrics"""
+    token = METRICS_TOKEN if token is None else token
+    if not token:
+        return client_host in LOOPBACK_HOSTS
+    return hmac.compare_digest((authorization or "").encode(), f"Bearer {token}".encode())
+
+
+# Metrics updated on hot paths
+
+http_requests = counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_request_duration = histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+http_in_flight = gauge("http_requests_in_flight", "HTTP requests being served", ("method", "route"))
+
+kite_call_duration = histogram("kite_call_duration_seconds", "Latency of kite.* calls", ("method",))
+kite_call_errors = counter("kite_call_errors_total", "Failed kite.* calls by error type", ("method", "error"))
+
+ticks = counter("ticker_ticks_total", "Ticks dispatched, from this worker's connection or relayed", ("source",))
@@ -0,0 +1,263 @@
+"""Mutual fund catalogue.
+
+``kite.mf_instruments()`` lists every scheme, thousands of them. The dump is
+downloaded once a day, stored on disk as a NumPy structured array and
+memory-mapped at startup, like the instrument master. Schemes are indexed by
+AMC, scheme type, plan and dividend type, and by the words of their name, so
+a search intersects a few small row lists and returns one page of results
+instead of the whole catalogue.
+
+A failed download is not retried for ``MF_REFRESH_RETRY`` seconds, so an
+unreachable Kite is not asked again on every request.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import date, datetime
+from functools import reduce
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+import broker
+from instruments import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+MF_INSTRUMENTS_PATH = os.path.join(DATA_DIR, "mf_instruments.npy")
+MF_REFRESH_RETRY = float(os.getenv("MF_REFRESH_RETRY", "300"))
+
+DTYPE = np.dtype([
+    ("tradingsymbol", "S12"),
+    ("name", "S128"),
+    ("amc", "S48"),
+    ("scheme_type", "S16"),
+    ("plan", "S8"),
+    ("dividend_type", "S16"),
+    ("settlement_type", "S8"),
+    ("purchase_allowed", "?"),
+    ("redemption_allowed", "?"),
+    ("minimum_purchase_amount", "<f8"),
+    ("purchase_amount_multiplier", "<f8"),
+    ("minimum_additional_purchase_amount", "<f8"),
+    ("minimum_redemption_quantity", "<f8"),
+    ("redemption_quantity_multiplier", "<f8"),
+    ("last_price", "<f8"),
+    ("last_price_date", "S10"),
+])
+
+_STRING_FIELDS = [name for name in DTYPE.names if DTYPE[name].kind == "S"]
+_FLAG_FIELDS = [name for name in DTYPE.names if DTYPE[name].kind == "b"]
+
+# Fields a search can filter on exactly (case-insensitive)
+FACETS = ("amc", "scheme_type", "plan", "dividend_type")
+
+SEARCH_MAX_LIMIT = 100
+
+_WORD = re.compile(rb"[A-Z0-9]+")
+
+_EMPTY = np.array([], dtype=np.intp)
+
+
+def _encode(value: Any, size: int) -> bytes:
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    return str(value or "").encode("utf-8")[:size]
+
+
+def to_records(funds: Iterable[Dict[str, Any]]) -> np.ndarray:
+    """Convert a ``kite.mf_instruments()`` payload into a structured array"""
+    sizes = {name: DTYPE[name].itemsize for name in _STRING_FIELDS}
+    rows = [
+        tuple(
+            _encode(fund.get(name), sizes[name]) if name in sizes
+            else bool(fund.get(name)) if name in _FLAG_FIELDS
+            else float(fund.get(name) or 0)
+            for name in DTYPE.names
+        )
+        for fund in funds
+    ]
+    records = np.array(rows, dtype=DTYPE)
+    records.sort(order="name")
+    return records
+
+
+def _group(keys: np.ndarray) -> Dict[bytes, np.ndarray]:
+    """Sorted row numbers for each distinct key"""
+    values, inverse = np.unique(keys, return_inverse=True)
+    order = np.argsort(inverse, kind="stable")
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(values)))[:-1]
+    return dict(zip(values.tolist(), np.split(order, bounds)))
+
+
+def _intersect(rows: np.ndarray, other: np.ndarray) -> np.ndarray:
+    """Rows in both sorted arrays, looking up the shorter one in the longer"""
+    if len(rows) > len(other):
+        rows, other = other, rows
+    if not len(rows) or not len(other):
+        return _EMPTY
+    positions = np.searchsorted(other, rows).clip(max=len(other) - 1)
+    return rows[other[positions] == rows]
+
+
+class MFCatalogue:
+    """Memory-mapped mutual fund schemes with facet and name-word indexes"""
+
+    def __init__(self, path: str = MF_INSTRUMENTS_PATH):
+        self.path = path
+        self.records: Optional[np.ndarray] = None
+        self.loaded_on: Optional[date] = None
+        self._by_symbol: Dict[bytes, int] = {}
+        # facet -> lower-cased value -> row numbers
+        self._facets: Dict[str, Dict[bytes, np.ndarray]] = {}
+        # Sorted name words and the rows each appears in, for prefix lookups
+        self._words = np.array([], dtype="S1")
+        self._postings: List[np.ndarray] = []
+        self._refreshing: Optional[asyncio.Task] = None
+        # Monotonic time of the last failed refresh
+        self.failed_at: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.records is not None
+
+    @property
+    def stale(self) -> bool:
+        return self.loaded_on is None or self.loaded_on < date.today()
+
+    def __len__(self) -> int:
+        return 0 if self.records is None else len(self.records)
+
+    def load(self) -> bool:
+        """Map the on-disk catalogue, if there is one"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            records = np.load(self.path, mmap_mode="r")
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading mutual fund catalogue: {str(e)}")
+            return False
+        self._index(records)
+        self.loaded_on = datetime.fromtimestamp(os.path.getmtime(self.path)).date()
+        logger.info(f"Loaded {len(records)} mutual fund schemes from {self.path}")
+        return True
+
+    def _index(self, records: np.ndarray) -> None:
+        self._by_symbol = {symbol: i for i, symbol in enumerate(records["tradingsymbol"].tolist())}
+        self._facets = {field: _group(np.char.lower(records[field])) for field in FACETS}
+        words: Dict[bytes, List[int]] = {}
+        for i, name in enumerate(np.char.upper(records["name"]).tolist()):
+            for word in set(_WORD.findall(name)):
+                words.setdefault(word, []).append(i)
+        vocabulary = sorted(words)
+        self._words = np.array(vocabulary, dtype=bytes)
+        self._postings = [np.array(words[word], dtype=np.intp) for word in vocabulary]
+        self.records = records
+
+    async def refresh(self, kite) -> None:
+        """Download today's catalogue and replace the on-disk copy"""
+        funds = await broker.call(kite.mf_instruments, timeout=120)
+        records = await asyncio.get_running_loop().run_in_executor(None, to_records, funds)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, records)
+        os.replace(tmp_path, self.path)
+        self.load()
+
+    @property
+    def backing_off(self) -> bool:
+        """Whether the last refresh failed less than ``MF_REFRESH_RETRY`` seconds ago"""
+        return self.failed_at is not None and time.monotonic() - self.failed_at < MF_REFRESH_RETRY
+
+    def ensure_fresh(self, kite) -> Optional[asyncio.Task]:
+        """Refresh in the background when the catalogue is missing or from a previous day"""
+        if not self.stale:
+            return None
+        if self._refreshing is None or self._refreshing.done():
+            if self.backing_off:
+                return None
+            self._refreshing = asyncio.ensure_future(self._refresh_logged(kite))
+        return self._refreshing
+
+    async def _refresh_logged(self, kite) -> None:
+        try:
+            await self.refresh(kite)
+        except Exception as e:
+            self.failed_at = time.monotonic()
+            logger.error(f"Error refreshing mutual fund catalogue, retrying in {MF_REFRESH_RETRY:.0f}s: {str(e)}")
+        else:
+            self.failed_at = None
+
+    async def ensure_loaded(self, kite) -> None:
+        """Refresh when stale, waiting for it only if there is nothing to serve yet"""
+        refreshing = self.ensure_fresh(kite)
+        if refreshing is not None and not self.loaded:
+            await asyncio.shield(refreshing)
+
+    # Lookups
+
+    def _rows(self, indexes: np.ndarray) -> List[Dict[str, Any]]:
+        return [
+            {
+                name: value.decode("utf-8", "ignore") if isinstance(value, bytes) else value
+                for name, value in zip(DTYPE.names, record)
+            }
+            for record in self.records[indexes].tolist()
+        ]
+
+    def get(self, isin: str) -> Optional[Dict[str, Any]]:
+        """Scheme by ISIN (Kite's trading symbol for funds)"""
+        index = self._by_symbol.get(isin.upper().encode())
+        return None if index is None else self._rows(np.array([index]))[0]
+
+    def _word_rows(self, prefix: bytes) -> np.ndarray:
+        """Rows with a name word starting with ``prefix``"""
+        start = int(np.searchsorted(self._words, prefix, side="left"))
+        end = int(np.searchsorted(self._words, prefix + b"\xff", side="left"))
+        if end - start == 1:
+            return self._postings[start]
+        if end == start:
+            return _EMPTY
+        return np.unique(np.concatenate(self._postings[start:end]))
+
+    def facets(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Distinct values of each filterable field with their scheme counts"""
+        return {
+            field: [
+                {"value": self.records[field][rows[0]].decode("utf-8", "ignore"), "count": len(rows)}
+                for value, rows in groups.items() if value
+            ]
+            for field, groups in self._facets.items()
+        }
+
+    def search(self, q: str = "", amc: Optional[str] = None, scheme_type: Optional[str] = None,
+               plan: Optional[str] = None, dividend_type: Optional[str] = None,
+               offset: int = 0, limit: int = 20) -> Dict[str, Any]:
+        """One page of schemes matching every filter and every word of ``q`` (as prefixes)"""
+        filters = {"amc": amc, "scheme_type": scheme_type, "plan": plan, "dividend_type": dividend_type}
+        limit = max(0, min(limit, SEARCH_MAX_LIMIT))
+        offset = max(0, offset)
+        if not self.loaded:
+            return {"total": 0, "offset": offset, "limit": limit, "results": []}
+        matches = [
+            self._facets[field].get(value.lower().encode(), _EMPTY)
+            for field, value in filters.items() if value
+        ]
+        matches.extend(self._word_rows(word) for word in set(_WORD.findall(q.upper().encode())))
+        if matches:
+            matches.sort(key=len)
+            rows = reduce(_intersect, matches)
+        else:
+            rows = np.arange(len(self.records))
+        return {
+            "total": int(len(rows)),
+            "offset": offset,
+            "limit": limit,
+            "results": self._rows(rows[offset:offset + limit]),
+        }
+
+
+catalogue = MFCatalogue()
@@ -0,0 +1,164 @@
+"""In-memory order book fed by pushed order updates.
+
+The book is seeded once from ``kite.orders()``. After that it is kept current
+by the order updates Kite pushes, both on the ticker connection and to the
+postback webhook, so reading the order book needs no REST call. Both sources
+can deliver the same update, and they can arrive out of order. An update is
+applied only if it changes the order, and never moves an order back out of a
+terminal status or lowers its filled quantity.
+
+``kite.orders()`` returns timestamps as datetimes but pushed updates carry
+strings, so timestamps are parsed as orders enter the book.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import cache
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"COMPLETE", "CANCELLED", "REJECTED"}
+
+# Fields whose change is worth pushing to clients
+_TRACKED_FIELDS = (
+    "status", "filled_quantity", "pending_quantity", "cancelled_quantity",
+    "quantity", "price", "trigger_price", "average_price", "status_message",
+)
+
+# Timestamps Kite sends as "YYYY-MM-DD HH:MM:SS" strings in pushed updates
+TIMESTAMP_FIELDS = ("order_timestamp", "exchange_timestamp", "exchange_update_timestamp")
+
+OrderListener = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def verify_postback(order: Dict[str, Any], api_secret: str) -> bool:
+    """Check a postback's checksum: SHA-256 of order_id + order_timestamp + api_secret"""
+    payload = f"{order.get('order_id', '')}{order.get('order_timestamp', '')}{api_secret}"
+    expected = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    return hmac.compare_digest(expected, str(order.get("checksum", "")))
+
+
+def parse_timestamps(order: Dict[str, Any]) -> Dict[str, Any]:
+    """The order with string timestamps converted to datetimes; a copy if any were strings"""
+    parsed = {}
+    for field in TIMESTAMP_FIELDS:
+        value = order.get(field)
+        if isinstance(value, str):
+            try:
+                parsed[field] = datetime.fromisoformat(value) if value else None
+            except ValueError:
+                logger.warning(f"Unparseable {field} {value!r} for order {order.get('order_id')}")
+                parsed[field] = None
+    return {**order, **parsed} if parsed else order
+
+
+def _sort_key(order: Dict[str, Any]) -> datetime:
+    timestamp = order.get("order_timestamp")
+    return timestamp if isinstance(timestamp, datetime) else datetime.min
+
+
+class OrderBook:
+    """Orders keyed by order_id, updated from pushed order updates"""
+
+    def __init__(self):
+        self._orders: Dict[str, Dict[str, Any]] = {}
+        self._listeners: List[OrderListener] = []
+        self._loading: Optional[asyncio.Task] = None
+        self.seeded_at: Optional[datetime] = None
+        self.updates_applied = 0
+        self.updates_ignored = 0
+
+    @property
+    def seeded(self) -> bool:
+        return self.seeded_at is not None
+
+    def add_listener(self, listener: OrderListener) -> None:
+        """Receive every order that changed"""
+        self._listeners.append(listener)
+
+    # Seeding
+
+    async def load(self, kite) -> None:
+        """(Re)seed the book from the broker"""
+        self.seed(await cache.fetch("orders", kite.orders))
+
+    async def ensure_loaded(self, kite) -> None:
+        """Seed the book unless it already is, sharing a load already in flight"""
+        if self.seeded:
+            return
+        if self._loading is None or self._loading.done():
+            self._loading = asyncio.ensure_future(self.load(kite))
+        await asyncio.shield(self._loading)
+
+    def seed(self, orders: List[Dict[str, Any]]) -> None:
+        """Replace the book with a broker snapshot, keeping any newer pushed state"""
+        previous = self._orders
+        self._orders = {}
+        for order in map(parse_timestamps, orders):
+            known = previous.get(order["order_id"])
+            self._orders[order["order_id"]] = known if known is not None and self._stale(order, known) else order
+        # Orders pushed after the snapshot was taken
+        for order_id, order in previous.items():
+            self._orders.setdefault(order_id, order)
+        self.seeded_at = datetime.now()
+        logger.info(f"Seeded order book with {len(self._orders)} orders")
+
+    def reset(self) -> None:
+        self._orders.clear()
+        self.seeded_at = None
+
+    # Updates
+
+    @staticmethod
+    def _stale(update: Dict[str, Any], current: Dict[str, Any]) -> bool:
+        """Whether an update is older than what the book already holds"""
+        if current["status"] in TERMINAL_STATUSES and update.get("status") not in TERMINAL_STATUSES:
+            return True
+        return (update.get("filled_quantity") or 0) < (current.get("filled_quantity") or 0)
+
+    def apply(self, update: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Merge an order update; returns the order if it changed"""
+        order_id = update.get("order_id")
+        if not order_id:
+            return None
+        update = parse_timestamps(update)
+        current = self._orders.get(order_id)
+        if current is not None:
+            if self._stale(update, current) or all(
+                update.get(field, current.get(field)) == current.get(field) for field in _TRACKED_FIELDS
+            ):
+                self.updates_ignored += 1
+                return None
+            order = {**current, **{k: v for k, v in update.items() if k != "checksum"}}
+        else:
+            order = {k: v for k, v in update.items() if k != "checksum"}
+        self._orders[order_id] = order
+        self.updates_applied += 1
+        for listener in self._listeners:
+            asyncio.ensure_future(listener(order))
+        return order
+
+    async def on_order_update(self, update: Dict[str, Any]) -> None:
+        self.apply(update)
+
+    # Reads
+
+    def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        return self._orders.get(order_id)
+
+    def orders(self) -> List[Dict[str, Any]]:
+        """All orders, oldest first like ``kite.orders()``"""
+        return sorted(self._orders.values(), key=_sort_key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "orders": len(self._orders),
+            "open": sum(1 for order in self._orders.values() if order["status"] not in TERMINAL_STATUSES),
+            "updates_applied": self.updates_applied,
+            "updates_ignored": self.updates_ignored,
+            "seeded_at": self.seeded_at.isoformat(timespec="seconds") if self.seeded_at else None,
+        }
@@ -0,0 +1,310 @@
+"""Live position book with incremental mark-to-market P&L.
+
+The book is seeded once from ``kite.holdings()``, ``kite.positions()`` and the
+order book. After that it is kept current without REST calls: every tick
+reprices the entries for its instrument and adjusts the running totals by the
+difference, and order updates apply new fills to the day positions. Changed
+entries are collected and pushed to listeners at most once per
+``PNL_PUSH_INTERVAL`` seconds.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from kiteconnect import KiteTicker
+
+import broker
+import cache
+from portfolio import held_quantity
+
+logger = logging.getLogger(__name__)
+
+PNL_PUSH_INTERVAL = float(os.getenv("PNL_PUSH_INTERVAL", "1"))
+
+HOLDINGS = "holdings"
+POSITIONS = "positions"
+
+# (book, instrument token, product)
+EntryKey = Tuple[str, int, str]
+PnlListener = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def _pnl(entry: Dict[str, Any]) -> float:
+    """Mark-to-market P&L the way Kite reports it"""
+    if entry["book"] == HOLDINGS:
+        return (entry["last_price"] - entry["average_price"]) * entry["quantity"]
+    return (entry["sell_value"] - entry["buy_value"]
+            + entry["quantity"] * entry["last_price"] * entry["multiplier"])
+
+
+class PositionBook:
+    """Holdings and net positions repriced tick by tick"""
+
+    def __init__(self, push_interval: float = PNL_PUSH_INTERVAL):
+        self.push_interval = push_interval
+        self._entries: Dict[EntryKey, Dict[str, Any]] = {}
+        self._by_token: Dict[int, List[EntryKey]] = {}
+        # order_id -> (filled quantity, filled value) already applied
+        self._filled: Dict[str, Tuple[int, float]] = {}
+        self.totals = {HOLDINGS: 0.0, POSITIONS: 0.0}
+        self.seeded_at: Optional[datetime] = None
+        self._bridge = None
+        self._listeners: List[PnlListener] = []
+        self._dirty: Set[EntryKey] = set()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._loading: Optional[asyncio.Task] = None
+        self.ticks_applied = 0
+        self.fills_applied = 0
+
+    @property
+    def seeded(self) -> bool:
+        return self.seeded_at is not None
+
+    def attach(self, bridge) -> None:
+        """Take ticks from a TickerBridge"""
+        self._bridge = bridge
+        bridge.add_listener(self.on_ticks)
+
+    def detach(self) -> None:
+        """Stop taking ticks and drop the book's subscriptions"""
+        self.reset()
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._bridge is not None:
+            self._bridge.remove_listener(self.on_ticks)
+            self._bridge = None
+
+    def add_listener(self, listener: PnlListener) -> None:
+        self._listeners.append(listener)
+
+    # Seeding
+
+    async def load(self, kite) -> None:
+        """(Re)seed the book from the broker
+
+        Positions and orders skip the cache so both come from the same moment.
+        """
+        holdings, positions, orders = await asyncio.gather(
+            cache.fetch("holdings", kite.holdings),
+            broker.call(kite.positions),
+            broker.call(kite.orders),
+        )
+        self.seed(holdings, positions, orders)
+
+    async def ensure_loaded(self, kite) -> None:
+        """Seed the book unless it already is, sharing a load already in flight"""
+        if self.seeded:
+            return
+        if self._loading is None or self._loading.done():
+            self._loading = asyncio.ensure_future(self.load(kite))
+        await asyncio.shield(self._loading)
+
+    def seed(self, holdings: List[Dict[str, Any]], positions: Dict[str, Any],
+             orders: List[Dict[str, Any]]) -> None:
+        """Replace the book with a broker snapshot
+
+        ``orders`` must be the order book of the same snapshot: fills it
+        reports are already in ``positions`` and are not applied again.
+        """
+        if orders is None:
+            raise ValueError("Seeding the position book needs the order book")
+        self._entries.clear()
+        self._by_token.clear()
+        self._filled.clear()
+        self.totals = {HOLDINGS: 0.0, POSITIONS: 0.0}
+        for holding in holdings:
+            quantity = held_quantity(holding)
+            if quantity:
+                self._add((HOLDINGS, holding["instrument_token"], holding.get("product", "CNC")), {
+                    "tradingsymbol": holding["tradingsymbol"],
+                    "exchange": holding["exchange"],
+                    "quantity": quantity,
+                    "average_price": holding["average_price"],
+                    "last_price": holding["last_price"],
+                })
+        for position in (positions or {}).get("net", []):
+            self._add((POSITIONS, position["instrument_token"], position["product"]), {
+                "tradingsymbol": position["tradingsymbol"],
+                "exchange": position["exchange"],
+                "quantity": position["quantity"],
+                "average_price": position["average_price"],
+                "last_price": position["last_price"],
+                "buy_quantity": position.get("buy_quantity", 0),
+                "sell_quantity": position.get("sell_quantity", 0),
+                "buy_value": position.get("buy_value", 0.0),
+                "sell_value": position.get("sell_value", 0.0),
+                "multiplier": position.get("multiplier") or 1,
+            })
+        # Fills already in the snapshot must not be applied again
+        for order in orders:
+            if order.get("filled_quantity"):
+                self._filled[order["order_id"]] = (
+                    order["filled_quantity"], order["filled_quantity"] * (order.get("average_price") or 0)
+                )
+        self.seeded_at = datetime.now()
+        self._dirty.clear()
+        self._resubscribe()
+        self._publish(self.snapshot())
+        logger.info(f"Seeded position book with {len(self._entries)} entries")
+
+    def reset(self) -> None:
+        """Forget everything, e.g. when the user logs out"""
+        self._entries.clear()
+        self._by_token.clear()
+        self._filled.clear()
+        self._dirty.clear()
+        self.totals = {HOLDINGS: 0.0, POSITIONS: 0.0}
+        self.seeded_at = None
+        if self._bridge is not None:
+            self._bridge.unsubscribe(self)
+
+    def _add(self, key: EntryKey, entry: Dict[str, Any]) -> Dict[str, Any]:
+        entry.update({"book": key[0], "instrument_token": key[1], "product": key[2]})
+        entry["pnl"] = _pnl(entry)
+        self._entries[key] = entry
+        self._by_token.setdefault(key[1], []).append(key)
+        self.totals[key[0]] += entry["pnl"]
+        return entry
+
+    def _resubscribe(self) -> None:
+        if self._bridge is None:
+            return
+        self._bridge.unsubscribe(self)
+        if self._by_token:
+            self._bridge.subscribe(self, list(self._by_token), KiteTicker.MODE_LTP)
+
+    # Updates
+
+    def _reprice(self, key: EntryKey, last_price: float) -> None:
+        entry = self._entries[key]
+        entry["last_price"] = last_price
+        pnl = _pnl(entry)
+        self.totals[key[0]] += pnl - entry["pnl"]
+        entry["pnl"] = pnl
+        self._dirty.add(key)
+
+    async def on_ticks(self, ticks: List[Dict[str, Any]]) -> None:
+        """Reprice the entries of each ticking instrument"""
+        for tick in ticks:
+            keys = self._by_token.get(tick["instrument_token"])
+            if not keys or tick.get("last_price") is None:
+                continue
+            for key in keys:
+                self._reprice(key, tick["last_price"])
+            self.ticks_applied += 1
+        self._schedule_flush()
+
+    async def on_order_update(self, order: Dict[str, Any]) -> None:
+        self.apply_order(order)
+
+    def apply_order(self, order: Dict[str, Any]) -> None:
+        """Apply the part of an order that filled since it was last seen"""
+        if not self.seeded:
+            return
+        order_id = order.get("order_id")
+        filled = order.get("filled_quantity") or 0
+        previous_quantity, previous_value = self._filled.get(order_id, (0, 0.0))
+        if not order_id or filled <= previous_quantity:
+            return
+        value = filled * (order.get("average_price") or 0)
+        self._filled[order_id] = (filled, value)
+        quantity, amount = filled - previous_quantity, value - previous_value
+
+        token = order["instrument_token"]
+        key = (POSITIONS, token, order.get("product", "CNC"))
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._add(key, {
+                "tradingsymbol": order["tradingsymbol"],
+                "exchange": order["exchange"],
+                "quantity": 0,
+                "average_price": 0.0,
+                "last_price": order.get("average_price") or 0.0,
+                "buy_quantity": 0,
+                "sell_quantity": 0,
+                "buy_value": 0.0,
+                "sell_value": 0.0,
+                "multiplier": 1,
+            })
+            if self._bridge is not None and len(self._by_token[token]) == 1:
+                self._bridge.subscribe(self, [token], KiteTicker.MODE_LTP)
+
+        side = "buy" if order["transaction_type"] == "BUY" else "sell"
+        entry[f"{side}_quantity"] += quantity
+        entry[f"{side}_value"] += amount
+        entry["quantity"] += quantity if side == "buy" else -quantity
+        if entry["quantity"] > 0 and entry["buy_quantity"]:
+            entry["average_price"] = entry["buy_value"] / entry["buy_quantity"]
+        elif entry["quantity"] < 0 and entry["sell_quantity"]:
+            entry["average_price"] = entry["sell_value"] / entry["sell_quantity"]
+        self.fills_applied += 1
+        self._reprice(key, entry["last_price"])
+        self._schedule_flush()
+
+    # Push
+
+    def _view(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "book": entry["book"],
+            "instrument_token": entry["instrument_token"],
+            "tradingsymbol": entry["tradingsymbol"],
+            "exchange": entry["exchange"],
+            "product": entry["product"],
+            "quantity": entry["quantity"],
+            "average_price": entry["average_price"],
+            "last_price": entry["last_price"],
+            "pnl": round(entry["pnl"], 2),
+        }
+
+    def _totals(self) -> Dict[str, float]:
+        return {
+            HOLDINGS: round(self.totals[HOLDINGS], 2),
+            POSITIONS: round(self.totals[POSITIONS], 2),
+            "total": round(self.totals[HOLDINGS] + self.totals[POSITIONS], 2),
+        }
+
+    def entries(self, book: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Current entries, optionally only those of one book"""
+        return [self._view(entry) for entry in self._entries.values() if book in (None, entry["book"])]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """The whole book in the shape of a ``pnl`` message"""
+        return {
+            "type": "pnl",
+            "snapshot": True,
+            "entries": self.entries(),
+            "totals": self._totals(),
+            "seededAt": self.seeded_at.isoformat(timespec="seconds") if self.seeded_at else None,
+        }
+
+    def _schedule_flush(self) -> None:
+        if not self._dirty or self._flush_handle is not None:
+            return
+        if not self._listeners:
+            self._dirty.clear()
+            return
+        self._flush_handle = asyncio.get_running_loop().call_later(self.push_interval, self._flush)
+
+    def _flush(self) -> None:
+        self._flush_handle = None
+        dirty, self._dirty = self._dirty, set()
+        entries = [self._view(self._entries[key]) for key in dirty if key in self._entries]
+        if not entries:
+            return
+        self._publish({"type": "pnl", "snapshot": False, "entries": entries, "totals": self._totals()})
+
+    def _publish(self, message: Dict[str, Any]) -> None:
+        for listener in self._listeners:
+            asyncio.ensure_future(listener(message))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "instruments": len(self._by_token),
+            "ticks_applied": self.ticks_applied,
+            "fills_applied": self.fills_applied,
+            "seeded_at": self.seeded_at.isoformat(timespec="seconds") if self.seeded_at else None,
+        }
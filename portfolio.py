@@ -0,0 +1,164 @@
+"""Portfolio snapshot loading.
+
+Holdings, positions and margins are independent REST calls, so they are
+fetched concurrently (through the response cache) and merged into a single
+snapshot. A failing part does not sink the others; it is reported under
+``errors`` instead.
+
+:class:`Holdings` turns a holdings payload into NumPy columns once. Every
+holdings view and portfolio analytic reads from those columns.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+import broker
+import cache
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PARTS = ("holdings", "positions", "margins")
+
+# Also fetches the order book, needed to seed the live position book
+SEED_PARTS = SNAPSHOT_PARTS + ("orders",)
+
+# Parts the position book is seeded from. They are fetched together, past the
+# cache, so the order book's fills are exactly those already in the positions.
+SEED_FRESH = ("positions", "orders")
+
+# Value used for a part that could not be fetched
+_EMPTY = {
+    "holdings": list,
+    "positions": dict,
+    "margins": dict,
+    "orders": list,
+}
+
+
+class SnapshotError(Exception):
+    """Raised when every part of a snapshot failed to load"""
+    pass
+
+
+def _fetch(kite, part: str, fresh: Iterable[str]) -> Awaitable[Any]:
+    fn = getattr(kite, part)
+    return broker.call(fn) if part in fresh else cache.fetch(part, fn)
+
+
+async def load_snapshot(kite, parts: Iterable[str] = SNAPSHOT_PARTS,
+                        fresh: Iterable[str] = ()) -> Dict[str, Any]:
+    """Fetch the requested portfolio parts concurrently
+
+    Parts listed in ``fresh`` skip the response cache.
+    """
+    parts, fresh = tuple(parts), tuple(fresh)
+    results = await asyncio.gather(
+        *(_fetch(kite, part, fresh) for part in parts),
+        return_exceptions=True
+    )
+
+    snapshot: Dict[str, Any] = {"errors": {}}
+    for part, result in zip(parts, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Failed to fetch {part}: {result}")
+            snapshot[part] = _EMPTY.get(part, dict)()
+            snapshot["errors"][part] = str(result)
+        else:
+            snapshot[part] = result
+
+    if len(snapshot["errors"]) == len(parts):
+        raise SnapshotError("; ".join(f"{part}: {msg}" for part, msg in snapshot["errors"].items()))
+    return snapshot
+
+
+HOLDINGS_DTYPE = np.dtype([
+    ("tradingsymbol", "U40"),
+    ("exchange", "U8"),
+    ("isin", "U12"),
+    ("instrument_token", "<i8"),
+    ("quantity", "<i8"),
+    ("average_price", "<f8"),
+    ("last_price", "<f8"),
+    ("pnl", "<f8"),
+])
+
+def held_quantity(holding: Dict[str, Any]) -> int:
+    """Shares held, counting those bought but not yet settled (T1)"""
+    return holding["quantity"] + (holding.get("t1_quantity") or 0)
+
+
+# Columns of a holding as shown in the UI
+HOLDING_FIELDS = ("tradingsymbol", "quantity", "average_price", "last_price", "pnl")
+
+
+class Holdings:
+    """Held instruments (quantity above zero) as columns, with a symbol index"""
+
+    def __init__(self, records: np.ndarray):
+        self.records = records
+        self.tradingsymbol = records["tradingsymbol"]
+        self.exchange = records["exchange"]
+        self.isin = records["isin"]
+        self.instrument_token = records["instrument_token"]
+        self.quantity = records["quantity"]
+        self.average_price = records["average_price"]
+        self.last_price = records["last_price"]
+        self.pnl = records["pnl"]
+        self.value = self.last_price * self.quantity
+        self.index = {symbol: i for i, symbol in enumerate(self.tradingsymbol.tolist())}
+
+    @classmethod
+    def from_payload(cls, holdings: Iterable[Dict[str, Any]]) -> "Holdings":
+        """Columns for ``kite.holdings()`` or position book entries"""
+        records = np.array([
+            (
+                h["tradingsymbol"], h.get("exchange", ""), h.get("isin") or "", h.get("instrument_token", 0),
+                held_quantity(h), h["average_price"], h["last_price"], h.get("pnl") or 0.0,
+            )
+            for h in holdings
+        ], dtype=HOLDINGS_DTYPE)
+        return cls(records[records["quantity"] > 0])
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def get(self, tradingsymbol: str) -> Optional[Dict[str, Any]]:
+        index = self.index.get(tradingsymbol)
+        return None if index is None else {field: self.records[field][index].item() for field in HOLDING_FIELDS}
+
+    @property
+    def total_value(self) -> float:
+        return float(self.value.sum())
+
+    @property
+    def total_pnl(self) -> float:
+        return float(self.pnl.sum())
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """One dict per holding with the UI's columns"""
+        columns = [self.records[field].tolist() for field in HOLDING_FIELDS]
+        return [dict(zip(HOLDING_FIELDS, values)) for values in zip(*columns)]
+
+    def allocation(self, labels: Sequence[str]) -> Dict[str, List]:
+        """Share of the portfolio value, in percent, for each label given per holding"""
+        names, groups = np.unique(np.asarray(labels, dtype=str), return_inverse=True)
+        values = np.bincount(groups, weights=self.value, minlength=len(names))
+        total = values.sum()
+        shares = values / total * 100 if total > 0 else np.zeros_like(values)
+        return {"labels": names.tolist(), "values": shares.tolist()}
+
+
+def open_positions(positions: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Net positions with a non-zero quantity, with the UI's columns"""
+    return [
+        {
+            "tradingsymbol": position["tradingsymbol"],
+            "net_quantity": position["quantity"],
+            "average_price": position["average_price"],
+            "pnl": position.get("pnl", 0),
+        }
+        for position in (positions or {}).get("net", [])
+        if position.get("quantity", 0) != 0
+    ]
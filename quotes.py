@@ -0,0 +1,176 @@
+"""Quote aggregator.
+
+Quote and LTP lookups from every client are collected for a short window
+(``QUOTE_BATCH_WINDOW_MS``) and sent as one ``kite.quote``/``kite.ltp`` call
+per ``QUOTE_BATCH_LIMIT`` instruments. Each caller then gets just the symbols
+it asked for. Results are kept for ``QUOTE_TTL`` seconds, and a symbol that is
+already being fetched is never requested twice. A fresh full quote also
+answers LTP lookups. Batches are kept per access token, so each user's
+symbols are fetched with their own session; the quotes fetched are shared.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import broker
+
+logger = logging.getLogger(__name__)
+
+QUOTE_BATCH_WINDOW_MS = float(os.getenv("QUOTE_BATCH_WINDOW_MS", "25"))
+QUOTE_TTL = float(os.getenv("QUOTE_TTL", "1"))
+
+# Instruments Kite accepts per call
+QUOTE_BATCH_LIMIT = {"quote": 500, "ltp": 1000}
+
+KINDS = tuple(QUOTE_BATCH_LIMIT)
+
+# (kind, access token) a batch is fetched for
+BatchKey = Tuple[str, str]
+
+
+def change_percent(quote: Dict[str, Any]) -> float:
+    """Change from the previous close, in percent"""
+    close = (quote.get("ohlc") or {}).get("close")
+    if not close:
+        return 0.0
+    return (quote["last_price"] - close) / close * 100
+
+
+def _chunks(items: List[str], size: int) -> Iterable[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class QuoteAggregator:
+    """Coalesces quote lookups across callers into batched broker calls"""
+
+    def __init__(self, window: float = QUOTE_BATCH_WINDOW_MS / 1000, ttl: float = QUOTE_TTL):
+        self.window = window
+        self.ttl = ttl
+        # kind -> symbol -> (fetched at, value)
+        self._values: Dict[str, Dict[str, Tuple[float, Dict[str, Any]]]] = {kind: {} for kind in KINDS}
+        # batch key -> symbol -> future for the batch it is waiting in
+        self._pending: Dict[BatchKey, Dict[str, asyncio.Future]] = {}
+        self._queued: Dict[BatchKey, Dict[str, asyncio.Future]] = {}
+        self._kite: Dict[BatchKey, Any] = {}
+        self._flush_handles: Dict[BatchKey, asyncio.TimerHandle] = {}
+        self.requests = 0
+        self.symbols_requested = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.broker_calls = 0
+
+    def _fresh(self, kind: str, symbol: str, now: float) -> Optional[Dict[str, Any]]:
+        entry = self._values[kind].get(symbol)
+        if entry is not None and now - entry[0] <= self.ttl:
+            return entry[1]
+        if kind == "ltp":
+            entry = self._values["quote"].get(symbol)
+            if entry is not None and now - entry[0] <= self.ttl:
+                return {"instrument_token": entry[1]["instrument_token"], "last_price": entry[1]["last_price"]}
+        return None
+
+    async def get(self, kite, symbols: Iterable[str], kind: str = "quote") -> Dict[str, Dict[str, Any]]:
+        """Quotes (or LTPs) for the given symbols, keyed like Kite's response"""
+        if kind not in KINDS:
+            raise ValueError(f"Invalid quote kind: {kind}")
+        symbols = list(dict.fromkeys(symbols))
+        self.requests += 1
+        self.symbols_requested += len(symbols)
+
+        key = (kind, getattr(kite, "access_token", None) or "")
+        now = time.monotonic()
+        result: Dict[str, Dict[str, Any]] = {}
+        waiting: Dict[str, asyncio.Future] = {}
+        loop = asyncio.get_running_loop()
+        for symbol in symbols:
+            value = self._fresh(kind, symbol, now)
+            if value is not None:
+                self.cache_hits += 1
+                result[symbol] = value
+                continue
+            future = self._pending.get(key, {}).get(symbol) or self._queued.get(key, {}).get(symbol)
+            if future is not None:
+                self.coalesced += 1
+            else:
+                future = loop.create_future()
+                self._queued.setdefault(key, {})[symbol] = future
+            waiting[symbol] = future
+
+        if key in self._queued and key not in self._flush_handles:
+            self._kite[key] = kite
+            self._flush_handles[key] = loop.call_later(self.window, self._flush, key)
+
+        if waiting:
+            values = await asyncio.gather(*(asyncio.shield(f) for f in waiting.values()))
+            for symbol, value in zip(waiting, values):
+                if value is not None:
+                    result[symbol] = value
+        return result
+
+    def _flush(self, key: BatchKey) -> None:
+        kind = key[0]
+        del self._flush_handles[key]
+        batch = self._queued.pop(key)
+        self._pending.setdefault(key, {}).update(batch)
+        kite = self._kite.pop(key)
+        # Drop expired values so the table only holds recently quoted symbols
+        now = time.monotonic()
+        values = self._values[kind]
+        for symbol in [s for s, (fetched, _) in values.items() if now - fetched > self.ttl]:
+            del values[symbol]
+        for chunk in _chunks(list(batch), QUOTE_BATCH_LIMIT[kind]):
+            asyncio.ensure_future(self._fetch(kite, key, chunk, batch))
+
+    def _settle(self, key: BatchKey, symbol: str) -> None:
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.pop(symbol, None)
+            if not pending:
+                del self._pending[key]
+
+    async def _fetch(self, kite, key: BatchKey, symbols: List[str], batch: Dict[str, asyncio.Future]) -> None:
+        kind = key[0]
+        self.broker_calls += 1
+        try:
+            quotes = await broker.call(getattr(kite, kind), symbols)
+        except Exception as e:
+            logger.error(f"Error fetching {kind} for {len(symbols)} symbols: {str(e)}")
+            for symbol in symbols:
+                self._settle(key, symbol)
+                if not batch[symbol].done():
+                    batch[symbol].set_exception(e)
+                    # Mark retrieved so callers that went away don't log it
+                    batch[symbol].exception()
+            return
+        now = time.monotonic()
+        for symbol in symbols:
+            value = quotes.get(symbol)
+            if value is not None:
+                self._values[kind][symbol] = (now, value)
+            self._settle(key, symbol)
+            if not batch[symbol].done():
+                batch[symbol].set_result(value)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "symbols_requested": self.symbols_requested,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "broker_calls": self.broker_calls,
+            "cached_symbols": sum(len(values) for values in self._values.values()),
+        }
+
+
+aggregator = QuoteAggregator()
+
+
+async def get(kite, symbols: Iterable[str], kind: str = "quote") -> Dict[str, Dict[str, Any]]:
+    return await aggregator.get(kite, symbols, kind)
+
+
+def stats() -> Dict[str, Any]:
+    return aggregator.stats()
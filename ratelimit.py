@@ -0,0 +1,187 @@
+"""Client-side rate limiting for Kite API quotas.
+
+Kite enforces per-second limits by endpoint class: quotes, historical data,
+order placement and everything else. Each class gets a token bucket sized to
+its limit, so bursts from several tabs or a candle backfill queue up here
+instead of coming back as 429s. Callers waiting on the same bucket are served
+by priority, so order placement goes ahead of analytics.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Priorities, lower is served first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Requests per second allowed for each endpoint class
+RATE_LIMITS: Dict[str, float] = {
+    "quote": float(os.getenv("RATE_LIMIT_QUOTE", "1")),
+    "historical": float(os.getenv("RATE_LIMIT_HISTORICAL", "3")),
+    "orders": float(os.getenv("RATE_LIMIT_ORDERS", "10")),
+    "default": float(os.getenv("RATE_LIMIT_DEFAULT", "10")),
+}
+
+# KiteConnect method -> endpoint class; anything else is "default"
+ENDPOINT_CLASSES: Dict[str, str] = {
+    "quote": "quote",
+    "ohlc": "quote",
+    "ltp": "quote",
+    "historical_data": "historical",
+    "place_order": "orders",
+    "modify_order": "orders",
+    "cancel_order": "orders",
+    "exit_order": "orders",
+    "place_mf_order": "orders",
+    "cancel_mf_order": "orders",
+}
+
+DEFAULT_PRIORITIES: Dict[str, int] = {
+    "orders": PRIORITY_HIGH,
+    "quote": PRIORITY_NORMAL,
+    "default": PRIORITY_NORMAL,
+    "historical": PRIORITY_LOW,
+}
+
+# Retries after a 429, with full-jitter exponential backoff
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", "3"))
+RATE_LIMIT_BACKOFF = float(os.getenv("RATE_LIMIT_BACKOFF", "0.5"))
+
+# Seconds over which utilisation is measured
+_UTILISATION_WINDOW = 10.0
+
+
+def endpoint_class(fn: Callable) -> str:
+    return ENDPOINT_CLASSES.get(getattr(fn, "__name__", ""), "default")
+
+
+def backoff(attempt: int) -> float:
+    """Delay before retry ``attempt`` (0-based)"""
+    return random.uniform(0, RATE_LIMIT_BACKOFF * 2 ** attempt)
+
+
+class TokenBucket:
+    """Token bucket whose waiters are released in priority order"""
+
+    def __init__(self, name: str, rate: float, burst: Optional[float] = None):
+        self.name = name
+        self.rate = rate
+        self.capacity = burst or max(rate, 1.0)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._grants: Deque[float] = deque()
+        self.granted = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+        self.max_queue = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _grant(self) -> None:
+        self.tokens -= 1
+        self.granted += 1
+        now = time.monotonic()
+        self._grants.append(now)
+        self._trim_grants(now)
+
+    def _trim_grants(self, now: float) -> None:
+        """Forget grants older than the utilisation window"""
+        while self._grants and now - self._grants[0] > _UTILISATION_WINDOW:
+            self._grants.popleft()
+
+    async def acquire(self, priority: int = PRIORITY_NORMAL) -> None:
+        """Wait for a token"""
+        self._refill()
+        if not self._waiters and self.tokens >= 1:
+            self._grant()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        self.max_queue = max(self.max_queue, len(self._waiters))
+        self.delayed += 1
+        started = time.monotonic()
+        self._schedule()
+        try:
+            await future
+        finally:
+            self.wait_seconds += time.monotonic() - started
+
+    def _schedule(self) -> None:
+        if self._timer is not None or not self._waiters:
+            return
+        delay = max(0.0, (1 - self.tokens) / self.rate)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._release)
+
+    def _release(self) -> None:
+        self._timer = None
+        self._refill()
+        while self._waiters and self.tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.cancelled():
+                continue
+            self._grant()
+            future.set_result(None)
+        # Drop waiters that gave up while queued
+        while self._waiters and self._waiters[0][2].cancelled():
+            heapq.heappop(self._waiters)
+        self._schedule()
+
+    def penalise(self) -> None:
+        """Empty the bucket after the broker throttled a call"""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+        self.throttled += 1
+
+    def stats(self) -> Dict[str, Any]:
+        self._refill()
+        self._trim_grants(time.monotonic())
+        return {
+            "rate": self.rate,
+            "tokens": round(self.tokens, 2),
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            "granted": self.granted,
+            "delayed": self.delayed,
+            "avg_wait_ms": round(self.wait_seconds / self.delayed * 1000, 1) if self.delayed else 0.0,
+            "throttled": self.throttled,
+            "utilisation": round(len(self._grants) / (self.rate * _UTILISATION_WINDOW), 3),
+        }
+
+
+class RateLimiter:
+    """One token bucket per Kite endpoint class"""
+
+    def __init__(self, limits: Dict[str, float] = RATE_LIMITS):
+        self.buckets = {name: TokenBucket(name, rate) for name, rate in limits.items()}
+
+    def bucket_for(self, fn: Callable) -> TokenBucket:
+        return self.buckets.get(endpoint_class(fn), self.buckets["default"])
+
+    def priority_for(self, fn: Callable) -> int:
+        return DEFAULT_PRIORITIES.get(endpoint_class(fn), PRIORITY_NORMAL)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: bucket.stats() for name, bucket in self.buckets.items()}
+
+
+limiter = RateLimiter()
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return limiter.stats()
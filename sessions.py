@@ -0,0 +1,342 @@
+"""Per-user Kite sessions.
+
+Every login gets its own session. A session is identified by a random id in
+the ``SESSION_COOKIE`` cookie and owns the user's KiteConnect client and live
+books, so one process can serve many accounts at once. Sessions are held in a
+bounded LRU (``SESSION_MAX``). A session ends when its access token expires,
+which Kite does at 06:00 IST the next day, or as soon as Kite rejects the
+token.
+
+With ``SESSION_BACKEND=sqlite`` sessions are also written to disk. They then
+survive restarts, outlive LRU eviction, and are shared by every uvicorn
+worker on the host. ``SESSION_BACKEND=state`` (the default when
+``STATE_BACKEND`` is shared) keeps them in the shared state backend instead.
+A logout there also ends the session on every other worker at once.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, time as dtime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+import state
+from candles import IST
+from execution import ExecutionScheduler
+from instruments import DATA_DIR
+from orderbook import OrderBook
+from pnl import PositionBook
+
+logger = logging.getLogger(__name__)
+
+SESSION_COOKIE = os.getenv("SESSION_COOKIE", "kite_session")
+SESSION_COOKIE_SECURE = os.getenv("SESSION_COOKIE_SECURE", "0").lower() in ("1", "true", "yes")
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "state" if state.backend.shared else "memory")
+SESSIONS_PATH = os.path.join(DATA_DIR, "sessions.sqlite")
+
+# Kite access tokens are valid until this time (IST) the next morning
+TOKEN_EXPIRY_TIME = dtime(6, 0)
+
+# Why a session was closed
+LOGOUT = "logout"
+EXPIRED = "expired"
+EVICTED = "evicted"
+# Ended by another worker
+ELSEWHERE = "elsewhere"
+
+# Channel on which the state backend announces ended sessions
+CLOSED_CHANNEL = "sessions:closed"
+
+SessionHook = Callable[["Session", str], Awaitable[None]]
+
+
+def token_expiry(now: Optional[datetime] = None) -> datetime:
+    """When an access token issued at ``now`` stops working"""
+    now = now or datetime.now(IST)
+    expiry = datetime.combine(now.date(), TOKEN_EXPIRY_TIME, IST)
+    return expiry if expiry > now else expiry + timedelta(days=1)
+
+
+class Session:
+    """One logged-in user: KiteConnect client, live position and order books and sliced executions"""
+
+    def __init__(self, session_id: str, kite, user_id: str,
+                 created_at: Optional[datetime] = None, expires_at: Optional[datetime] = None):
+        self.id = session_id
+        self.kite = kite
+        self.user_id = user_id
+        self.created_at = created_at or datetime.now(IST)
+        self.expires_at = expires_at or token_expiry(self.created_at)
+        self.positions = PositionBook()
+        self.orders = OrderBook()
+        self.executions = ExecutionScheduler(kite, self.orders)
+        # Set from the broker thread when Kite rejects the token
+        self.revoked = False
+        # Set once the session has left the store and its client is closed
+        self.closed = False
+
+    @property
+    def access_token(self) -> str:
+        return self.kite.access_token
+
+    @property
+    def expired(self) -> bool:
+        return self.closed or self.revoked or datetime.now(IST) >= self.expires_at
+
+    @property
+    def ttl(self) -> int:
+        """Seconds until the access token expires"""
+        return max(0, int((self.expires_at - datetime.now(IST)).total_seconds()))
+
+    def record(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "access_token": self.access_token,
+            "created_at": int(self.created_at.timestamp()),
+            "expires_at": int(self.expires_at.timestamp()),
+        }
+
+
+class SqliteSessionBackend:
+    """Sessions persisted in SQLite"""
+
+    def __init__(self, path: str = SESSIONS_PATH):
+        self.path = path
+        self._initialised = False
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialised:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._initialised:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS sessions (
+                       id TEXT PRIMARY KEY,
+                       user_id TEXT NOT NULL,
+                       access_token TEXT NOT NULL,
+                       created_at INTEGER NOT NULL,
+                       expires_at INTEGER NOT NULL
+                   )"""
+            )
+            self._initialised = True
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """A connection that commits on success and is always closed"""
+        conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.get_running_loop().run_in_executor(None, self._load, session_id)
+
+    async def save(self, record: Dict[str, Any]) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self._save, record)
+
+    async def delete(self, session_id: str) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self._delete, session_id)
+
+    def watch(self, handler: Callable[[str], Awaitable[None]]) -> None:
+        """Sessions ended on other workers are only noticed once they expire"""
+
+    def _load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock, self._transaction() as conn:
+            row = conn.execute(
+                "SELECT id, user_id, access_token, created_at, expires_at FROM sessions WHERE id = ?",
+                (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("id", "user_id", "access_token", "created_at", "expires_at"), row))
+
+    def _save(self, record: Dict[str, Any]) -> None:
+        """Store a session, dropping any whose token has since expired"""
+        with self._lock, self._transaction() as conn:
+            conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (int(time.time()),))
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (:id, :user_id, :access_token, :created_at, :expires_at)",
+                record
+            )
+
+    def _delete(self, session_id: str) -> None:
+        with self._lock, self._transaction() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+
+class StateSessionBackend:
+    """Sessions kept in the shared state backend until their token expires"""
+
+    def __init__(self, shared=None):
+        self.shared = shared or state.backend
+
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await self.shared.get(f"session:{session_id}")
+
+    async def save(self, record: Dict[str, Any]) -> None:
+        await self.shared.set(f"session:{record['id']}", record, ttl=max(1, record["expires_at"] - time.time()))
+
+    async def delete(self, session_id: str) -> None:
+        await self.shared.delete(f"session:{session_id}")
+        await self.shared.publish(CLOSED_CHANNEL, {"worker": state.WORKER_ID, "id": session_id})
+
+    def watch(self, handler: Callable[[str], Awaitable[None]]) -> None:
+        """Call ``handler(session_id)`` when another worker ends a session"""
+        async def on_closed(message: Dict[str, Any]) -> None:
+            if message["worker"] != state.WORKER_ID:
+                await handler(message["id"])
+
+        self.shared.subscribe(CLOSED_CHANNEL, on_closed)
+
+
+BACKENDS = {
+    "memory": lambda: None,
+    "sqlite": SqliteSessionBackend,
+    "state": StateSessionBackend,
+}
+
+
+class SessionStore:
+    """Bounded LRU of live sessions with an optional persistent backend"""
+
+    def __init__(self, client_factory: Callable[[str], Any], max_sessions: int = SESSION_MAX,
+                 backend: Optional[Any] = None):
+        self._client_factory = client_factory
+        self.max_sessions = max_sessions
+        self.backend = backend
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._open_hooks: List[SessionHook] = []
+        self._close_hooks: List[SessionHook] = []
+        self.created = 0
+        self.restored = 0
+        self.evicted = 0
+        self.expired = 0
+        if backend is not None:
+            backend.watch(self._forget)
+
+    def on_open(self, hook: SessionHook) -> None:
+        """Run ``hook(session, reason)`` whenever a session is created or restored"""
+        self._open_hooks.append(hook)
+
+    def on_close(self, hook: SessionHook) -> None:
+        """Run ``hook(session, reason)`` whenever a session leaves memory"""
+        self._close_hooks.append(hook)
+
+    def _watch(self, session: Session) -> None:
+        def revoke():
+            session.revoked = True
+            logger.warning(f"Kite rejected the token of session for {session.user_id}")
+
+        session.kite.set_session_expiry_hook(revoke)
+
+    async def create(self, kite, user_id: str) -> Session:
+        """Start a session for a client that has just completed the login flow"""
+        session = Session(secrets.token_urlsafe(32), kite, user_id)
+        self._watch(session)
+        if self.backend is not None:
+            await self.backend.save(session.record())
+        self.created += 1
+        await self._add(session, "login")
+        logger.info(f"Created session for {user_id}")
+        return session
+
+    async def get(self, session_id: Optional[str]) -> Optional[Session]:
+        """Live session for an id, restoring it from the backend if needed"""
+        if not session_id:
+            return None
+        session = self._sessions.get(session_id)
+        if session is None and self.backend is not None:
+            record = await self.backend.load(session_id)
+            session = self._sessions.get(session_id)
+            if session is None and record is not None:
+                session = self._restore(record)
+                self.restored += 1
+                await self._add(session, "restored")
+        if session is None:
+            return None
+        if session.expired:
+            self.expired += 1
+            await self.delete(session_id, EXPIRED)
+            return None
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _restore(self, record: Dict[str, Any]) -> Session:
+        kite = self._client_factory(record["access_token"])
+        session = Session(
+            record["id"], kite, record["user_id"],
+            created_at=datetime.fromtimestamp(record["created_at"], IST),
+            expires_at=datetime.fromtimestamp(record["expires_at"], IST),
+        )
+        self._watch(session)
+        return session
+
+    async def _add(self, session: Session, reason: str) -> None:
+        self._sessions[session.id] = session
+        for hook in self._open_hooks:
+            await hook(session, reason)
+        while len(self._sessions) > self.max_sessions:
+            _, oldest = self._sessions.popitem(last=False)
+            self.evicted += 1
+            await self._close(oldest, EVICTED)
+
+    async def delete(self, session_id: str, reason: str = LOGOUT) -> None:
+        """End a session everywhere"""
+        session = self._sessions.pop(session_id, None)
+        if self.backend is not None:
+            await self.backend.delete(session_id)
+        if session is not None:
+            await self._close(session, reason)
+
+    async def _forget(self, session_id: str) -> None:
+        """Drop a session another worker has ended"""
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            await self._close(session, ELSEWHERE)
+
+    async def _close(self, session: Session, reason: str) -> None:
+        session.closed = True
+        for hook in self._close_hooks:
+            try:
+                await hook(session, reason)
+            except Exception as e:
+                logger.error(f"Error closing session: {str(e)}")
+        logger.info(f"Closed session for {session.user_id} ({reason})")
+
+    def find(self, access_token: Optional[str]) -> Optional[Session]:
+        """Live session using an access token"""
+        if not access_token:
+            return None
+        return next((s for s in self._sessions.values() if s.access_token == access_token and not s.expired), None)
+
+    def for_user(self, user_id: Optional[str]) -> List[Session]:
+        return [s for s in self._sessions.values() if s.user_id == user_id and not s.expired]
+
+    def __iter__(self) -> Iterator[Session]:
+        return iter(list(self._sessions.values()))
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "backend": type(self.backend).__name__ if self.backend is not None else "memory",
+            "created": self.created,
+            "restored": self.restored,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
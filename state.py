@@ -0,0 +1,214 @@
+"""Shared state backend for running several workers.
+
+Sessions, cached broker responses and the tick/order-update fan-out go
+through a small async key-value and pub/sub interface. ``STATE_BACKEND``
+selects the implementation:
+
+``memory`` (default)
+    Process-local dicts. Right for a single worker.
+``redis``
+    A Redis server (or anything speaking its protocol) at ``REDIS_URL``,
+    shared by every worker. Needs the ``redis`` package.
+
+Values are stored as JSON. Datetimes and dates, which KiteConnect returns
+for timestamps, are tagged so they come back with the same type.
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Prefix for every key and channel, so several apps can share a server
+STATE_PREFIX = os.getenv("STATE_PREFIX", "kite:")
+
+# Identifies this process in leases and published messages
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+MessageHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__}")
+
+
+def _decode(value: Dict[str, Any]) -> Any:
+    if len(value) == 1:
+        if "__datetime__" in value:
+            return datetime.fromisoformat(value["__datetime__"])
+        if "__date__" in value:
+            return date.fromisoformat(value["__date__"])
+    return value
+
+
+def dumps(value: Any) -> str:
+    return json.dumps(value, default=_encode)
+
+
+def loads(data: Any) -> Any:
+    return json.loads(data, object_hook=_decode)
+
+
+class MemoryState:
+    """Process-local state"""
+
+    shared = False
+
+    def __init__(self):
+        # key -> (expires at or None, value)
+        self._values: Dict[str, Tuple[Optional[float], Any]] = {}
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+
+    def _live(self, key: str) -> Optional[Tuple[Optional[float], Any]]:
+        entry = self._values.get(key)
+        if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+            del self._values[key]
+            return None
+        return entry
+
+    async def get(self, key: str) -> Any:
+        entry = self._live(key)
+        return entry[1] if entry is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None, only_if_missing: bool = False) -> bool:
+        """Store a value, optionally expiring after ``ttl`` seconds; False if skipped"""
+        if only_if_missing and self._live(key) is not None:
+            return False
+        self._values[key] = (time.monotonic() + ttl if ttl else None, value)
+        return True
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._values.pop(key, None)
+
+    async def keys(self, prefix: str) -> List[str]:
+        return [key for key in list(self._values) if key.startswith(prefix) and self._live(key) is not None]
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        for handler in self._handlers.get(channel, []):
+            asyncio.ensure_future(handler(message))
+
+    def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        """Call ``handler`` with every message published on ``channel``"""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class RedisState:
+    """State in a Redis server shared by every worker"""
+
+    shared = True
+
+    def __init__(self, client, prefix: str = STATE_PREFIX):
+        self.client = client
+        self.prefix = prefix
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def get(self, key: str) -> Any:
+        data = await self.client.get(self.prefix + key)
+        return loads(data) if data is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None, only_if_missing: bool = False) -> bool:
+        """Store a value, optionally expiring after ``ttl`` seconds; False if skipped"""
+        result = await self.client.set(
+            self.prefix + key, dumps(value),
+            px=max(1, int(ttl * 1000)) if ttl else None,
+            nx=only_if_missing,
+        )
+        return bool(result)
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+    async def keys(self, prefix: str) -> List[str]:
+        start = len(self.prefix)
+        return [
+            (key.decode() if isinstance(key, bytes) else key)[start:]
+            async for key in self.client.scan_iter(match=f"{self.prefix}{prefix}*")
+        ]
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        await self.client.publish(self.prefix + channel, dumps(message))
+
+    def subscribe(self, channel: str, handler: MessageHandler) -> None:
+        """Call ``handler`` with every message published on ``channel``"""
+        new = channel not in self._handlers
+        self._handlers.setdefault(channel, []).append(handler)
+        if new and self._pubsub is not None:
+            asyncio.ensure_future(self._listen_to(channel))
+
+    async def _listen_to(self, *channels: str) -> None:
+        await self._pubsub.subscribe(*(self.prefix + channel for channel in channels))
+        if self._listener is None:
+            self._listener = asyncio.ensure_future(self._listen())
+
+    async def start(self) -> None:
+        """Start receiving published messages"""
+        if self._pubsub is not None:
+            return
+        self._pubsub = self.client.pubsub()
+        if self._handlers:
+            await self._listen_to(*self._handlers)
+        logger.info(f"Connected to shared state as worker {WORKER_ID}")
+
+    async def _listen(self) -> None:
+        start = len(self.prefix)
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                channel = message["channel"]
+                channel = (channel.decode() if isinstance(channel, bytes) else channel)[start:]
+                payload = loads(message["data"])
+                for handler in self._handlers.get(channel, []):
+                    asyncio.ensure_future(handler(payload))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error receiving shared state message: {str(e)}")
+                await asyncio.sleep(1)
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        await self.client.aclose()
+
+
+def create_backend(name: str = STATE_BACKEND):
+    """State backend selected by name"""
+    if name == "memory":
+        return MemoryState()
+    if name == "redis":
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise ValueError("STATE_BACKEND=redis needs the redis package (pip install redis)")
+        return RedisState(redis.from_url(REDIS_URL))
+    raise ValueError(f"Invalid state backend: {name}")
+
+
+backend = create_backend()
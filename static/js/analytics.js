@@ -35,6 +35,13 @@ async function fetchPortfolioAnalytics() {
         renderPerformanceChart(data.performance);
         renderRiskMetrics(data.riskMetrics);
 
+        if (data.pending) {
+            // Price history is still being downloaded; check back shortly
+            showToast('Computing analytics from price history...', 'info');
+            setTimeout(fetchPortfolioAnalytics, 10000);
+            return;
+        }
+
         // Show success toast
         showToast('Data refreshed successfully', 'success');
     } catch (error) {
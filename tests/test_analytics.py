@@ -0,0 +1,144 @@
+import asyncio
+import math
+from datetime import date
+
+import numpy as np
+import pytest
+
+import analytics
+import cache
+from analytics import compute_risk, forward_fill, price_matrix, returns_matrix
+from candles import CANDLE_DTYPE, to_epoch
+from portfolio import Holdings
+
+nan = np.nan
+BENCHMARK = 256265
+
+
+def _candles(closes, first_day=1):
+    """Daily candles from 2024-01-<first_day>; None leaves a day out"""
+    rows = [
+        (to_epoch(date(2024, 1, first_day + i)), close, close, close, close, 0)
+        for i, close in enumerate(closes) if close is not None
+    ]
+    return np.array(rows, dtype=CANDLE_DTYPE)
+
+
+class FakeStore:
+    def __init__(self, series, delay=0.0):
+        self.series = series
+        self.delay = delay
+        self.requests = []
+
+    async def array(self, kite, token, start, end, interval="day"):
+        self.requests.append((token, start, end))
+        await asyncio.sleep(self.delay)
+        return self.series[token]
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(cache, "default_cache", cache.TTLCache())
+    monkeypatch.setattr(analytics, "benchmark_token", lambda: BENCHMARK)
+
+
+def test_forward_fill_and_returns():
+    closes = np.array([[nan, 1.0], [2.0, nan], [nan, nan], [3.0, 4.0]])
+    filled = forward_fill(closes)
+    assert np.isnan(filled[0, 0])
+    assert filled[1:].tolist() == [[2.0, 1.0], [2.0, 1.0], [3.0, 4.0]]
+
+    returns = returns_matrix(np.array([[100.0, nan], [110.0, 50.0], [99.0, 55.0]]))
+    assert returns == pytest.approx(np.array([[0.1, 0.0], [-0.1, 0.1]]))
+
+
+def test_compute_risk_matches_hand_computed_values():
+    returns = np.array([[0.01, 0.02], [-0.02, 0.00], [0.03, -0.01], [0.00, 0.01]])
+    benchmark = np.array([0.01, -0.01, 0.02, 0.00])
+    weights = np.array([0.5, 0.5])
+
+    risk = compute_risk(returns, benchmark, weights, risk_free_rate=0.0)
+
+    # Portfolio returns 0.015, -0.01, 0.01, 0.005: mean 0.005, sample variance 3.5e-4 / 3
+    daily_std = math.sqrt(3.5e-4 / 3)
+    assert risk["volatility"] == pytest.approx(daily_std * math.sqrt(252))
+    # Covariance with the benchmark 3.5e-4 / 3 over its variance 5e-4 / 3
+    assert risk["beta"] == pytest.approx(0.7)
+    assert risk["sharpeRatio"] == pytest.approx(0.005 / daily_std * math.sqrt(252))
+    assert risk["alpha"] == pytest.approx((0.005 - 0.7 * 0.005) * 252)
+    assert risk["observations"] == 4
+    assert risk["covariance"].shape == (2, 2)
+
+
+def test_compute_risk_needs_two_observations():
+    risk = compute_risk(np.zeros((1, 2)), np.zeros(1), np.array([0.5, 0.5]))
+    assert risk["volatility"] == risk["beta"] == risk["sharpeRatio"] == 0.0
+
+
+def test_price_matrix_aligns_to_the_benchmark_calendar(monkeypatch):
+    monkeypatch.setattr(analytics, "candle_store", FakeStore({
+        BENCHMARK: _candles([100, 101, 102, 103, 104]),
+        # No candle on the 3rd, and one on the 6th, which is not a benchmark day
+        1: _candles([10, 11, None, 13, 14, 15]),
+        # Listed on the 2nd
+        2: _candles([20, 21, 22, 23], first_day=2),
+    }))
+    dates, closes = asyncio.run(price_matrix(None, [1, 2], date(2024, 1, 1), date(2024, 1, 5)))
+    assert dates.tolist() == [to_epoch(date(2024, 1, day)) for day in range(1, 6)]
+    assert closes[:, 0].tolist() == [10, 11, 11, 13, 14]
+    assert np.isnan(closes[0, 1]) and closes[1:, 1].tolist() == [20, 21, 22, 23]
+    assert closes[:, 2].tolist() == [100, 101, 102, 103, 104]
+
+
+def _holdings(*rows):
+    return Holdings.from_payload([
+        {"tradingsymbol": symbol, "exchange": "NSE", "instrument_token": token, "quantity": quantity,
+         "average_price": price, "last_price": price}
+        for symbol, token, quantity, price in rows
+    ])
+
+
+def test_slow_first_computation_is_pending_then_cached(monkeypatch):
+    store = FakeStore({BENCHMARK: _candles([100, 101, 103]), 1: _candles([10, 11, 12])}, delay=0.1)
+    monkeypatch.setattr(analytics, "candle_store", store)
+    held = _holdings(("INFY", 1, 10, 12.0))
+
+    async def run():
+        pending = await analytics.risk_metrics(None, held, wait=0.01)
+        # The computation carries on after the caller stopped waiting
+        await asyncio.sleep(0.2)
+        ready = await analytics.risk_metrics(None, held, wait=0.01)
+        return pending, ready
+
+    pending, ready = asyncio.run(run())
+    assert pending["pending"] and pending["observations"] == 0
+    assert pending["covariance"] == {"symbols": ["INFY"], "matrix": []}
+    assert not ready["pending"] and ready["observations"] == 2
+    assert len(store.requests) == 2
+
+
+class FakeKite:
+    access_token = "token"
+
+    def ltp(self, symbols):
+        return {symbol: {"last_price": 110.0} for symbol in symbols}
+
+
+def test_performance_is_quantity_weighted_closes_filled_across_holidays(monkeypatch):
+    # The 3rd is a market holiday: no benchmark candle. INFY misses the 4th.
+    monkeypatch.setattr(analytics, "candle_store", FakeStore({
+        BENCHMARK: _candles([100, 102, None, 104]),
+        1: _candles([10, 11, None, None]),
+        2: _candles([50, 49, None, 52]),
+    }))
+    held = _holdings(("INFY", 1, 10, 12.0), ("TCS", 2, 2, 55.0))
+
+    series = asyncio.run(analytics.performance_series(FakeKite(), held, days=4))
+
+    assert series["dates"][:3] == ["2024-01-01", "2024-01-02", "2024-01-04"]
+    assert series["dates"][3] == date.today().isoformat()
+    # 10 x close + 2 x close per day; INFY's last close carries into the 4th
+    assert series["portfolioValues"] == [200.0, 208.0, 214.0, held.total_value]
+    # The benchmark is rebased onto the portfolio's first value, today's point from the live price
+    assert series["benchmarkValues"] == pytest.approx([200.0, 204.0, 208.0, 220.0])
+    assert not series["pending"]
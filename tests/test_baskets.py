@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+
+import baskets
+import instruments
+from baskets import FreezeLimits, normalise, validate
+
+
+@pytest.fixture
+def master():
+    master = instruments.InstrumentMaster("/nonexistent")
+    master._index(instruments.to_records([
+        {"instrument_token": 1, "tradingsymbol": "INFY", "exchange": "NSE", "segment": "NSE",
+         "instrument_type": "EQ", "tick_size": 0.05, "lot_size": 1},
+        {"instrument_token": 2, "tradingsymbol": "NIFTY24DECFUT", "name": "NIFTY", "exchange": "NFO",
+         "segment": "NFO-FUT", "instrument_type": "FUT", "expiry": "2099-12-31", "tick_size": 0.05,
+         "lot_size": 25},
+    ]))
+    return master
+
+
+@pytest.fixture
+def freeze(tmp_path):
+    path = tmp_path / "qtyfreeze.csv"
+    path.write_text("SYMBOL,VOL_FRZ_QTY\nNIFTY,1800\n")
+    return FreezeLimits(str(path))
+
+
+def _leg(**fields):
+    return normalise({"symbol": "NSE:INFY", "transactionType": "BUY", "orderType": "LIMIT", "quantity": 100,
+                      "price": 1500, **fields})
+
+
+def test_normalise_drops_fields_the_variety_and_validity_ignore():
+    params = _leg(validityTtl=5, icebergLegs=2, icebergQuantity=50)
+    assert "validity_ttl" not in params
+    assert "iceberg_legs" not in params and "iceberg_quantity" not in params
+
+    params = _leg(variety="iceberg", validity="ttl", validityTtl="5", icebergLegs="2", icebergQuantity="50")
+    assert params["validity"] == "TTL"
+    assert (params["validity_ttl"], params["iceberg_legs"], params["iceberg_quantity"]) == ("5", "2", "50")
+
+
+def test_ttl_needs_a_lifetime(master):
+    assert validate(_leg(validity="TTL"), master) == [
+        f"validity_ttl must be between 1 and {baskets.VALIDITY_TTL_MAX} minutes for TTL orders"
+    ]
+    params = _leg(validity="TTL", validityTtl="15")
+    assert validate(params, master) == []
+    assert params["validity_ttl"] == 15
+
+
+def test_iceberg_needs_legs_and_leg_quantity(master):
+    assert validate(_leg(variety="iceberg"), master) == [
+        "iceberg_legs must be between 2 and 10",
+        "iceberg_quantity is required for iceberg orders",
+    ]
+    assert validate(_leg(variety="iceberg", icebergLegs=11, icebergQuantity=10), master) == [
+        "iceberg_legs must be between 2 and 10",
+    ]
+    assert validate(_leg(variety="iceberg", icebergLegs=2, icebergQuantity=40), master) == [
+        "iceberg_quantity must split quantity 100 into 2 legs",
+    ]
+    assert validate(_leg(variety="iceberg", orderType="MARKET", icebergLegs=2, icebergQuantity=50), master) == [
+        "Iceberg orders must be LIMIT or SL, not MARKET",
+    ]
+    params = _leg(variety="iceberg", icebergLegs="4", icebergQuantity="25")
+    assert validate(params, master) == []
+    assert (params["iceberg_legs"], params["iceberg_quantity"]) == (4, 25)
+
+
+def test_iceberg_legs_are_checked_against_lot_and_freeze(master, freeze):
+    leg = {"symbol": "NFO:NIFTY24DECFUT", "transactionType": "BUY", "orderType": "LIMIT", "price": 24000,
+           "variety": "iceberg"}
+    assert validate(normalise({**leg, "quantity": 3000, "icebergLegs": 2, "icebergQuantity": 1510}),
+                    master, freeze) == [
+        "iceberg_quantity must be a multiple of the lot size 25",
+    ]
+    assert validate(normalise({**leg, "quantity": 5000, "icebergLegs": 2, "icebergQuantity": 2500}),
+                    master, freeze) == [
+        "iceberg_quantity exceeds the freeze limit of 1800",
+    ]
+    # The whole order may exceed the freeze limit as long as each leg fits
+    assert validate(normalise({**leg, "quantity": 5000, "icebergLegs": 4, "icebergQuantity": 1250}),
+                    master, freeze) == []
+    assert validate(normalise({**leg, "variety": "regular", "quantity": 5000}), master, freeze) == [
+        "quantity exceeds the freeze limit of 1800; place it as a sliced execution",
+    ]
+
+
+def test_iceberg_fields_reach_place_order(master):
+    class Kite:
+        def place_order(self, variety, **params):
+            self.placed = (variety, params)
+            return "1"
+
+    kite = Kite()
+    params = _leg(variety="iceberg", validity="TTL", validityTtl=30, icebergLegs=2, icebergQuantity=50)
+    assert validate(params, master) == []
+    assert asyncio.run(baskets._place(kite, params)) == {"status": "placed", "order_id": "1"}
+    variety, placed = kite.placed
+    assert variety == "iceberg"
+    assert (placed["iceberg_legs"], placed["iceberg_quantity"], placed["validity_ttl"]) == (2, 50, 30)
+
+
+def test_legs_that_are_not_objects_reject_the_basket():
+    class Kite:
+        def place_order(self, variety, **params):
+            raise AssertionError("nothing is placed")
+
+    legs = [{"symbol": "NSE:INFY", "transactionType": "BUY", "orderType": "MARKET", "quantity": 1},
+            "NSE:TCS", None, 5]
+    with pytest.raises(baskets.BasketError) as error:
+        asyncio.run(baskets.place_basket(Kite(), legs))
+    assert [result["index"] for result in error.value.results] == [1, 2, 3]
+    assert error.value.results[1] == {"index": 2, "status": "invalid",
+                                      "errors": ["Order must be an object, not NoneType"]}
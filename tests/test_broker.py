@@ -0,0 +1,128 @@
+import asyncio
+import threading
+
+import pytest
+from kiteconnect.exceptions import KiteException, TokenException
+
+import ratelimit
+from broker import BrokerExecutor, BrokerTimeoutError, RateLimitedError
+
+LIMITS = {"quote": 1000, "historical": 1000, "orders": 1000, "default": 1000}
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setattr(ratelimit, "backoff", lambda attempt: 0)
+    executor = BrokerExecutor(max_workers=1, timeout=5, limiter=ratelimit.RateLimiter(LIMITS))
+    yield executor
+    executor.shutdown()
+
+
+def test_call_returns_result_and_counts_it(executor):
+    def profile(user):
+        return {"user_id": user, "thread": threading.current_thread().name}
+
+    result = asyncio.run(executor.call(profile, "AB1234"))
+    assert result["user_id"] == "AB1234"
+    assert result["thread"].startswith("kite")
+    assert executor.stats()["completed"] == 1
+
+
+def test_errors_reach_the_caller(executor):
+    def orders():
+        raise TokenException("Token expired", code=403)
+
+    with pytest.raises(TokenException):
+        asyncio.run(executor.call(orders))
+    assert executor.stats()["errors"] == 1
+
+
+def test_timeout(executor):
+    release = threading.Event()
+
+    def holdings():
+        release.wait(5)
+
+    async def run():
+        try:
+            with pytest.raises(BrokerTimeoutError):
+                await executor.call(holdings, timeout=0.05)
+        finally:
+            release.set()
+
+    asyncio.run(run())
+    assert executor.stats()["timeouts"] == 1
+
+
+def test_queue_depth_while_the_pool_is_busy(executor):
+    started = threading.Event()
+    release = threading.Event()
+
+    def margins():
+        started.set()
+        release.wait(5)
+        return "done"
+
+    async def run():
+        calls = [asyncio.ensure_future(executor.call(margins)) for _ in range(3)]
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        await asyncio.sleep(0.01)
+        stats = executor.stats()
+        assert (stats["in_flight"], stats["queue_depth"]) == (1, 2)
+        release.set()
+        assert await asyncio.gather(*calls) == ["done"] * 3
+
+    asyncio.run(run())
+    assert executor.stats()["queue_depth"] == 0
+
+
+def test_throttled_calls_are_retried(executor):
+    attempts = []
+
+    def quote(instruments):
+        attempts.append(instruments)
+        if len(attempts) < 3:
+            raise KiteException("Too many requests", code=429)
+        return {"NSE:INFY": {"last_price": 1500.0}}
+
+    assert asyncio.run(executor.call(quote, ["NSE:INFY"])) == {"NSE:INFY": {"last_price": 1500.0}}
+    assert len(attempts) == 3
+    assert executor.stats()["retries"] == 2
+
+
+def test_throttling_gives_up_after_the_retries(executor):
+    def quote():
+        raise KiteException("Too many requests", code=429)
+
+    with pytest.raises(RateLimitedError):
+        asyncio.run(executor.call(quote))
+    assert executor.stats()["retries"] == ratelimit.RATE_LIMIT_RETRIES
+
+
+def test_shutdown_cancels_queued_calls(executor):
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def slow():
+        started.set()
+        release.wait(5)
+        ran.append("slow")
+
+    def queued():
+        ran.append("queued")
+
+    async def run():
+        running = asyncio.ensure_future(executor.call(slow))
+        waiting = asyncio.ensure_future(executor.call(queued))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        await asyncio.sleep(0.01)
+        executor.shutdown()
+        release.set()
+        await running
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+    asyncio.run(run())
+    assert ran == ["slow"]
+    assert executor.stats()["queue_depth"] == 0
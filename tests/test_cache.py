@@ -0,0 +1,119 @@
+import asyncio
+
+import cache
+from cache import TTLCache
+
+
+def test_hits_until_expiry():
+    async def run():
+        ttl_cache = TTLCache()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            return len(calls)
+
+        assert await ttl_cache.get_or_fetch("k", 60, fetch) == 1
+        assert await ttl_cache.get_or_fetch("k", 60, fetch) == 1
+        assert await ttl_cache.get_or_fetch("z", 0, fetch) == 2
+        assert await ttl_cache.get_or_fetch("z", 0, fetch) == 3
+        return ttl_cache
+
+    stats = asyncio.run(run()).stats()
+    assert (stats["hits"], stats["misses"]) == (1, 3)
+
+
+def test_concurrent_misses_fetch_once():
+    async def run():
+        ttl_cache = TTLCache()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "value"
+
+        results = await asyncio.gather(*(ttl_cache.get_or_fetch("k", 60, fetch) for _ in range(5)))
+        return results, calls, ttl_cache.stats()
+
+    results, calls, stats = asyncio.run(run())
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+    assert stats["coalesced"] == 4
+
+
+def test_result_invalidated_in_flight_is_not_stored():
+    async def run():
+        ttl_cache = TTLCache()
+
+        async def fetch():
+            ttl_cache.invalidate("k")
+            return "stale"
+
+        assert await ttl_cache.get_or_fetch("k", 60, fetch) == "stale"
+        return ttl_cache
+
+    ttl_cache = asyncio.run(run())
+    assert ttl_cache._entries == {}
+    assert ttl_cache._invalidated == {}
+
+
+def test_invalidating_idle_keys_keeps_no_state():
+    ttl_cache = TTLCache()
+    ttl_cache.invalidate(*(f"session{i}:holdings" for i in range(100)))
+    ttl_cache.invalidate_prefix("session1")
+    assert ttl_cache._invalidated == {}
+
+
+def test_expired_entries_are_swept_on_store(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    ttl_cache = TTLCache()
+    for i in range(10):
+        ttl_cache._store(f"k{i}", 5, i)
+    now[0] += cache.CACHE_SWEEP_INTERVAL
+    ttl_cache._store("fresh", 5, "v")
+    assert list(ttl_cache._entries) == ["fresh"]
+    assert ttl_cache.stats()["expired"] == 10
+
+
+def test_cancelled_caller_does_not_fail_the_others():
+    async def run():
+        ttl_cache = TTLCache()
+        release = asyncio.Event()
+
+        async def fetch():
+            await release.wait()
+            return "value"
+
+        leader = asyncio.ensure_future(ttl_cache.get_or_fetch("k", 60, fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(ttl_cache.get_or_fetch("k", 60, fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await follower == "value"
+        assert leader.cancelled()
+        return ttl_cache
+
+    ttl_cache = asyncio.run(run())
+    assert ttl_cache._entries["k"][1] == "value"
+    assert ttl_cache._inflight == {}
+
+
+def test_failed_fetch_reaches_every_caller():
+    async def run():
+        ttl_cache = TTLCache()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("broker down")
+
+        results = await asyncio.gather(*(ttl_cache.get_or_fetch("k", 60, fetch) for _ in range(3)),
+                                       return_exceptions=True)
+        return results, ttl_cache
+
+    results, ttl_cache = asyncio.run(run())
+    assert [str(result) for result in results] == ["broker down"] * 3
+    assert ttl_cache._entries == {}
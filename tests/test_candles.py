@@ -0,0 +1,107 @@
+import asyncio
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import candles
+from candles import IST, CandleStore, from_epoch, split_range, to_epoch
+
+TOKEN = 408065
+DAY = 86400
+
+
+class FakeKite:
+    def __init__(self):
+        self.requests = []
+
+    def historical_data(self, instrument_token, from_date, to_date, interval):
+        self.requests.append((from_date.date(), to_date.date()))
+        days = (to_date.date() - from_date.date()).days + 1
+        return [
+            {"date": datetime.combine(from_date.date() + timedelta(days=i), datetime.min.time(), IST),
+             "open": 100.0 + i, "high": 101.0 + i, "low": 99.0 + i, "close": 100.5 + i, "volume": 1000 + i}
+            for i in range(days)
+        ]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CandleStore(str(tmp_path / "candles.sqlite"))
+
+
+def test_epoch_round_trip_is_ist():
+    ts = to_epoch(date(2024, 1, 2))
+    assert from_epoch(ts) == datetime(2024, 1, 2, tzinfo=IST)
+    assert to_epoch(datetime(2024, 1, 2, 9, 15)) == ts + 9 * 3600 + 15 * 60
+
+
+def test_split_range_respects_interval_limits():
+    start = to_epoch(date(2024, 1, 1))
+    assert split_range(start, start + 59 * DAY, "minute") == [(start, start + 59 * DAY)]
+    chunks = split_range(start, start + 150 * DAY, "minute")
+    assert chunks == [
+        (start, start + 60 * DAY - 1),
+        (start + 60 * DAY, start + 120 * DAY - 1),
+        (start + 120 * DAY, start + 150 * DAY),
+    ]
+    assert split_range(start, start - 1, "day") == []
+
+
+def test_missing_ranges_keep_coverage_contiguous(store):
+    assert store._missing(None, 10, 20) == [(10, 20)]
+    assert store._missing((10, 20), 12, 18) == []
+    assert store._missing((10, 20), 5, 25, "minute") == [(5, 9), (21, 25)]
+    # A request past the covered end is fetched from the edge, not from its own start
+    assert store._missing((10, 20), 30, 40, "minute") == [(21, 40)]
+    # Day candles are fetched by date, so a gap starts with the day after the covered edge
+    edge = to_epoch(date(2024, 1, 10))
+    assert store._missing((edge - DAY, edge), edge, edge + 2 * DAY) == [(edge + DAY, edge + 2 * DAY)]
+    assert store._missing((edge - DAY, edge + DAY - 1), edge, edge + DAY) == [(edge + DAY, edge + DAY)]
+
+
+def test_backfill_only_fetches_gaps(store):
+    kite = FakeKite()
+
+    async def run():
+        first = await store.get(kite, TOKEN, date(2024, 1, 1), date(2024, 1, 10))
+        later = await store.get(kite, TOKEN, date(2024, 1, 5), date(2024, 1, 15))
+        wider = await store.array(kite, TOKEN, date(2023, 12, 25), date(2024, 1, 15))
+        again = await store.array(kite, TOKEN, date(2023, 12, 28), date(2024, 1, 12))
+        return first, later, wider, again
+
+    first, later, wider, again = asyncio.run(run())
+    assert kite.requests == [
+        (date(2024, 1, 1), date(2024, 1, 10)),
+        (date(2024, 1, 11), date(2024, 1, 15)),
+        (date(2023, 12, 25), date(2023, 12, 31)),
+    ]
+    assert len(first) == 10 and first[0]["date"] == "2024-01-01T00:00:00+05:30"
+    assert [c["date"][:10] for c in later] == [f"2024-01-{day:02d}" for day in range(5, 16)]
+    assert len(wider) == 22 and len(again) == 16
+    assert store._coverage(TOKEN, "day") == (to_epoch(date(2023, 12, 25)), to_epoch(date(2024, 1, 15)))
+    assert store._locks == {} and store._lock_users == {}
+
+
+def test_forming_candle_is_not_marked_covered(store):
+    kite = FakeKite()
+    today = datetime.now(IST).date()
+    asyncio.run(store.array(kite, TOKEN, today - timedelta(days=3), today))
+    asyncio.run(store.array(kite, TOKEN, today - timedelta(days=3), today))
+    assert kite.requests == [(today - timedelta(days=3), today), (today, today)]
+
+
+def test_connections_are_closed(store, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+
+    def tracking_connect(*args, **kwargs):
+        opened.append(connect(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(candles.sqlite3, "connect", tracking_connect)
+    asyncio.run(store.array(FakeKite(), TOKEN, date(2024, 1, 1), date(2024, 1, 3)))
+    assert len(opened) == 3
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
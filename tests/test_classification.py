@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import classification
+import instruments
+from classification import BUNDLED_PATH, ClassificationIndex, infer
+
+
+@pytest.fixture
+def master(monkeypatch):
+    master = instruments.InstrumentMaster("/nonexistent")
+    monkeypatch.setattr(classification, "instrument_master", master)
+    return master
+
+
+def _load(master, rows):
+    master._index(instruments.to_records([
+        {"instrument_token": i + 1, "exchange": "NSE", "segment": "NSE", "instrument_type": "EQ", **row}
+        for i, row in enumerate(rows)
+    ]))
+
+
+@pytest.fixture
+def index(master):
+    index = ClassificationIndex([BUNDLED_PATH])
+    index.load()
+    return index
+
+
+def test_bundled_symbols(index):
+    assert index.get("TCS", "NSE") == {
+        "sector": "Information Technology", "industry": "IT Services",
+        "asset_class": "Equity", "market_cap": "Large Cap",
+    }
+    assert index.get("NIFTYBEES", "NSE")["asset_class"] == "ETF"
+    assert index.get("GOLDBEES", "NSE")["asset_class"] == "Commodity"
+
+
+def test_user_file_overrides_by_isin_and_symbol(master, tmp_path):
+    path = tmp_path / "mine.csv"
+    path.write_text("Symbol,ISIN,Sector,Industry,Asset_Class,Market_Cap\n"
+                    "ZOMATO,,Consumer Services,Food Delivery,Equity,Large Cap\n"
+                    ",INE467B01029,Technology,Software,Equity,Large Cap\n")
+    index = ClassificationIndex([BUNDLED_PATH, str(path)])
+    index.load()
+    columns = index.classify(["TCS", "TCS", "ZOMATO"], ["NSE"] * 3, ["INE467B01029", "", ""])
+    assert columns["sector"].tolist() == ["Technology", "Information Technology", "Consumer Services"]
+
+
+@pytest.mark.parametrize("symbol, exchange, isin, asset_class", [
+    ("SGBAUG28V-GB", "NSE", "", "Commodity"),
+    ("GS2033-GS", "NSE", "", "Debt"),
+    ("IRFC-N1", "NSE", "", "Debt"),
+    ("SETFNIF50", "NSE", "INF200KA1FS1", "ETF"),
+    ("SOMEFUND", "", "INF123A01012", "Equity"),
+    ("UNKNOWN", "NSE", "", "Equity"),
+])
+def test_inferred_asset_classes(master, symbol, exchange, isin, asset_class):
+    assert infer(symbol, exchange, isin)[2] == asset_class
+
+
+def test_inference_from_master_segment_and_name(master):
+    _load(master, [
+        {"tradingsymbol": "NIFTY24DECFUT", "name": "NIFTY", "exchange": "NFO", "segment": "NFO-FUT"},
+        {"tradingsymbol": "MON100", "name": "MOTILAL NASDAQ 100 ETF"},
+        {"tradingsymbol": "LIQUIDCASE", "name": "ZERODHA LIQUID ETF"},
+    ])
+    assert infer("NIFTY24DECFUT", "NFO")[2] == "Derivatives"
+    assert infer("MON100", "NSE")[2] == "ETF"
+    assert infer("LIQUIDCASE", "NSE")[2] == "Debt"
+
+
+def test_guesses_made_before_the_master_loads_are_not_kept(index, master):
+    assert index.get("MON100", "NSE")["asset_class"] == "Equity"
+    _load(master, [{"tradingsymbol": "MON100", "name": "MOTILAL NASDAQ 100 ETF"}])
+    assert index.get("MON100", "NSE")["asset_class"] == "ETF"
+    # A reloaded master replaces earlier guesses too
+    _load(master, [{"tradingsymbol": "MON100", "name": "MOTILAL NASDAQ 100"}])
+    assert index.get("MON100", "NSE")["asset_class"] == "Equity"
+
+
+def test_empty_input(index):
+    assert index.classify([], [], [])["sector"].tolist() == []
+    assert isinstance(index.classify(np.array(["TCS"]))["sector"], np.ndarray)
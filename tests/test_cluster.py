@@ -0,0 +1,130 @@
+import asyncio
+
+import fakeredis
+from kiteconnect import KiteTicker
+
+from cluster import LEASE_KEY, TickerCoordinator
+from state import RedisState
+from ticker import TickerBridge
+
+QUOTE = KiteTicker.MODE_QUOTE
+
+
+class FakeTicker:
+    def __init__(self, api_key, access_token):
+        self.access_token = access_token
+        self.subscribed = set()
+
+    def connect(self, threaded=False):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+    def subscribe(self, tokens):
+        self.subscribed.update(tokens)
+
+    def unsubscribe(self, tokens):
+        self.subscribed.difference_update(tokens)
+
+    def set_mode(self, mode, tokens):
+        pass
+
+
+async def _workers(count, lease_seconds=10.0):
+    """Coordinators for ``count`` workers sharing one Redis server"""
+    server = fakeredis.FakeServer()
+    workers = []
+    for i in range(count):
+        shared = RedisState(fakeredis.FakeAsyncRedis(server=server), prefix="test:")
+        bridge = TickerBridge("key", mode=QUOTE, ticker_factory=FakeTicker)
+        workers.append(TickerCoordinator(bridge, shared, worker_id=f"w{i}", lease_seconds=lease_seconds))
+        await shared.start()
+    return workers
+
+
+async def _until(condition, timeout=2.0):
+    for _ in range(int(timeout / 0.02)):
+        if condition():
+            return
+        await asyncio.sleep(0.02)
+    raise AssertionError("Condition not reached")
+
+
+async def _shutdown(workers):
+    for worker in workers:
+        await worker.stop()
+        await worker.shared.close()
+
+
+def test_only_one_worker_becomes_leader():
+    async def run():
+        workers = await _workers(2)
+        for worker in workers:
+            await worker.start()
+        await workers[1].request_stream("token")
+        await _until(lambda: workers[0].bridge.connected)
+        result = ([w.leader for w in workers], await workers[0].shared.get(LEASE_KEY),
+                  [w.bridge.connected for w in workers])
+        await _shutdown(workers)
+        return result
+
+    leaders, lease, connected = asyncio.run(run())
+    assert leaders == [True, False]
+    assert lease == "w0"
+    # Only the leader opens the upstream connection, with the offered token
+    assert connected == [True, False]
+
+
+def test_follower_takes_over_when_the_lease_expires():
+    async def run():
+        leader, follower = await _workers(2, lease_seconds=0.3)
+        await leader.start()
+        await follower.start()
+        await follower.request_stream("token")
+        assert leader.leader and not follower.leader
+        # The leader dies without releasing its lease
+        leader._task.cancel()
+        await _until(lambda: follower.leader)
+        await _until(lambda: follower.bridge.connected)
+        result = await follower.shared.get(LEASE_KEY), follower.elections
+        await _shutdown([follower])
+        await leader.shared.close()
+        return result
+
+    assert asyncio.run(run()) == ("w1", 1)
+
+
+def test_follower_demand_and_relayed_ticks():
+    received = []
+
+    async def listener(ticks):
+        received.extend(ticks)
+
+    async def run():
+        leader, follower = await _workers(2)
+        await leader.start()
+        await follower.start()
+        await follower.request_stream("token")
+        await _until(lambda: leader.bridge.connected)
+
+        # A client on the follower subscribes; the leader takes it upstream
+        follower.bridge.add_listener(listener)
+        follower.bridge.subscribe("client", [408065], QUOTE)
+        await _until(lambda: 408065 in leader.bridge._ticker.subscribed)
+
+        # Ticks from the leader's upstream connection reach the follower's clients
+        tick = {"instrument_token": 408065, "mode": QUOTE, "last_price": 1500.0}
+        leader.bridge._dispatch([tick], True)
+        await _until(lambda: received)
+        stats = leader.stats(), follower.stats()
+        await _shutdown([leader, follower])
+        return stats
+
+    leader_stats, follower_stats = asyncio.run(run())
+    assert received == [{"instrument_token": 408065, "mode": QUOTE, "last_price": 1500.0}]
+    assert leader_stats["remote_workers"] == 1 and leader_stats["ticks_relayed"] == 1
+    assert follower_stats["ticks_received"] == 1 and follower_stats["local_tokens"] == 1
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+import connections
+from connections import QUEUE_FULL, SLOW_CONSUMER, ClientConnection, ConnectionManager, parse_max_hz
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.closed_with = None
+
+    async def send_json(self, message):
+        await asyncio.sleep(3600)
+
+    async def send_bytes(self, frame):
+        await asyncio.sleep(3600)
+
+    async def close(self, code, reason):
+        self.closed_with = (code, reason)
+
+
+def test_full_queue_is_not_counted_as_laggard(monkeypatch):
+    monkeypatch.setattr(connections, "WS_MAX_QUEUE", 3)
+
+    async def run():
+        manager = ConnectionManager()
+        websocket = FakeWebSocket()
+        connection = ClientConnection(websocket, manager)
+        for _ in range(4):
+            connection.send({"type": "orders"})
+        await asyncio.sleep(0)
+        return manager, connection, websocket
+
+    manager, connection, websocket = asyncio.run(run())
+    assert connection.close_reason == QUEUE_FULL
+    assert websocket.closed_with == (connections.CLOSE_LAGGARD, QUEUE_FULL)
+    assert manager.stats()["disconnected_laggards"] == 0
+    assert manager.stats()["disconnects"] == {QUEUE_FULL: 1}
+
+
+def test_slow_consumer_is_counted_as_laggard(monkeypatch):
+    monkeypatch.setattr(connections, "WS_HIGH_WATER", 1)
+    monkeypatch.setattr(connections, "WS_LAGGARD_SECONDS", 0.0)
+
+    async def run():
+        manager = ConnectionManager()
+        connection = ClientConnection(FakeWebSocket(), manager)
+        connection.send_ticks([{"instrument_token": token} for token in range(3)])
+        await asyncio.sleep(0.001)
+        connection.send_ticks([{"instrument_token": 9}])
+        await asyncio.sleep(0)
+        return manager, connection
+
+    manager, connection = asyncio.run(run())
+    assert connection.close_reason == SLOW_CONSUMER
+    assert manager.stats()["disconnected_laggards"] == 1
+    assert manager.stats()["disconnects"] == {SLOW_CONSUMER: 1}
+
+
+def test_ticks_are_conflated_per_instrument():
+    async def run():
+        manager = ConnectionManager()
+        connection = ClientConnection(FakeWebSocket(), manager)
+        connection.send_ticks([{"instrument_token": 1, "last_price": 1.0}])
+        connection.send_ticks([{"instrument_token": 1, "last_price": 2.0}, {"instrument_token": 2}])
+        return manager, connection
+
+    manager, connection = asyncio.run(run())
+    assert connection.pending == 2
+    assert connection._ticks[1]["last_price"] == 2.0
+    assert manager.conflated_ticks == 1
+
+
+def test_parse_max_hz():
+    assert parse_max_hz() == connections.WS_DEFAULT_MAX_HZ
+    assert parse_max_hz("2.5") == 2.5
+    assert parse_max_hz(0) == 0
+    assert parse_max_hz(10 ** 6) == connections.WS_MAX_HZ_LIMIT
+    for value in ("fast", -1, float("nan"), [1]):
+        with pytest.raises(ValueError):
+            parse_max_hz(value)
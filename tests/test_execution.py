@@ -0,0 +1,155 @@
+import asyncio
+import threading
+
+import pytest
+
+from execution import CANCELLED, COMPLETE, RUNNING, ExecutionScheduler, ParentOrder
+
+PARAMS = {
+    "variety": "regular", "exchange": "NFO", "tradingsymbol": "NIFTY24DECFUT", "transaction_type": "BUY",
+    "order_type": "MARKET", "product": "NRML",
+}
+
+
+class FakeKite:
+    def __init__(self, gate=None):
+        self.placed = []
+        self.cancelled = []
+        self.gate = gate
+        self._lock = threading.Lock()
+
+    def place_order(self, variety, **params):
+        if self.gate is not None:
+            self.gate.wait(5)
+        with self._lock:
+            self.placed.append(params["quantity"])
+            return f"child-{len(self.placed)}"
+
+    def cancel_order(self, variety, order_id):
+        self.cancelled.append(order_id)
+        return order_id
+
+
+def _params(quantity):
+    return {**PARAMS, "quantity": quantity}
+
+
+def _fill(order_id, quantity):
+    return {"order_id": order_id, "status": "COMPLETE", "filled_quantity": quantity, "average_price": 100.0}
+
+
+async def _until(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_slices_are_whole_lots_within_slice_quantity():
+    parent = ParentOrder(_params(1000), "split", slice_quantity=300, lot_size=25)
+    assert parent.slices(1000) == [300, 300, 300, 100]
+    # A part lot is never placed
+    assert parent.slices(310) == [300]
+    assert parent.slices(20) == []
+
+
+@pytest.mark.parametrize("options, expected", [
+    ({"strategy": "split", "freeze_limit": 1800, "lot_size": 25}, 1800),
+    ({"strategy": "split", "slice_quantity": 2000, "freeze_limit": 1800, "lot_size": 25}, 1800),
+    ({"strategy": "split", "slice_quantity": 110, "lot_size": 25}, 100),
+    ({"strategy": "split", "slice_quantity": 10, "lot_size": 25}, 25),
+    ({"strategy": "twap", "duration": 60, "slices": 4, "lot_size": 25}, 1250),
+])
+def test_slice_quantity_settings(options, expected):
+    async def run():
+        scheduler = ExecutionScheduler(FakeKite(), {})
+        parent = scheduler.submit(_params(5000), **options)
+        parent.task.cancel()
+        return parent.slice_quantity
+
+    assert asyncio.run(run()) == expected
+
+
+@pytest.mark.parametrize("options", [
+    {"strategy": "market"},
+    {"strategy": "twap"},
+    {"strategy": "vwap", "duration": 60, "instrument_token": None},
+    {"strategy": "vwap", "duration": 60, "instrument_token": 1, "participation": 1.5},
+])
+def test_invalid_settings_are_rejected(options):
+    scheduler = ExecutionScheduler(FakeKite(), {})
+    with pytest.raises(ValueError):
+        scheduler.submit(_params(100), **options)
+
+
+def test_exchange_iceberg_orders_are_not_worked():
+    scheduler = ExecutionScheduler(FakeKite(), {})
+    with pytest.raises(ValueError):
+        scheduler.submit({**_params(100), "variety": "iceberg", "iceberg_legs": 2, "iceberg_quantity": 50})
+
+
+def test_split_completes_when_children_fill():
+    async def run():
+        kite = FakeKite()
+        scheduler = ExecutionScheduler(kite, {})
+        parent = scheduler.submit(_params(250), strategy="split", slice_quantity=100)
+        await parent.task
+        assert kite.placed == [100, 100, 50]
+        assert parent.status == RUNNING
+        for order_id, child in list(parent.children.items()):
+            await scheduler.on_order_update(_fill(order_id, child["quantity"]))
+        return parent
+
+    parent = asyncio.run(run())
+    assert parent.status == COMPLETE
+    assert parent.filled == 250
+    assert parent.finished_at is not None
+
+
+def test_iceberg_places_one_slice_at_a_time():
+    async def run():
+        kite = FakeKite()
+        scheduler = ExecutionScheduler(kite, {})
+        parent = scheduler.submit(_params(200), strategy="iceberg", slice_quantity=100)
+        await _until(lambda: len(kite.placed) == 1)
+        await asyncio.sleep(0.05)
+        assert len(kite.placed) == 1
+        await scheduler.on_order_update(_fill("child-1", 100))
+        await _until(lambda: len(kite.placed) == 2)
+        await scheduler.on_order_update(_fill("child-2", 100))
+        await asyncio.wait_for(parent.task, 5)
+        return parent
+
+    assert asyncio.run(run()).status == COMPLETE
+
+
+def test_rejected_child_fails_the_parent():
+    async def run():
+        kite = FakeKite()
+        scheduler = ExecutionScheduler(kite, {})
+        parent = scheduler.submit(_params(200), strategy="iceberg", slice_quantity=100)
+        await _until(lambda: len(kite.placed) == 1)
+        await scheduler.on_order_update({"order_id": "child-1", "status": "REJECTED", "status_message": "margin"})
+        return parent
+
+    parent = asyncio.run(run())
+    assert parent.error == "Child order child-1 was rejected: margin"
+
+
+def test_child_accepted_after_cancel_is_recorded_and_cancelled():
+    async def run():
+        gate = threading.Event()
+        kite = FakeKite(gate)
+        scheduler = ExecutionScheduler(kite, {})
+        parent = scheduler.submit(_params(100), strategy="split")
+        await asyncio.sleep(0.05)
+        # place_order is still in flight when the parent is cancelled
+        await scheduler.cancel(parent.id)
+        gate.set()
+        await _until(lambda: kite.cancelled)
+        return parent, kite
+
+    parent, kite = asyncio.run(run())
+    assert parent.status == CANCELLED
+    assert list(parent.children) == ["child-1"]
+    assert kite.cancelled == ["child-1"]
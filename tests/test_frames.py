@@ -0,0 +1,64 @@
+import struct
+from datetime import datetime
+
+import pytest
+
+import frames
+from frames import LTP, OI, TIMESTAMP, VOLUME, decode_ticks, encode_ticks
+
+NOW = datetime(2024, 1, 2, 9, 15, 3)
+
+
+def _tick(token=256265, **fields):
+    return {"instrument_token": token, "last_price": 24000.5, "volume_traded": 1200, "oi": 0,
+            "exchange_timestamp": NOW, **fields}
+
+
+def test_round_trip():
+    last_sent = {}
+    frame = encode_ticks([_tick(), _tick(408065, last_price=1500.25, oi=None)], last_sent)
+    assert struct.unpack_from(">BBH", frame) == (frames.VERSION, frames.FRAME_TICKS, 2)
+    assert frame[4:9] == struct.pack(">IB", 256265, LTP | VOLUME | OI | TIMESTAMP)
+    assert decode_ticks(frame) == [
+        {"instrument_token": 256265, "last_price": 24000.5, "volume_traded": 1200, "oi": 0,
+         "exchange_timestamp": int(NOW.timestamp())},
+        {"instrument_token": 408065, "last_price": 1500.25, "volume_traded": 1200,
+         "exchange_timestamp": int(NOW.timestamp())},
+    ]
+    assert set(last_sent) == {256265, 408065}
+
+
+def test_only_changed_fields_are_sent():
+    last_sent = {}
+    encode_ticks([_tick(), _tick(408065)], last_sent)
+    assert encode_ticks([_tick(), _tick(408065)], last_sent) == b""
+
+    frame = encode_ticks([_tick(), _tick(408065, last_price=24001.0, volume_traded=1300)], last_sent)
+    assert frame[4:9] == struct.pack(">IB", 408065, LTP | VOLUME)
+    assert decode_ticks(frame) == [{"instrument_token": 408065, "last_price": 24001.0, "volume_traded": 1300}]
+
+
+def test_string_timestamps_match_datetimes():
+    last_sent = {}
+    encode_ticks([_tick()], last_sent)
+    assert encode_ticks([_tick(exchange_timestamp=NOW.isoformat(sep=" "))], last_sent) == b""
+
+
+def test_unknown_frames_are_rejected():
+    frame = encode_ticks([_tick()], {})
+    with pytest.raises(ValueError):
+        decode_ticks(struct.pack(">BBH", frames.VERSION + 1, frames.FRAME_TICKS, 1) + frame[4:])
+
+
+def test_large_and_float_values_round_trip():
+    frame = encode_ticks([_tick(volume_traded=7_500_000_000.0, oi=2 ** 40)], {})
+    tick = decode_ticks(frame)[0]
+    assert tick["volume_traded"] == 7_500_000_000
+    assert tick["oi"] == 2 ** 40
+
+
+def test_unencodable_tick_is_skipped():
+    last_sent = {}
+    frame = encode_ticks([_tick(volume_traded=-1), _tick(408065, oi="n/a"), _tick(738561)], last_sent)
+    assert [tick["instrument_token"] for tick in decode_ticks(frame)] == [738561]
+    assert list(last_sent) == [738561]
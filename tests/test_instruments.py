@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+import instruments
+from instruments import InstrumentMaster, resolve_tokens, to_records
+
+ROWS = [
+    {"instrument_token": 408065, "tradingsymbol": "INFY", "name": "INFOSYS", "exchange": "NSE", "segment": "NSE",
+     "instrument_type": "EQ", "tick_size": 0.05, "lot_size": 1},
+    {"instrument_token": 128053508, "tradingsymbol": "INFY", "name": "INFOSYS", "exchange": "BSE",
+     "segment": "BSE", "instrument_type": "EQ", "tick_size": 0.05, "lot_size": 1},
+    {"instrument_token": 4267265, "tradingsymbol": "INFY24DECFUT", "name": "INFY", "exchange": "NFO",
+     "segment": "NFO-FUT", "instrument_type": "FUT", "expiry": "2024-12-26", "tick_size": 0.05, "lot_size": 400},
+    {"instrument_token": 2953217, "tradingsymbol": "TCS", "name": "TATA CONSULTANCY", "exchange": "NSE",
+     "segment": "NSE", "instrument_type": "EQ", "tick_size": 0.05, "lot_size": 1},
+    {"instrument_token": 256265, "tradingsymbol": "NIFTY 50", "exchange": "NSE", "segment": "INDICES",
+     "instrument_type": "EQ"},
+]
+
+
+class FakeKite:
+    def __init__(self):
+        self.ltp_calls = []
+        self.dumps = 0
+
+    def ltp(self, symbols):
+        self.ltp_calls.append(list(symbols))
+        return {symbol: {"instrument_token": 1000 + i} for i, symbol in enumerate(symbols) if symbol != "NSE:NOPE"}
+
+    def instruments(self):
+        self.dumps += 1
+        return ROWS
+
+
+@pytest.fixture
+def master(monkeypatch):
+    master = InstrumentMaster("/nonexistent/instruments.npy")
+    master._index(to_records(ROWS))
+    monkeypatch.setattr(instruments, "master", master)
+    monkeypatch.setattr(instruments, "_symbol_tokens", {})
+    return master
+
+
+def test_symbol_and_token_indexes(master):
+    assert master.token("NSE:INFY") == 408065
+    assert master.token("BSE:INFY") == 128053508
+    assert master.token("NSE:NOPE") is None
+    assert master.symbol(2953217) == "NSE:TCS"
+    row = master.get("NFO:INFY24DECFUT")
+    assert (row["instrument_token"], row["lot_size"], row["expiry"]) == (4267265, 400, "2024-12-26")
+    assert master.get(256265)["segment"] == "INDICES"
+    assert master.get("4267265")["tradingsymbol"] == "INFY24DECFUT"
+    assert master.unknown(["NSE:INFY", "NSE:NOPE"]) == ["NSE:NOPE"]
+
+
+def test_prefix_search(master):
+    assert [row["tradingsymbol"] for row in master.search("inf")] == ["INFY", "INFY", "INFY24DECFUT"]
+    assert [row["exchange"] for row in master.search("INFY", exchange="NSE")] == ["NSE"]
+    assert [row["tradingsymbol"] for row in master.search("INF", segment="NFO-FUT")] == ["INFY24DECFUT"]
+    assert len(master.search("INF", limit=1)) == 1
+    assert master.search("ZZZ") == []
+
+
+def test_resolve_tokens_from_the_master(master):
+    kite = FakeKite()
+    resolved = asyncio.run(resolve_tokens(kite, ["NSE:INFY", "256265", 2953217, "NSE:NOPE"]))
+    assert resolved == {"NSE:INFY": 408065, "256265": 256265, 2953217: 2953217}
+    assert kite.ltp_calls == []
+
+
+def test_resolve_tokens_without_the_master(monkeypatch):
+    monkeypatch.setattr(instruments, "master", InstrumentMaster("/nonexistent/instruments.npy"))
+    monkeypatch.setattr(instruments, "_symbol_tokens", {})
+    kite = FakeKite()
+    assert asyncio.run(resolve_tokens(kite, ["NSE:INFY", "NSE:NOPE"])) == {"NSE:INFY": 1000}
+    # Resolved symbols are remembered; unknown ones are asked for again
+    assert asyncio.run(resolve_tokens(kite, ["NSE:INFY", "NSE:NOPE"])) == {"NSE:INFY": 1000}
+    assert kite.ltp_calls == [["NSE:INFY", "NSE:NOPE"], ["NSE:NOPE"]]
+
+
+def test_keep_fresh_downloads_once_a_client_is_available(tmp_path):
+    master = InstrumentMaster(str(tmp_path / "instruments.npy"))
+    kite = FakeKite()
+    clients = [None, kite]
+
+    async def run():
+        task = asyncio.ensure_future(master.keep_fresh(lambda: clients.pop(0) if clients else kite, interval=0.01))
+        for _ in range(100):
+            if master.loaded:
+                break
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(run())
+    assert master.loaded and not master.stale
+    assert master.token("NSE:TCS") == 2953217
+    assert kite.dumps == 1
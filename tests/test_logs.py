@@ -0,0 +1,63 @@
+import json
+import logging
+
+import pytest
+
+import logs
+from logs import JsonFormatter, SamplingFilter, parse_rates
+
+
+def _record(name="ticker", msg="Received %d ticks", level=logging.DEBUG, args=(5,), **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_parse_rates():
+    assert parse_rates("ticker=0.01, connections=0.1,,") == {"ticker": 0.01, "connections": 0.1}
+    assert parse_rates("a=2,b=-1") == {"a": 1.0, "b": 0.0}
+    assert parse_rates("") == {}
+    with pytest.raises(ValueError):
+        parse_rates("ticker")
+
+
+def test_sampling_keeps_the_first_and_every_nth_record():
+    sampler = SamplingFilter({"ticker": 0.25, "quiet": 0.0})
+    kept = [sampler.filter(_record()) for _ in range(9)]
+    assert kept == [True, False, False, False, True, False, False, False, True]
+    # Each message is counted on its own; child loggers inherit the rate
+    assert sampler.filter(_record(msg="Ticker connected"))
+    assert [sampler.filter(_record(name="ticker.child")) for _ in range(2)] == [True, False]
+    assert not sampler.filter(_record(name="quiet"))
+    # Warnings and unsampled loggers always pass
+    assert sampler.filter(_record(level=logging.WARNING))
+    assert sampler.filter(_record(name="broker"))
+
+
+def test_sampling_remembers_a_bounded_number_of_messages():
+    sampler = SamplingFilter({"ticker": 0.5}, max_messages=2)
+    for i in range(100):
+        sampler.filter(_record(msg=f"message {i}", args=()))
+    assert list(sampler._seen) == [("ticker", "message 98"), ("ticker", "message 99")]
+    # Seeing a message again makes it the most recent
+    sampler.filter(_record(msg="message 98", args=()))
+    sampler.filter(_record(msg="message 100", args=()))
+    assert list(sampler._seen) == [("ticker", "message 98"), ("ticker", "message 100")]
+
+
+def test_json_formatter_includes_request_id_and_extras():
+    record = _record(name="broker", level=logging.INFO, msg="kite.%s took %.3fs", args=("ltp", 0.0123),
+                     request_id="abc123", method="ltp", duration=0.0123)
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["level"] == "INFO" and entry["logger"] == "broker"
+    assert entry["message"] == "kite.ltp took 0.012s"
+    assert entry["request_id"] == "abc123"
+    assert (entry["method"], entry["duration"]) == ("ltp", 0.0123)
+    assert entry["ts"].endswith("+00:00")
+    assert "args" not in entry and "levelno" not in entry
+
+
+def test_new_request_id():
+    assert logs.new_request_id("client-id") == "client-id"
+    assert len(logs.new_request_id("x" * 65)) == 16
+    assert logs.new_request_id("bad\nid") != "bad\nid"
@@ -0,0 +1,18 @@
+import metrics
+
+
+def test_render_formats_labels_and_values():
+    registry = metrics.Registry()
+    counter = registry.register(metrics.Counter("demo_total", "Demo", ("route",)))
+    counter.inc(route='/a"b')
+    counter.inc(2, route='/a"b')
+    assert 'demo_total{route="/a\\"b"} 3' in registry.render()
+
+
+def test_scrapes_need_the_token_or_loopback():
+    assert metrics.scrape_allowed(None, "127.0.0.1", token="")
+    assert metrics.scrape_allowed(None, "::1", token="")
+    assert not metrics.scrape_allowed(None, "10.0.0.5", token="")
+    assert metrics.scrape_allowed("Bearer s3cret", "10.0.0.5", token="s3cret")
+    assert not metrics.scrape_allowed("Bearer wrong", "127.0.0.1", token="s3cret")
+    assert not metrics.scrape_allowed(None, "127.0.0.1", token="s3cret")
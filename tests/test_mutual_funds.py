@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+import mutual_funds
+from mutual_funds import MFCatalogue, to_records
+
+FUNDS = [
+    {"tradingsymbol": "INF209K01YY1", "name": "Aditya Birla Sun Life Liquid Fund", "amc": "BirlaSunLifeMutualFund_MF",
+     "scheme_type": "debt", "plan": "direct", "dividend_type": "growth", "last_price": 400.0},
+    {"tradingsymbol": "INF846K01EW2", "name": "Axis Bluechip Fund", "amc": "AxisMutualFund_MF",
+     "scheme_type": "equity", "plan": "direct", "dividend_type": "growth", "last_price": 55.0},
+    {"tradingsymbol": "INF846K01EX0", "name": "Axis Bluechip Fund", "amc": "AxisMutualFund_MF",
+     "scheme_type": "equity", "plan": "regular", "dividend_type": "payout", "last_price": 20.0},
+    {"tradingsymbol": "INF846K01FL2", "name": "Axis Liquid Fund", "amc": "AxisMutualFund_MF",
+     "scheme_type": "debt", "plan": "direct", "dividend_type": "growth", "last_price": 2600.0},
+]
+
+
+class FakeKite:
+    def __init__(self, error=None):
+        self.calls = 0
+        self.error = error
+
+    def mf_instruments(self):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return FUNDS
+
+
+@pytest.fixture
+def catalogue():
+    catalogue = MFCatalogue("/nonexistent/mf_instruments.npy")
+    catalogue._index(to_records(FUNDS))
+    return catalogue
+
+
+def _symbols(result):
+    return [fund["tradingsymbol"] for fund in result["results"]]
+
+
+def test_search_by_name_prefix_and_facets(catalogue):
+    assert _symbols(catalogue.search("axis liq")) == ["INF846K01FL2"]
+    assert catalogue.search("blue", plan="Direct")["total"] == 1
+    assert _symbols(catalogue.search(scheme_type="debt")) == ["INF209K01YY1", "INF846K01FL2"]
+    assert catalogue.search("bluechip", amc="nobody")["total"] == 0
+
+    page = catalogue.search(amc="axismutualfund_mf", offset=1, limit=1)
+    assert (page["total"], page["offset"], page["limit"], len(page["results"])) == (3, 1, 1, 1)
+
+
+def test_get_and_facets(catalogue):
+    assert catalogue.get("inf846k01ew2")["name"] == "Axis Bluechip Fund"
+    assert catalogue.get("INF000000000") is None
+    assert {"value": "AxisMutualFund_MF", "count": 3} in catalogue.facets()["amc"]
+
+
+def test_refresh_downloads_and_maps_the_catalogue(tmp_path):
+    catalogue = MFCatalogue(str(tmp_path / "mf_instruments.npy"))
+    kite = FakeKite()
+
+    asyncio.run(catalogue.ensure_loaded(kite))
+    assert catalogue.loaded and not catalogue.stale
+    assert len(catalogue) == len(FUNDS)
+    assert catalogue.ensure_fresh(kite) is None
+    assert kite.calls == 1
+
+
+def test_failed_refresh_backs_off(tmp_path, monkeypatch):
+    catalogue = MFCatalogue(str(tmp_path / "mf_instruments.npy"))
+    kite = FakeKite(error=RuntimeError("Kite is down"))
+
+    async def run():
+        await catalogue.ensure_loaded(kite)
+        assert catalogue.backing_off
+        # Requests during the backoff are answered from what is there, without a download
+        assert catalogue.ensure_fresh(kite) is None
+        await catalogue.ensure_loaded(kite)
+        assert kite.calls == 1
+
+        monkeypatch.setattr(mutual_funds, "MF_REFRESH_RETRY", 0)
+        kite.error = None
+        await catalogue.ensure_loaded(kite)
+
+    asyncio.run(run())
+    assert kite.calls == 2
+    assert catalogue.loaded and not catalogue.backing_off
@@ -0,0 +1,45 @@
+import hashlib
+from datetime import datetime
+
+from orderbook import OrderBook, parse_timestamps, verify_postback
+
+SECRET = "secret"
+
+
+def _postback(**fields):
+    order = {"order_id": "220101000000001", "order_timestamp": "2024-01-02 09:15:03", "status": "COMPLETE",
+             **fields}
+    payload = f"{order['order_id']}{order['order_timestamp']}{SECRET}"
+    return {**order, "checksum": hashlib.sha256(payload.encode("utf-8")).hexdigest()}
+
+
+def test_verify_postback():
+    assert verify_postback(_postback(), SECRET)
+    assert not verify_postback(_postback(), "other secret")
+    assert not verify_postback({**_postback(), "order_timestamp": "2024-01-02 09:15:04"}, SECRET)
+    assert not verify_postback({**_postback(), "checksum": ""}, SECRET)
+    assert not verify_postback({"order_id": "1"}, SECRET)
+
+
+def test_pushed_timestamps_are_parsed():
+    book = OrderBook()
+    order = book.apply(_postback(exchange_timestamp="2024-01-02 09:15:04", exchange_update_timestamp=""))
+    assert order["order_timestamp"] == datetime(2024, 1, 2, 9, 15, 3)
+    assert order["exchange_timestamp"] == datetime(2024, 1, 2, 9, 15, 4)
+    assert order["exchange_update_timestamp"] is None
+    assert "checksum" not in order
+
+    seeded = {"order_id": "1", "order_timestamp": datetime(2024, 1, 2, 9, 0), "status": "OPEN"}
+    assert parse_timestamps(seeded) is seeded
+
+
+def test_orders_sort_by_time_whatever_the_source():
+    book = OrderBook()
+    book.seed([
+        {"order_id": "a", "order_timestamp": datetime(2024, 1, 2, 10, 0, 0), "status": "COMPLETE"},
+        {"order_id": "b", "order_timestamp": datetime(2024, 1, 2, 9, 59, 59, 500000), "status": "COMPLETE"},
+    ])
+    book.apply({"order_id": "c", "order_timestamp": "2024-01-02 09:59:59", "status": "OPEN"})
+    book.apply({"order_id": "d", "order_timestamp": "2024-01-02 10:00:01", "status": "OPEN"})
+    book.apply({"order_id": "e", "status": "OPEN"})
+    assert [order["order_id"] for order in book.orders()] == ["e", "c", "b", "a", "d"]
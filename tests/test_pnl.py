@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from pnl import HOLDINGS, POSITIONS, PositionBook
+
+TOKEN = 408065
+
+
+def _position(**overrides):
+    position = {
+        "instrument_token": TOKEN, "tradingsymbol": "INFY", "exchange": "NSE", "product": "MIS",
+        "quantity": 10, "average_price": 100.0, "last_price": 110.0,
+        "buy_quantity": 10, "sell_quantity": 0, "buy_value": 1000.0, "sell_value": 0.0, "multiplier": 1,
+    }
+    position.update(overrides)
+    return position
+
+
+def _order(order_id="1", filled=10, price=100.0, side="BUY"):
+    return {
+        "order_id": order_id, "instrument_token": TOKEN, "tradingsymbol": "INFY", "exchange": "NSE",
+        "product": "MIS", "transaction_type": side, "filled_quantity": filled, "average_price": price,
+    }
+
+
+def _entry(book):
+    return book.entries(POSITIONS)[0]
+
+
+def test_seed_requires_orders():
+    with pytest.raises(ValueError):
+        PositionBook().seed([], {"net": []}, None)
+
+
+def test_fill_already_in_snapshot_is_not_applied_again():
+    book = PositionBook()
+    # Order 1 has filled 10 of 20; the snapshot's position includes those 10
+    book.seed([], {"net": [_position()]}, [_order(filled=10)])
+    book.apply_order(_order(filled=15))
+    entry = _entry(book)
+    assert entry["quantity"] == 15
+    assert book.fills_applied == 1
+
+
+def test_fill_deltas_accumulate():
+    book = PositionBook()
+    book.seed([], {"net": []}, [])
+    book.apply_order(_order(filled=4, price=100.0))
+    book.apply_order(_order(filled=10, price=102.0))
+    # A repeated or older update changes nothing
+    book.apply_order(_order(filled=10, price=102.0))
+    book.apply_order(_order(filled=6, price=101.0))
+    entry = _entry(book)
+    assert entry["quantity"] == 10
+    assert entry["average_price"] == pytest.approx(102.0)
+    assert book.fills_applied == 2
+
+
+def test_sell_fill_closes_position_and_books_pnl():
+    book = PositionBook()
+    book.seed([], {"net": [_position(last_price=100.0)]}, [])
+    book.apply_order(_order(order_id="2", filled=10, price=105.0, side="SELL"))
+    entry = _entry(book)
+    assert entry["quantity"] == 0
+    assert entry["pnl"] == pytest.approx(50.0)
+    assert book.totals[POSITIONS] == pytest.approx(50.0)
+
+
+def test_ticks_reprice_holdings_and_positions():
+    book = PositionBook()
+    holding = {"instrument_token": TOKEN, "tradingsymbol": "INFY", "exchange": "NSE",
+               "quantity": 5, "average_price": 90.0, "last_price": 90.0}
+    book.seed([holding], {"net": [_position()]}, [])
+    asyncio.run(book.on_ticks([{"instrument_token": TOKEN, "last_price": 120.0}]))
+    assert book.totals[HOLDINGS] == pytest.approx(150.0)
+    assert book.totals[POSITIONS] == pytest.approx(200.0)
+
+
+def test_orders_before_seeding_are_ignored():
+    book = PositionBook()
+    book.apply_order(_order())
+    assert book.entries() == []
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+from kiteconnect.exceptions import NetworkException
+
+import cache
+import portfolio
+from pnl import HOLDINGS, PositionBook
+from portfolio import SnapshotError, load_snapshot
+
+HOLDING = {"tradingsymbol": "INFY", "exchange": "NSE", "isin": "INE009A01021", "instrument_token": 408065,
+           "quantity": 10, "average_price": 1400.0, "last_price": 1500.0, "pnl": 1000.0}
+
+
+class FakeKite:
+    access_token = "token"
+
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.calls = []
+
+    def _part(self, name, value):
+        self.calls.append(name)
+        if name in self.failing:
+            raise NetworkException(f"{name} is unavailable")
+        return value
+
+    def holdings(self):
+        return self._part("holdings", [HOLDING])
+
+    def positions(self):
+        return self._part("positions", {"net": [], "day": []})
+
+    def margins(self):
+        return self._part("margins", {"equity": {"net": 5000.0}})
+
+    def orders(self):
+        return self._part("orders", [])
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(cache, "default_cache", cache.TTLCache())
+
+
+def test_failing_part_is_reported_and_the_rest_load():
+    snapshot = asyncio.run(load_snapshot(FakeKite(failing=("positions",))))
+    assert snapshot["holdings"] == [HOLDING]
+    assert snapshot["margins"] == {"equity": {"net": 5000.0}}
+    assert snapshot["positions"] == {}
+    assert snapshot["errors"] == {"positions": "positions is unavailable"}
+
+
+def test_snapshot_fails_when_every_part_fails():
+    with pytest.raises(SnapshotError):
+        asyncio.run(load_snapshot(FakeKite(failing=portfolio.SNAPSHOT_PARTS)))
+
+
+def test_seed_parts_skip_the_cache():
+    kite = FakeKite()
+
+    async def run():
+        await load_snapshot(kite, portfolio.SEED_PARTS)
+        kite.calls.clear()
+        return await load_snapshot(kite, portfolio.SEED_PARTS, fresh=portfolio.SEED_FRESH)
+
+    snapshot = asyncio.run(run())
+    # Positions and orders come from one fresh fetch; the rest stays cached
+    assert sorted(kite.calls) == ["orders", "positions"]
+    assert snapshot["orders"] == [] and not snapshot["errors"]
+
+
+def test_holdings_columns():
+    holdings = portfolio.Holdings.from_payload([HOLDING, {**HOLDING, "tradingsymbol": "TCS", "quantity": 0}])
+    assert len(holdings) == 1
+    assert holdings.get("INFY")["quantity"] == 10
+    assert holdings.total_value == pytest.approx(15000.0)
+    assert holdings.total_pnl == pytest.approx(1000.0)
+
+
+def test_unsettled_shares_count_the_same_for_the_book_and_the_payload():
+    payload = [{**HOLDING, "quantity": 6, "t1_quantity": 4}, {**HOLDING, "tradingsymbol": "TCS", "quantity": 0,
+                                                             "t1_quantity": 5, "instrument_token": 2953217}]
+    book = PositionBook()
+    book.seed(payload, {"net": []}, [])
+    from_book = portfolio.Holdings.from_payload(book.entries(HOLDINGS)).rows()
+    from_payload = portfolio.Holdings.from_payload(payload).rows()
+    assert [row["quantity"] for row in from_payload] == [row["quantity"] for row in from_book] == [10, 5]
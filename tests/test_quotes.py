@@ -0,0 +1,73 @@
+import asyncio
+import threading
+
+from quotes import QuoteAggregator
+
+
+class FakeKite:
+    calls = []
+    lock = threading.Lock()
+
+    def __init__(self, access_token):
+        self.access_token = access_token
+
+    def quote(self, symbols):
+        with self.lock:
+            self.calls.append((self.access_token, sorted(symbols)))
+        return {s: {"instrument_token": i, "last_price": 100.0 + i} for i, s in enumerate(symbols)}
+
+
+def _run(coro):
+    FakeKite.calls = []
+    return asyncio.run(coro)
+
+
+def test_lookups_in_a_window_share_one_call():
+    async def run():
+        aggregator = QuoteAggregator(window=0.01)
+        kite = FakeKite("a")
+        first, second = await asyncio.gather(
+            aggregator.get(kite, ["NSE:INFY", "NSE:TCS"]),
+            aggregator.get(kite, ["NSE:TCS", "NSE:SBIN"]),
+        )
+        assert set(first) == {"NSE:INFY", "NSE:TCS"}
+        assert set(second) == {"NSE:TCS", "NSE:SBIN"}
+        # Fresh values answer without another call, and answer LTP lookups too
+        ltp = await aggregator.get(kite, ["NSE:INFY"], kind="ltp")
+        assert set(ltp["NSE:INFY"]) == {"instrument_token", "last_price"}
+        return aggregator
+
+    aggregator = _run(run())
+    assert FakeKite.calls == [("a", ["NSE:INFY", "NSE:SBIN", "NSE:TCS"])]
+    assert aggregator.stats()["coalesced"] == 1
+    assert aggregator._pending == {} and aggregator._queued == {}
+
+
+def test_each_session_fetches_with_its_own_token():
+    async def run():
+        aggregator = QuoteAggregator(window=0.01)
+        await asyncio.gather(
+            aggregator.get(FakeKite("a"), ["NSE:INFY"]),
+            aggregator.get(FakeKite("b"), ["NSE:INFY", "NSE:TCS"]),
+        )
+
+    _run(run())
+    assert sorted(FakeKite.calls) == [("a", ["NSE:INFY"]), ("b", ["NSE:INFY", "NSE:TCS"])]
+
+
+def test_failure_reaches_only_that_sessions_callers():
+    class Expired(FakeKite):
+        def quote(self, symbols):
+            raise RuntimeError("token expired")
+
+    async def run():
+        aggregator = QuoteAggregator(window=0.01)
+        return await asyncio.gather(
+            aggregator.get(Expired("a"), ["NSE:INFY"]),
+            aggregator.get(FakeKite("b"), ["NSE:INFY"]),
+            return_exceptions=True,
+        )
+
+    failed, ok = _run(run())
+    assert isinstance(failed, RuntimeError)
+    assert "NSE:INFY" in ok
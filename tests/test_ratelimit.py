@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+import ratelimit
+from ratelimit import PRIORITY_HIGH, PRIORITY_LOW, RateLimiter, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_up_to_capacity_then_refill(clock):
+    async def run():
+        bucket = TokenBucket("test", rate=2, burst=3)
+        for _ in range(3):
+            await bucket.acquire()
+        assert bucket.tokens == pytest.approx(0)
+        clock.now += 1.0
+        bucket._refill()
+        assert bucket.tokens == pytest.approx(2)
+        clock.now += 60
+        bucket._refill()
+        assert bucket.tokens == pytest.approx(3)
+
+    asyncio.run(run())
+
+
+def test_grant_log_is_trimmed_without_stats(clock):
+    async def run():
+        bucket = TokenBucket("test", rate=1000)
+        for _ in range(50):
+            for _ in range(100):
+                await bucket.acquire()
+            clock.now += 1.0
+        # Only grants inside the utilisation window are kept
+        assert len(bucket._grants) <= 100 * (ratelimit._UTILISATION_WINDOW + 1)
+        assert bucket.granted == 5000
+
+    asyncio.run(run())
+
+
+def test_waiters_are_released_by_priority():
+    async def run():
+        bucket = TokenBucket("test", rate=50, burst=1)
+        await bucket.acquire()
+        order = []
+
+        async def wait(name, priority):
+            await bucket.acquire(priority)
+            order.append(name)
+
+        await asyncio.gather(wait("low", PRIORITY_LOW), wait("high", PRIORITY_HIGH), wait("low2", PRIORITY_LOW))
+        assert order == ["high", "low", "low2"]
+        assert bucket.stats()["delayed"] == 3
+
+    asyncio.run(run())
+
+
+def test_penalise_empties_the_bucket():
+    bucket = TokenBucket("test", rate=5)
+    bucket.penalise()
+    assert bucket.tokens <= 0
+    assert bucket.stats()["throttled"] == 1
+
+
+def test_endpoint_classes():
+    limiter = RateLimiter({"quote": 1, "orders": 10, "default": 10})
+
+    def place_order():
+        pass
+
+    def quote():
+        pass
+
+    def profile():
+        pass
+
+    assert limiter.bucket_for(place_order).name == "orders"
+    assert limiter.bucket_for(quote).name == "quote"
+    assert limiter.bucket_for(profile).name == "default"
+    assert limiter.priority_for(place_order) == PRIORITY_HIGH
+
+
+def test_backoff_is_bounded():
+    for attempt in range(4):
+        assert 0 <= ratelimit.backoff(attempt) <= ratelimit.RATE_LIMIT_BACKOFF * 2 ** attempt
@@ -0,0 +1,137 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import sessions
+import state
+from candles import IST
+from sessions import EVICTED, EXPIRED, LOGOUT, SessionStore, SqliteSessionBackend, StateSessionBackend, token_expiry
+
+
+class FakeKite:
+    def __init__(self, access_token):
+        self.access_token = access_token
+        self.expiry_hook = None
+
+    def set_session_expiry_hook(self, hook):
+        self.expiry_hook = hook
+
+
+class Recorder:
+    def __init__(self, store):
+        self.events = []
+        store.on_open(self.opened)
+        store.on_close(self.closed)
+
+    async def opened(self, session, reason):
+        self.events.append(("open", session.user_id, reason))
+
+    async def closed(self, session, reason):
+        self.events.append(("close", session.user_id, reason))
+
+
+def test_token_expiry_is_the_next_six_am():
+    assert token_expiry(datetime(2024, 1, 2, 9, 30, tzinfo=IST)) == datetime(2024, 1, 3, 6, 0, tzinfo=IST)
+    assert token_expiry(datetime(2024, 1, 2, 5, 0, tzinfo=IST)) == datetime(2024, 1, 2, 6, 0, tzinfo=IST)
+
+
+def test_least_recently_used_session_is_evicted():
+    store = SessionStore(FakeKite, max_sessions=2)
+    recorder = Recorder(store)
+
+    async def run():
+        a = await store.create(FakeKite("a"), "A")
+        b = await store.create(FakeKite("b"), "B")
+        # Touching A makes B the oldest
+        assert await store.get(a.id) is a
+        await store.create(FakeKite("c"), "C")
+        return a, b
+
+    a, b = asyncio.run(run())
+    assert [session.user_id for session in store] == ["A", "C"]
+    assert b.closed and not a.closed
+    assert recorder.events[-1] == ("close", "B", EVICTED)
+    assert store.stats()["evicted"] == 1
+
+
+def test_expired_revoked_and_logged_out_sessions_end():
+    store = SessionStore(FakeKite)
+    recorder = Recorder(store)
+
+    async def run():
+        expired = await store.create(FakeKite("a"), "A")
+        expired.expires_at = datetime.now(IST) - timedelta(seconds=1)
+        revoked = await store.create(FakeKite("b"), "B")
+        revoked.kite.expiry_hook()
+        logged_out = await store.create(FakeKite("c"), "C")
+        results = [await store.get(s.id) for s in (expired, revoked)]
+        await store.delete(logged_out.id)
+        results.append(await store.get(logged_out.id))
+        return results
+
+    assert asyncio.run(run()) == [None, None, None]
+    assert len(store) == 0
+    assert [event for event in recorder.events if event[0] == "close"] == [
+        ("close", "A", EXPIRED), ("close", "B", EXPIRED), ("close", "C", LOGOUT),
+    ]
+    assert store.find("c") is None and store.for_user("C") == []
+
+
+def _round_trip(backend):
+    """Create a session in one store and restore it in another sharing the backend"""
+    first = SessionStore(FakeKite, backend=backend)
+    second = SessionStore(FakeKite, backend=backend)
+
+    async def run():
+        created = await first.create(FakeKite("token"), "AB1234")
+        restored = await second.get(created.id)
+        await second.delete(created.id)
+        return created, restored, await backend.load(created.id)
+
+    created, restored, after_logout = asyncio.run(run())
+    assert restored is not created
+    assert (restored.id, restored.user_id, restored.access_token) == (created.id, "AB1234", "token")
+    assert restored.expires_at == created.expires_at.replace(microsecond=0)
+    assert restored.kite.expiry_hook is not None
+    assert second.stats()["restored"] == 1
+    assert after_logout is None
+
+
+def test_sqlite_backend_round_trip(tmp_path, monkeypatch):
+    opened = []
+    connect = sqlite3.connect
+
+    def tracking_connect(*args, **kwargs):
+        opened.append(connect(*args, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(sessions.sqlite3, "connect", tracking_connect)
+    _round_trip(SqliteSessionBackend(str(tmp_path / "sessions.sqlite")))
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+def test_state_backend_round_trip():
+    _round_trip(StateSessionBackend(state.MemoryState()))
+
+
+def test_logout_on_another_worker_ends_the_session_here():
+    shared = state.MemoryState()
+    store = SessionStore(FakeKite, backend=StateSessionBackend(shared))
+    recorder = Recorder(store)
+
+    async def run():
+        session = await store.create(FakeKite("token"), "AB1234")
+        # Our own announcement is ignored; one from another worker is not
+        await shared.publish(sessions.CLOSED_CHANNEL, {"worker": state.WORKER_ID, "id": session.id})
+        await asyncio.sleep(0)
+        assert len(store) == 1
+        await shared.publish(sessions.CLOSED_CHANNEL, {"worker": "other:1", "id": session.id})
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert len(store) == 0
+    assert recorder.events[-1] == ("close", "AB1234", sessions.ELSEWHERE)
@@ -0,0 +1,97 @@
+import asyncio
+from datetime import date, datetime
+
+import fakeredis
+import pytest
+
+import state
+from state import MemoryState, RedisState
+
+
+def _redis(server):
+    return RedisState(fakeredis.FakeAsyncRedis(server=server), prefix="test:")
+
+
+def test_values_round_trip_through_json():
+    value = {"when": datetime(2024, 1, 2, 9, 15), "day": date(2024, 1, 2), "rows": [1, 2.5, None]}
+    assert state.loads(state.dumps(value)) == value
+
+
+@pytest.mark.parametrize("make", [lambda: MemoryState(), lambda: _redis(fakeredis.FakeServer())])
+def test_get_set_delete_and_keys(make):
+    backend = make()
+
+    async def run():
+        assert await backend.get("a") is None
+        assert await backend.set("a", {"n": 1})
+        assert not await backend.set("a", {"n": 2}, only_if_missing=True)
+        await backend.set("b", [1, 2])
+        values = await backend.get("a"), await backend.get("b")
+        keys = sorted(await backend.keys(""))
+        await backend.delete("a", "b")
+        return values, keys, await backend.get("a")
+
+    values, keys, deleted = asyncio.run(run())
+    assert values == ({"n": 1}, [1, 2])
+    assert keys == ["a", "b"]
+    assert deleted is None
+
+
+@pytest.mark.parametrize("make", [lambda: MemoryState(), lambda: _redis(fakeredis.FakeServer())])
+def test_values_expire_after_their_ttl(make):
+    backend = make()
+
+    async def run():
+        await backend.set("lease", "w1", ttl=0.05)
+        held = await backend.get("lease")
+        await asyncio.sleep(0.1)
+        return held, await backend.get("lease"), await backend.set("lease", "w2", only_if_missing=True)
+
+    assert asyncio.run(run()) == ("w1", None, True)
+
+
+def test_redis_keys_are_prefixed():
+    server = fakeredis.FakeServer()
+    backend = _redis(server)
+
+    async def run():
+        await backend.set("ticker:leader", "w1")
+        raw = await fakeredis.FakeAsyncRedis(server=server).keys("*")
+        return raw, await backend.keys("ticker:")
+
+    raw, keys = asyncio.run(run())
+    assert raw == [b"test:ticker:leader"]
+    assert keys == ["ticker:leader"]
+
+
+def test_published_messages_reach_every_subscriber():
+    server = fakeredis.FakeServer()
+    first, second = _redis(server), _redis(server)
+    received = []
+
+    async def handler(message):
+        received.append(message)
+
+    async def run():
+        first.subscribe("ticks", handler)
+        await first.start()
+        await second.start()
+        # Subscribing after start listens at once
+        second.subscribe("ticks", handler)
+        await asyncio.sleep(0.05)
+        await second.publish("ticks", {"worker": "w2", "ticks": [{"instrument_token": 1}]})
+        for _ in range(100):
+            if len(received) == 2:
+                break
+            await asyncio.sleep(0.02)
+        await first.close()
+        await second.close()
+
+    asyncio.run(run())
+    assert received == [{"worker": "w2", "ticks": [{"instrument_token": 1}]}] * 2
+
+
+def test_create_backend():
+    assert isinstance(state.create_backend("memory"), MemoryState)
+    with pytest.raises(ValueError):
+        state.create_backend("zookeeper")
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+from kiteconnect import KiteTicker
+
+from ticker import TickerBridge, project_tick
+
+LTP, QUOTE, FULL = KiteTicker.MODE_LTP, KiteTicker.MODE_QUOTE, KiteTicker.MODE_FULL
+
+FULL_TICK = {
+    "instrument_token": 256265, "mode": FULL, "tradable": True, "last_price": 24000.5,
+    "ohlc": {"open": 23900.0}, "volume_traded": 1200, "oi": 50, "exchange_timestamp": "2024-01-02T09:15:03",
+    "depth": {"buy": [], "sell": []},
+}
+
+
+class FakeTicker:
+    def __init__(self, api_key, access_token):
+        self.calls = []
+
+    def connect(self, threaded=False):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+    def subscribe(self, tokens):
+        self.calls.append(("subscribe", sorted(tokens)))
+
+    def unsubscribe(self, tokens):
+        self.calls.append(("unsubscribe", sorted(tokens)))
+
+    def set_mode(self, mode, tokens):
+        self.calls.append(("set_mode", mode, sorted(tokens)))
+
+
+@pytest.fixture
+def bridge():
+    async def start():
+        bridge = TickerBridge("key", mode=QUOTE, ticker_factory=FakeTicker)
+        bridge.start("token")
+        return bridge
+
+    return asyncio.run(start())
+
+
+def test_tokens_are_subscribed_once_and_released_by_the_last_client(bridge):
+    bridge.subscribe("a", [1, 2])
+    bridge.subscribe("b", [2, 3])
+    assert bridge._ticker.calls == [
+        ("subscribe", [1, 2]), ("set_mode", QUOTE, [1, 2]),
+        ("subscribe", [3]), ("set_mode", QUOTE, [3]),
+    ]
+    bridge._ticker.calls.clear()
+
+    bridge.unsubscribe("a")
+    assert bridge._ticker.calls == [("unsubscribe", [1])]
+    assert sorted(bridge.subscribed_tokens()) == [2, 3]
+    bridge.unsubscribe("b", [2, 3])
+    assert bridge.subscribed_tokens() == []
+    assert bridge.clients() == []
+
+
+def test_upstream_mode_is_the_richest_and_downgrades(bridge):
+    bridge.subscribe("a", [1], LTP)
+    bridge.subscribe("b", [1], FULL)
+    bridge.subscribe("c", [1], QUOTE)
+    assert bridge._upstream_mode(1) == FULL
+    bridge._ticker.calls.clear()
+
+    bridge.unsubscribe("b")
+    assert bridge._ticker.calls == [("set_mode", QUOTE, [1])]
+    bridge.unsubscribe("c")
+    assert bridge._ticker.calls[-1] == ("set_mode", LTP, [1])
+    # A client switching its own mode moves its reference
+    bridge.subscribe("a", [1], FULL)
+    assert bridge._mode_counts[1] == {FULL: 1}
+
+
+def test_set_tokens_replaces_a_subscription(bridge):
+    bridge.subscribe("a", [1, 2], QUOTE)
+    bridge.set_tokens("a", {2: FULL, 3: LTP})
+    assert bridge.tokens_for("a") == {2: FULL, 3: LTP}
+    assert sorted(bridge.subscribed_tokens()) == [2, 3]
+
+
+def test_invalid_mode_takes_no_reference(bridge):
+    with pytest.raises(ValueError):
+        bridge.subscribe("a", [1], "depth")
+    assert bridge.subscribed_tokens() == []
+
+
+def test_project_tick():
+    assert project_tick(FULL_TICK, FULL) is FULL_TICK
+    assert project_tick(FULL_TICK, LTP) == {
+        "instrument_token": 256265, "mode": LTP, "tradable": True, "last_price": 24000.5,
+    }
+    quote = project_tick(FULL_TICK, QUOTE)
+    assert quote["mode"] == QUOTE
+    assert quote["ohlc"] == {"open": 23900.0} and quote["volume_traded"] == 1200
+    assert not {"oi", "depth", "exchange_timestamp"} & set(quote)
+    # Ticks are never padded up to a richer mode
+    ltp_tick = project_tick(FULL_TICK, LTP)
+    assert project_tick(ltp_tick, FULL) is ltp_tick
+
+
+def test_ticks_reach_listeners_and_last_ticks(bridge):
+    received = []
+
+    async def listener(ticks):
+        received.extend(ticks)
+
+    async def run():
+        bridge.add_listener(listener)
+        bridge.subscribe("a", [256265])
+        bridge.dispatch_ticks([FULL_TICK, {**FULL_TICK, "instrument_token": 1}])
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert len(received) == 2
+    assert list(bridge.last_ticks) == [256265]
@@ -0,0 +1,92 @@
+import httpx
+import pytest
+import requests
+from kiteconnect.exceptions import TokenException
+
+import transport
+from transport import HttpxSession, create_kite
+
+
+def _session(handler):
+    return HttpxSession(pool_size=4, transport=httpx.MockTransport(handler))
+
+
+def _kite(handler):
+    kite = create_kite("key", access_token="token")
+    kite.reqsession = _session(handler)
+    return kite
+
+
+def test_create_kite_uses_a_pooled_httpx_session():
+    kite = create_kite("key", transport="httpx")
+    assert isinstance(kite.reqsession, HttpxSession)
+    assert kite.reqsession.client.timeout == httpx.Timeout(
+        transport.KITE_READ_TIMEOUT, connect=transport.KITE_CONNECT_TIMEOUT
+    )
+    transport.close(kite)
+    assert kite.reqsession.client.is_closed
+
+
+def test_create_kite_with_requests_sizes_the_pool():
+    kite = create_kite("key", transport="requests")
+    assert isinstance(kite.reqsession, requests.Session)
+    assert kite.reqsession.get_adapter("https://api.kite.trade")._pool_maxsize == transport.KITE_POOL_SIZE
+    with pytest.raises(ValueError):
+        create_kite("key", transport="urllib")
+
+
+def test_kite_requests_go_through_the_client():
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(200, json={"status": "success", "data": {"user_id": "AB1234"}})
+
+    assert _kite(handler).profile() == {"user_id": "AB1234"}
+    request = seen[0]
+    assert (request.method, request.url.path) == ("GET", "/user/profile")
+    assert request.headers["Authorization"] == "token key:token"
+
+
+def test_form_and_query_parameters_are_passed_on():
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        data = {"order_id": "1"} if request.method == "POST" else {"candles": []}
+        return httpx.Response(200, json={"status": "success", "data": data})
+
+    kite = _kite(handler)
+    kite.place_order(variety="regular", exchange="NSE", tradingsymbol="INFY", transaction_type="BUY",
+                     quantity=1, product="CNC", order_type="MARKET")
+    kite.historical_data(408065, "2024-01-01", "2024-01-02", "day")
+    post, get = seen
+    assert post.url.path == "/orders/regular" and b"tradingsymbol=INFY" in post.content
+    assert get.url.path == "/instruments/historical/408065/day"
+    assert get.url.params["from"] == "2024-01-01"
+
+
+def test_api_errors_raise_kite_exceptions():
+    def handler(request):
+        return httpx.Response(403, json={"status": "error", "error_type": "TokenException",
+                                         "message": "Invalid session"})
+
+    with pytest.raises(TokenException) as error:
+        _kite(handler).profile()
+    assert error.value.code == 403
+
+
+@pytest.mark.parametrize("raised, expected", [
+    (httpx.ConnectTimeout("connect"), requests.exceptions.ConnectTimeout),
+    (httpx.ReadTimeout("read"), requests.exceptions.ReadTimeout),
+    (httpx.PoolTimeout("pool"), requests.exceptions.Timeout),
+    (httpx.ConnectError("refused"), requests.exceptions.ConnectionError),
+    (httpx.RemoteProtocolError("reset"), requests.exceptions.RequestException),
+])
+def test_transport_errors_map_to_requests_exceptions(raised, expected):
+    def handler(request):
+        raise raised
+
+    with pytest.raises(expected) as error:
+        _kite(handler).profile()
+    assert error.value.__cause__ is raised
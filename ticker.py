@@ -0,0 +1,328 @@
+"""Shared KiteTicker streaming bridge.
+
+One upstream KiteTicker connection per process carries the union of the
+instrument tokens subscribed by every ``/ws`` client. Each token is reference
+counted per streaming mode, so it is subscribed upstream when its first client
+asks for it, streamed in the richest mode any client wants, and unsubscribed
+when its last client goes away. Ticks are decoded once on the ticker thread
+and handed to the event loop, where listeners fan them out.
+
+With several workers only one of them holds the upstream connection (see
+``cluster.py``); the others receive its ticks with :meth:`dispatch_ticks`.
+"""
+import asyncio
+import logging
+import os
+import threading
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from kiteconnect import KiteTicker
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Streaming modes, from the leanest to the richest
+MODES = (KiteTicker.MODE_LTP, KiteTicker.MODE_QUOTE, KiteTicker.MODE_FULL)
+
+TICKER_MODE = os.getenv("TICKER_MODE", KiteTicker.MODE_QUOTE)
+
+# Fields carried by each mode; full mode carries everything
+_LTP_FIELDS = {"instrument_token", "mode", "tradable", "last_price"}
+_FULL_ONLY_FIELDS = {"last_trade_time", "oi", "oi_day_high", "oi_day_low", "exchange_timestamp", "depth"}
+
+TickListener = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+OrderListener = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def _jsonable(value: Any) -> Any:
+    """Convert a decoded tick into plain JSON types"""
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def project_tick(tick: Dict[str, Any], mode: str) -> Dict[str, Any]:
+    """Trim a tick down to the fields of a leaner mode"""
+    if MODES.index(mode) >= MODES.index(tick.get("mode", KiteTicker.MODE_FULL)):
+        return tick
+    if mode == KiteTicker.MODE_LTP:
+        projected = {k: v for k, v in tick.items() if k in _LTP_FIELDS}
+    else:
+        projected = {k: v for k, v in tick.items() if k not in _FULL_ONLY_FIELDS}
+    projected["mode"] = mode
+    return projected
+
+
+def _call_in_reactor(fn: Callable, *args) -> None:
+    """Run a ticker method on the Twisted reactor thread"""
+    from twisted.internet import reactor
+
+    if reactor.running:
+        reactor.callFromThread(fn, *args)
+    else:
+        fn(*args)
+
+
+class TickerBridge:
+    """Reference-counted fan-out over a single upstream KiteTicker"""
+
+    def __init__(self, api_key: str, mode: str = TICKER_MODE, ticker_factory: Callable = KiteTicker):
+        self.api_key = api_key
+        self.mode = mode
+        self._ticker_factory = ticker_factory
+        self._ticker = None
+        self._access_token: Optional[str] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+        # token -> {mode: number of clients subscribed in that mode}
+        self._mode_counts: Dict[int, Dict[str, int]] = {}
+        self._subscriptions: Dict[Any, Dict[int, str]] = {}
+        # Last value seen for each subscribed instrument
+        self.last_ticks: Dict[int, Dict[str, Any]] = {}
+        self._listeners: List[TickListener] = []
+        self._order_listeners: List[OrderListener] = []
+        # Listeners for data from this process's own upstream connection only
+        self._upstream_listeners: List[TickListener] = []
+        self._upstream_order_listeners: List[OrderListener] = []
+        self._subscription_listeners: List[Callable[[], None]] = []
+        self.ticks_received = 0
+
+    # Lifecycle
+
+    def start(self, access_token: str) -> None:
+        """Connect upstream unless already connected
+
+        Ticks are the same for every user, so whichever session starts the
+        bridge carries the stream for all of them. Order updates on the
+        connection are only those of that session's user.
+        """
+        if not access_token or self._ticker is not None:
+            return
+        self.stop()
+        self._loop = asyncio.get_running_loop()
+        self._access_token = access_token
+        ticker = self._ticker_factory(self.api_key, access_token)
+        ticker.on_connect = self._on_connect
+        ticker.on_ticks = self._on_ticks
+        ticker.on_order_update = self._on_order_update
+        ticker.on_close = self._on_close
+        ticker.on_error = self._on_error
+        self._ticker = ticker
+        ticker.connect(threaded=True)
+        logger.info("Started upstream ticker")
+
+    def stop(self) -> None:
+        """Close the upstream connection"""
+        ticker, self._ticker = self._ticker, None
+        self._access_token = None
+        if ticker is not None:
+            try:
+                _call_in_reactor(ticker.close)
+            except Exception as e:
+                logger.warning(f"Error closing ticker: {str(e)}")
+            logger.info("Stopped upstream ticker")
+
+    @property
+    def connected(self) -> bool:
+        return self._ticker is not None and self._ticker.is_connected()
+
+    @property
+    def access_token(self) -> Optional[str]:
+        """Token the upstream connection was opened with"""
+        return self._access_token
+
+    def add_listener(self, listener: TickListener, upstream_only: bool = False) -> None:
+        """Receive ticks; with ``upstream_only``, not those passed to dispatch_ticks"""
+        (self._upstream_listeners if upstream_only else self._listeners).append(listener)
+
+    def remove_listener(self, listener: TickListener) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def add_order_listener(self, listener: OrderListener, upstream_only: bool = False) -> None:
+        """Receive order updates pushed on the ticker connection"""
+        (self._upstream_order_listeners if upstream_only else self._order_listeners).append(listener)
+
+    def add_subscription_listener(self, listener: Callable[[], None]) -> None:
+        """Called whenever the set of subscribed tokens or their modes changes"""
+        self._subscription_listeners.append(listener)
+
+    # Subscriptions
+
+    def subscribe(self, client: Any, tokens: Iterable[int], mode: Optional[str] = None) -> None:
+        """Add tokens to a client's subscription in the given mode"""
+        mode = mode or self.mode
+        if mode not in MODES:
+            raise ValueError(f"Invalid mode: {mode}")
+        added, changed = [], []
+        with self._lock:
+            current = self._subscriptions.setdefault(client, {})
+            for token in set(tokens):
+                previous = current.get(token)
+                if previous == mode:
+                    continue
+                before = self._upstream_mode(token)
+                if previous is not None:
+                    self._release(token, previous)
+                current[token] = mode
+                counts = self._mode_counts.setdefault(token, {})
+                counts[mode] = counts.get(mode, 0) + 1
+                if before is None:
+                    added.append(token)
+                elif self._upstream_mode(token) != before:
+                    changed.append(token)
+        if added:
+            self._upstream("subscribe", added)
+        if changed:
+            self._upstream("set_mode", changed)
+        if added or changed:
+            self._subscriptions_changed()
+
+    def unsubscribe(self, client: Any, tokens: Optional[Iterable[int]] = None) -> None:
+        """Remove tokens (or all of them) from a client's subscription"""
+        removed, changed = [], []
+        with self._lock:
+            current = self._subscriptions.get(client, {})
+            targets = list(current) if tokens is None else [t for t in set(tokens) if t in current]
+            for token in targets:
+                before = self._upstream_mode(token)
+                self._release(token, current.pop(token))
+                after = self._upstream_mode(token)
+                if after is None:
+                    removed.append(token)
+                elif after != before:
+                    changed.append(token)
+            if not current:
+                self._subscriptions.pop(client, None)
+        if removed:
+            self._upstream("unsubscribe", removed)
+        if changed:
+            self._upstream("set_mode", changed)
+        if removed or changed:
+            self._subscriptions_changed()
+
+    def set_tokens(self, client: Any, modes: Dict[int, str]) -> None:
+        """Replace a client's subscription with the given token -> mode map"""
+        current = self.tokens_for(client)
+        stale = [token for token in current if token not in modes]
+        if stale:
+            self.unsubscribe(client, stale)
+        by_mode: Dict[str, List[int]] = {}
+        for token, mode in modes.items():
+            if current.get(token) != mode:
+                by_mode.setdefault(mode, []).append(token)
+        for mode, tokens in by_mode.items():
+            self.subscribe(client, tokens, mode)
+
+    def _subscriptions_changed(self) -> None:
+        for listener in self._subscription_listeners:
+            listener()
+
+    def _release(self, token: int, mode: str) -> None:
+        counts = self._mode_counts[token]
+        counts[mode] -= 1
+        if counts[mode] == 0:
+            del counts[mode]
+        if not counts:
+            del self._mode_counts[token]
+            self.last_ticks.pop(token, None)
+
+    def _upstream_mode(self, token: int) -> Optional[str]:
+        """Richest mode any client wants for a token"""
+        counts = self._mode_counts.get(token)
+        if not counts:
+            return None
+        return max(counts, key=MODES.index)
+
+    def tokens_for(self, client: Any) -> Dict[int, str]:
+        """Subscribed tokens of a client mapped to their mode"""
+        return self._subscriptions.get(client, {})
+
+    def clients(self) -> List[Any]:
+        with self._lock:
+            return list(self._subscriptions)
+
+    def subscribed_tokens(self) -> List[int]:
+        with self._lock:
+            return list(self._mode_counts)
+
+    def _upstream_modes(self, tokens: Iterable[int]) -> Dict[str, List[int]]:
+        with self._lock:
+            by_mode: Dict[str, List[int]] = {}
+            for token in tokens:
+                mode = self._upstream_mode(token)
+                if mode is not None:
+                    by_mode.setdefault(mode, []).append(token)
+            return by_mode
+
+    def _upstream(self, action: str, tokens: List[int]) -> None:
+        if not self.connected:
+            # Picked up by _on_connect once the connection is up
+            return
+        ticker = self._ticker
+        try:
+            if action == "unsubscribe":
+                _call_in_reactor(ticker.unsubscribe, tokens)
+            else:
+                _call_in_reactor(
+                    self._subscribe_upstream, ticker, self._upstream_modes(tokens), action == "subscribe"
+                )
+        except Exception as e:
+            logger.error(f"Ticker {action} failed: {str(e)}")
+
+    def _subscribe_upstream(self, ticker, by_mode: Dict[str, List[int]], subscribe: bool = True) -> None:
+        for mode, tokens in by_mode.items():
+            if subscribe:
+                ticker.subscribe(tokens)
+            ticker.set_mode(mode, tokens)
+
+    # Ticker callbacks (run on the reactor thread)
+
+    def _on_connect(self, ws, response) -> None:
+        tokens = self.subscribed_tokens()
+        logger.info(f"Ticker connected, subscribing {len(tokens)} tokens")
+        if tokens:
+            self._subscribe_upstream(ws, self._upstream_modes(tokens))
+
+    def _on_ticks(self, ws, ticks: List[Dict[str, Any]]) -> None:
+        self.ticks_received += len(ticks)
+        logger.debug("Received %d ticks", len(ticks), extra={"ticks": len(ticks)})
+        decoded = [_jsonable(tick) for tick in ticks]
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._dispatch, decoded, True)
+
+    def _on_order_update(self, ws, data: Dict[str, Any]) -> None:
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._dispatch_order, _jsonable(data), True)
+
+    def _on_close(self, ws, code, reason) -> None:
+        logger.warning(f"Ticker connection closed: {code} - {reason}")
+
+    def _on_error(self, ws, code, reason) -> None:
+        logger.error(f"Ticker error: {code} - {reason}")
+
+    def dispatch_ticks(self, ticks: List[Dict[str, Any]]) -> None:
+        """Fan out ticks received from another worker's upstream connection"""
+        self._dispatch(ticks)
+
+    def dispatch_order(self, order: Dict[str, Any]) -> None:
+        """Fan out an order update received other than on this ticker"""
+        self._dispatch_order(order)
+
+    def _dispatch(self, ticks: List[Dict[str, Any]], upstream: bool = False) -> None:
+        metrics.ticks.inc(len(ticks), source="upstream" if upstream else "relayed")
+        for tick in ticks:
+            if tick["instrument_token"] in self._mode_counts:
+                self.last_ticks[tick["instrument_token"]] = tick
+        for listener in self._listeners + (self._upstream_listeners if upstream else []):
+            asyncio.ensure_future(listener(ticks))
+
+    def _dispatch_order(self, order: Dict[str, Any], upstream: bool = False) -> None:
+        for listener in self._order_listeners + (self._upstream_order_listeners if upstream else []):
+            asyncio.ensure_future(listener(order))
@@ -0,0 +1,129 @@
+"""HTTP transport for KiteConnect.
+
+KiteConnect sends every request through ``self.reqsession.request(...)``,
+which by default is a plain ``requests.Session`` that keeps at most 10 idle
+connections. Once more broker threads than that are busy, the extra
+connections are thrown away and each new one pays for a TCP and TLS
+handshake. :func:`create_kite` builds a client whose pool is sized to the
+broker thread pool.
+
+``KITE_TRANSPORT`` selects the implementation:
+
+``httpx`` (default)
+    A shared, thread-safe ``httpx.Client`` with keep-alive, connect/read
+    timeouts, one SSL context for every connection and optional HTTP/2
+    (``KITE_HTTP2=1``, needs ``httpx[http2]``). Its errors are raised as the
+    ``requests`` exceptions KiteConnect documents.
+``requests``
+    The library's own session with a sized ``HTTPAdapter`` pool.
+"""
+import logging
+import os
+import ssl
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from kiteconnect import KiteConnect
+
+from broker import BROKER_POOL_SIZE
+
+logger = logging.getLogger(__name__)
+
+KITE_TRANSPORT = os.getenv("KITE_TRANSPORT", "httpx")
+KITE_POOL_SIZE = int(os.getenv("KITE_POOL_SIZE", str(BROKER_POOL_SIZE)))
+KITE_KEEPALIVE_SECONDS = float(os.getenv("KITE_KEEPALIVE_SECONDS", "60"))
+KITE_HTTP2 = os.getenv("KITE_HTTP2", "0").lower() in ("1", "true", "yes")
+KITE_CONNECT_TIMEOUT = float(os.getenv("KITE_CONNECT_TIMEOUT", "3"))
+KITE_READ_TIMEOUT = float(os.getenv("KITE_READ_TIMEOUT", "7"))
+
+TRANSPORTS = ("httpx", "requests")
+
+# httpx errors raised as the requests exceptions KiteConnect documents, first
+# match wins
+_ERRORS = (
+    (httpx.ConnectTimeout, requests.exceptions.ConnectTimeout),
+    (httpx.ReadTimeout, requests.exceptions.ReadTimeout),
+    (httpx.TimeoutException, requests.exceptions.Timeout),
+    (httpx.ConnectError, requests.exceptions.ConnectionError),
+    (httpx.TooManyRedirects, requests.exceptions.TooManyRedirects),
+    (httpx.HTTPError, requests.exceptions.RequestException),
+)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class HttpxSession:
+    """``requests.Session``-compatible facade over a pooled ``httpx.Client``"""
+
+    def __init__(self, pool_size: int = KITE_POOL_SIZE, http2: bool = KITE_HTTP2,
+                 keepalive: float = KITE_KEEPALIVE_SECONDS, connect_timeout: float = KITE_CONNECT_TIMEOUT,
+                 read_timeout: float = KITE_READ_TIMEOUT, verify: bool = True, proxy: Optional[str] = None,
+                 transport: Optional[httpx.BaseTransport] = None):
+        if http2 and not _http2_available():
+            logger.warning("KITE_HTTP2 is set but the h2 package is missing, using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        # One context for every connection, so TLS setup is done once
+        context = ssl.create_default_context() if verify else False
+        self.client = httpx.Client(
+            http2=http2,
+            verify=context,
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=keepalive,
+            ),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            proxy=proxy,
+            transport=transport,
+        )
+
+    def request(self, method: str, url: str, json: Any = None, data: Any = None,
+                params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None,
+                verify: bool = True, allow_redirects: bool = True, timeout: Any = None,
+                proxies: Optional[Dict[str, str]] = None) -> httpx.Response:
+        # verify and proxies are fixed when the client is built; the client's
+        # connect/read timeouts replace KiteConnect's single timeout
+        try:
+            return self.client.request(
+                method, url, json=json, data=data, params=params, headers=headers,
+                follow_redirects=allow_redirects,
+            )
+        except httpx.HTTPError as e:
+            for source, target in _ERRORS:
+                if isinstance(e, source):
+                    raise target(str(e)) from e
+            raise
+
+    def close(self) -> None:
+        self.client.close()
+
+
+def create_kite(api_key: str, transport: str = KITE_TRANSPORT, **kwargs) -> KiteConnect:
+    """KiteConnect client using the configured transport"""
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Invalid transport: {transport}")
+    if transport == "requests":
+        kite = KiteConnect(api_key=api_key, timeout=KITE_READ_TIMEOUT, **kwargs)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=KITE_POOL_SIZE, pool_maxsize=KITE_POOL_SIZE)
+        for prefix in ("https://", "http://"):
+            kite.reqsession.mount(prefix, adapter)
+        return kite
+    kite = KiteConnect(api_key=api_key, timeout=KITE_READ_TIMEOUT, **kwargs)
+    kite.reqsession = HttpxSession(verify=not kite.disable_ssl, proxy=kite.proxies.get("https"))
+    logger.info(f"Kite transport: httpx, pool={KITE_POOL_SIZE}, http2={kite.reqsession.http2}")
+    return kite
+
+
+def close(kite: KiteConnect) -> None:
+    """Release the client's pooled connections"""
+    session = getattr(kite, "reqsession", None)
+    if session is not None:
+        session.close()